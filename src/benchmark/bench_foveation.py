@@ -0,0 +1,89 @@
+"""
+フォビエイテッド合成のベンチマーク。
+
+従来の np.where による合成、ROI 合成（blend="hard"）、固定小数点のソフトエッジ合成
+（blend="soft"）を 720p / 1080p / 4K で比較し、1フレームあたりの処理時間を表示する。
+あわせて出力フレームを使い回したときの ROI 合成（hard）の一時メモリのピークを tracemalloc で測り、
+MAX_HARD_PEAK_BYTES を超えたら失敗する（フレームごとのメモリ確保が戻っていないことの確認）。
+
+実行方法:
+    python -m src.benchmark.bench_foveation [--frames 60] [--edge-width 16]
+"""
+import argparse
+import time
+import tracemalloc
+import numpy as np
+from src.server.foveated_compression import FoveatedCompositor, _merge_frame_where
+from src.server.foveation_profile import DEFAULT_PROFILE
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+}
+
+# blend="hard" で out を指定したときに許す1フレームあたりの一時メモリ（バイト）
+MAX_HARD_PEAK_BYTES = 64 * 1024
+
+
+def gaze_path(width, height, count):
+    """画面中央付近から端までを往復する視線の軌跡を生成する。"""
+    t = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    xs = (width / 2 + width * 0.45 * np.cos(t)).astype(int)
+    ys = (height / 2 + height * 0.45 * np.sin(2 * t)).astype(int)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def time_per_frame(merge, frames, path):
+    """merge(frames, x, y) を軌跡に沿って実行し、1フレームあたりの平均時間（ms）を返す。"""
+    merge(frames, *path[0])  # キャッシュ作成分を除外するためのウォームアップ
+    start = time.perf_counter()
+    for gaze_x, gaze_y in path:
+        merge(frames, gaze_x, gaze_y)
+    return (time.perf_counter() - start) / len(path) * 1000
+
+
+def peak_bytes(merge, frames, path):
+    """ウォームアップ後に merge を軌跡に沿って実行し、tracemalloc で測った一時メモリのピーク（バイト）を返す。"""
+    merge(frames, *path[0])
+    tracemalloc.start()
+    try:
+        for gaze_x, gaze_y in path:
+            merge(frames, gaze_x, gaze_y)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Foveated compositing benchmark")
+    parser.add_argument("--frames", type=int, default=60, help="計測するフレーム数")
+    parser.add_argument("--edge-width", type=int, default=16, help="ソフトエッジの円環の幅")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    radii = DEFAULT_PROFILE.radii
+    hard = FoveatedCompositor(radii, blend="hard")
+    soft = FoveatedCompositor(radii, blend="soft", edge_width=args.edge_width)
+
+    print(f"{'resolution':>10} {'np.where':>10} {'roi hard':>10} {'roi soft':>10} {'soft/where':>11} {'hard peak':>10}")
+    for name, (width, height) in RESOLUTIONS.items():
+        frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(3)]
+        path = gaze_path(width, height, args.frames)
+        out = np.empty_like(frames[0])
+
+        where_ms = time_per_frame(lambda f, x, y: _merge_frame_where(f[0], f[1], f[2], x, y), frames, path)
+        hard_ms = time_per_frame(lambda f, x, y: hard.composite(f, x, y, out=out), frames, path)
+        soft_ms = time_per_frame(lambda f, x, y: soft.composite(f, x, y, out=out), frames, path)
+
+        hard_peak = peak_bytes(lambda f, x, y: hard.composite(f, x, y, out=out), frames, path)
+
+        print(f"{name:>10} {where_ms:>8.2f}ms {hard_ms:>8.2f}ms {soft_ms:>8.2f}ms {soft_ms / where_ms:>10.2f}x "
+              f"{hard_peak / 1024:>8.1f}KB")
+        assert hard_peak <= MAX_HARD_PEAK_BYTES, \
+            f"ROI compositing into out allocated {hard_peak} bytes per run at {name} (limit {MAX_HARD_PEAK_BYTES})"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+フレーム取得元のベンチマーク。
+
+cv2.VideoCapture.read() と RawVideoPipe（ffmpeg の rawvideo パイプを readinto で
+事前確保した配列に読み込む）を 1080p の動画で比較し、1フレームあたりの時間を表示する。
+入力動画を指定しない場合は ffmpeg の testsrc2 で 1080p のH.264動画を生成して使う。
+
+実行方法:
+    python -m src.benchmark.bench_frame_source [--input video.mp4] [--frames 300] [--threads 0]
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from src.server.frame_source import open_frame_source
+
+
+def make_test_clip(path, frames, width=1920, height=1080, fps=30):
+    """ffmpeg の testsrc2 から H.264 のテスト動画を生成する。"""
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}",
+        "-frames:v", str(frames),
+        "-c:v", "libx264", "-preset", "fast", "-pix_fmt", "yuv420p",
+        path
+    ]
+    subprocess.run(command, check=True)
+
+
+def time_source(input_video, backend, frames, reuse, threads=0):
+    """フレーム取得元から frames 枚読み込み、(読み込んだ枚数, 1フレームあたりの時間 ms) を返す。"""
+    source = open_frame_source(input_video, backend=backend, threads=threads)
+    frame = None
+    count = 0
+    start = time.perf_counter()
+    while count < frames:
+        ret, frame = source.read(frame) if reuse else source.read()
+        if not ret:
+            break
+        count += 1
+    elapsed = time.perf_counter() - start
+    source.release()
+    return count, elapsed / max(count, 1) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame source benchmark")
+    parser.add_argument("--input", help="1080p の入力動画（省略時は testsrc2 から生成）")
+    parser.add_argument("--frames", type=int, default=300, help="読み込むフレーム数")
+    parser.add_argument("--threads", type=int, default=0, help="ffmpeg デコーダのスレッド数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_video = args.input
+        if input_video is None:
+            input_video = os.path.join(temp_dir, "bench_1080p.mp4")
+            print(f"Generating test clip: {input_video}")
+            make_test_clip(input_video, args.frames)
+
+        cases = [
+            ("cv2.VideoCapture", "opencv", False),
+            ("cv2.VideoCapture (read into buffer)", "opencv", True),
+            ("RawVideoPipe (readinto)", "ffmpeg", True),
+        ]
+        for name, backend, reuse in cases:
+            count, ms = time_source(input_video, backend, args.frames, reuse, threads=args.threads)
+            print(f"{name:>38}: {ms:7.2f} ms/frame ({1000 / ms:6.1f} fps, {count} frames)")
+
+
+if __name__ == "__main__":
+    main()
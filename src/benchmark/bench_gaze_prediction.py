@@ -0,0 +1,134 @@
+"""
+視線予測（GazeEstimator.generate_gaze_position）のベンチマーク。
+
+候補座標ごとに compute_total_cost を呼ぶ従来の方法と、全候補を NumPy でまとめて計算する
+compute_total_costs を、解像度とグリッド間隔を変えて比較する。後者は境界コストの静的なフィールドを
+キャッシュした場合（vector）と、毎フレーム作り直した場合（no field）の両方を測る。同じ乱数で作った
+障害物と視線の軌跡に沿って実行し、選ばれた候補が一致するかも確認する。
+
+続けて search_mode="hierarchical"（粗いグリッドから段階的に細かくする探索）の1フレームあたりの
+時間と、細かい固定グリッド（--reference-step）の最適解からの距離を表示する。
+
+実行方法:
+    python -m src.benchmark.bench_gaze_prediction [--frames 30] [--steps 100,50,20] [--tolerance 1]
+"""
+import argparse
+import random
+import time
+import numpy as np
+from src.server.gaze_prediction import GazeEstimator
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+}
+
+
+def boundary_points_for(width, height):
+    """VideoStreaming と同じ画面の四隅付近の境界点。"""
+    return [(50, 50), (width - 50, 50), (50, height - 50), (width - 50, height - 50)]
+
+
+def scalar_best_position(estimator, last_gaze_position, boundary_points, obstacle_points, current_vector):
+    """従来の実装と同じく、候補を1つずつ compute_total_cost で評価して最小コストの候補を返す。"""
+    min_cost = float("inf")
+    best_position = None
+    for x, y in estimator.candidate_positions().astype(int).tolist():
+        cost = estimator.compute_total_cost(
+            last_gaze_position, (x, y), boundary_points, obstacle_points, current_vector
+        )
+        if cost < min_cost:
+            min_cost = cost
+            best_position = (x, y)
+    return best_position
+
+
+def vector_best_position(estimator, last_gaze_position, boundary_points, obstacle_points, current_vector):
+    costs = estimator.compute_total_costs(last_gaze_position, boundary_points, obstacle_points, current_vector)
+    best_x, best_y = estimator.candidate_positions()[np.argmin(costs)]
+    return int(best_x), int(best_y)
+
+
+def uncached_best_position(estimator, last_gaze_position, boundary_points, obstacle_points, current_vector):
+    """静的なコストのキャッシュを毎回破棄して計算する（フレームごとに境界コストも計算していた場合）。"""
+    estimator.invalidate_static_costs()
+    return vector_best_position(estimator, last_gaze_position, boundary_points, obstacle_points, current_vector)
+
+
+def hierarchical_best_position(estimator, last_gaze_position, boundary_points, obstacle_points, current_vector):
+    return estimator.search_hierarchical(last_gaze_position, boundary_points, obstacle_points, current_vector)
+
+
+def make_frames(estimator, count, seed):
+    """10フレームごとに障害物を更新する配信ループと同じ入力（現在位置、障害物）の列を作る。"""
+    random.seed(seed)
+    width, height = estimator.window_width, estimator.window_height
+    frames = []
+    obstacle_points = estimator.generate_random_obstacles()
+    for index in range(count):
+        if index % 10 == 0:
+            obstacle_points = estimator.generate_random_obstacles()
+        position = (random.randint(0, width), random.randint(0, height))
+        frames.append((position, obstacle_points))
+    return frames
+
+
+def time_per_frame(select, estimator, frames, boundary_points, current_vector):
+    """select を各フレームで実行し、(1フレームあたりの時間（µs）, 選ばれた候補のリスト) を返す。"""
+    select(estimator, frames[0][0], boundary_points, frames[0][1], current_vector)  # ウォームアップ
+    results = []
+    start = time.perf_counter()
+    for position, obstacle_points in frames:
+        results.append(select(estimator, position, boundary_points, obstacle_points, current_vector))
+    return (time.perf_counter() - start) / len(frames) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gaze prediction benchmark")
+    parser.add_argument("--frames", type=int, default=30, help="計測するフレーム数")
+    parser.add_argument("--steps", default="100,50,20", help="候補グリッドの間隔（ピクセル、カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=0, help="障害物と視線の軌跡の乱数シード")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="hierarchical の停止条件（ピクセル）")
+    parser.add_argument("--reference-step", type=int, default=2, help="hierarchical の精度を確かめる固定グリッドの間隔")
+    parser.add_argument("--reference-frames", type=int, default=5, help="精度を確かめるフレーム数")
+    args = parser.parse_args()
+
+    current_vector = (1, 0)
+    print(f"{'resolution':>10} {'step':>5} {'candidates':>10} {'scalar us':>11} {'no field us':>12} "
+          f"{'vector us':>10} {'speedup':>8} {'match':>6} {'builds':>7}")
+    for name, (width, height) in RESOLUTIONS.items():
+        boundary_points = boundary_points_for(width, height)
+        for step in (int(s) for s in args.steps.split(",")):
+            estimator = GazeEstimator(width, height)
+            estimator.grid_step = step
+            frames = make_frames(estimator, args.frames, args.seed)
+            scalar_us, expected = time_per_frame(scalar_best_position, estimator, frames, boundary_points, current_vector)
+            uncached_us, _ = time_per_frame(uncached_best_position, estimator, frames, boundary_points, current_vector)
+            builds = estimator.static_field_builds
+            vector_us, actual = time_per_frame(vector_best_position, estimator, frames, boundary_points, current_vector)
+            match = sum(a == b for a, b in zip(expected, actual))
+            print(f"{name:>10} {step:>5} {len(estimator.candidate_positions()):>10} {scalar_us:>11.0f} "
+                  f"{uncached_us:>12.1f} {vector_us:>10.1f} {scalar_us / vector_us:>7.0f}x {match:>3}/{len(frames)} "
+                  f"{estimator.static_field_builds - builds:>7}")
+
+    print()
+    print(f"{'resolution':>10} {'coarse':>7} {'hier us':>9} {'grid 100 us':>12} {'error px (max)':>15}")
+    for name, (width, height) in RESOLUTIONS.items():
+        boundary_points = boundary_points_for(width, height)
+        hierarchical = GazeEstimator(width, height, search_mode="hierarchical", refine_tolerance=args.tolerance)
+        grid = GazeEstimator(width, height)
+        frames = make_frames(hierarchical, args.frames, args.seed)
+        hier_us, found = time_per_frame(hierarchical_best_position, hierarchical, frames, boundary_points, current_vector)
+        grid_us, _ = time_per_frame(vector_best_position, grid, frames, boundary_points, current_vector)
+
+        # 細かい固定グリッドで求めた最適解からの距離
+        reference = GazeEstimator(width, height, grid_step=args.reference_step)
+        errors = []
+        for (position, obstacle_points), (x, y) in list(zip(frames, found))[:args.reference_frames]:
+            expected = vector_best_position(reference, position, boundary_points, obstacle_points, current_vector)
+            errors.append(np.hypot(x - expected[0], y - expected[1]))
+        print(f"{name:>10} {hierarchical.grid_step:>7} {hier_us:>9.1f} {grid_us:>12.1f} {max(errors):>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
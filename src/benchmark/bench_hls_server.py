@@ -0,0 +1,138 @@
+"""
+HLS配信サーバーの負荷試験。
+
+一時ディレクトリにプレイリストとダミーのセグメントを用意し、ローカルの並列クライアント
+（既定 64）がプレイリストとセグメントを交互に取得し続けたときのスループットとレイテンシを測る。
+    legacy   : 従来の socketserver.TCPServer + SimpleHTTPRequestHandler（1スレッド、HTTP/1.0）
+    nocache  : HLSHTTPServer（接続ごとのスレッド、HTTP/1.1 keep-alive、sendfile）、キャッシュなし
+    hls_http : HLSHTTPServer に SegmentCache を付けたもの（温まったセグメントはディスクを読まない）
+クライアントは同じプロセスのスレッドで動くため、CPU 1コアの環境ではクライアント側の負荷も結果に含まれる。
+
+実行方法:
+    python -m src.benchmark.bench_hls_server [--clients 64] [--duration 10] [--segment-kb 256]
+"""
+import argparse
+import http.client
+import http.server
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import numpy as np
+from src.client.hls_http import HLSHTTPServer
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_hls_tree(root, segments, segment_kb):
+    """ダミーのセグメントと、それを並べたメディアプレイリストを作る。"""
+    level_dir = os.path.join(root, "medium")
+    os.makedirs(level_dir, exist_ok=True)
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+    payload = os.urandom(segment_kb * 1024)
+    for index in range(segments):
+        name = f"segment-medium-{index:03d}.ts"
+        with open(os.path.join(level_dir, name), "wb") as f:
+            f.write(payload)
+        lines += ["#EXTINF:2.000000,", name]
+    with open(os.path.join(level_dir, "medium.m3u8"), "w") as f:
+        f.write("\n".join(lines + ["#EXT-X-ENDLIST"]) + "\n")
+
+
+def start_server(kind, root):
+    if kind == "legacy":
+        handler = lambda *args: QuietHandler(*args, directory=root)
+        server = socketserver.TCPServer(("127.0.0.1", 0), handler)
+    elif kind == "nocache":
+        server = HLSHTTPServer(("127.0.0.1", 0), root, log_requests=False, cache_bytes=0)
+    else:
+        server = HLSHTTPServer(("127.0.0.1", 0), root, log_requests=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def client_loop(port, segments, deadline, offset, latencies, counters, lock):
+    """プレイリストとセグメントを交互に取得し、1リクエストごとのレイテンシを記録する。"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    local = []
+    received = 0
+    errors = 0
+    index = offset
+    while time.perf_counter() < deadline:
+        for path in ("/medium/medium.m3u8", f"/medium/segment-medium-{index % segments:03d}.ts"):
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    errors += 1
+                received += len(body)
+                local.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+        index += 1
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        counters["bytes"] += received
+        counters["errors"] += errors
+
+
+def run_load(kind, root, clients, duration, segments):
+    server, thread = start_server(kind, root)
+    port = server.server_address[1]
+    latencies = []
+    counters = {"bytes": 0, "errors": 0}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+    workers = [
+        threading.Thread(target=client_loop, args=(port, segments, deadline, n, latencies, counters, lock))
+        for n in range(clients)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+    latencies = np.array(latencies) * 1000
+    print(f"{kind:>9}: {len(latencies) / elapsed:7.1f} req/s, {counters['bytes'] / elapsed / 1e6:7.1f} MB/s, "
+          f"p50 {np.percentile(latencies, 50):7.1f} ms, p99 {np.percentile(latencies, 99):7.1f} ms, "
+          f"max {latencies.max():7.1f} ms, errors {counters['errors']}")
+    cache = getattr(server, "cache", None)
+    if cache is not None:
+        stats = cache.stats()
+        print(f"{'':>9}  cache: hit rate {stats['hit_rate']:.3f}, hits {stats['hits']}, misses {stats['misses']}, "
+              f"evictions {stats['evictions']}, invalidations {stats['invalidations']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HLS server load test")
+    parser.add_argument("--clients", type=int, default=64, help="並列クライアント数")
+    parser.add_argument("--duration", type=float, default=10.0, help="各サーバーの試験時間（秒）")
+    parser.add_argument("--segments", type=int, default=20, help="セグメント数")
+    parser.add_argument("--segment-kb", type=int, default=256, help="1セグメントのサイズ（KB）")
+    parser.add_argument("--server", choices=["legacy", "nocache", "hls_http", "all"], default="all", help="試験するサーバー")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_hls_tree(root, args.segments, args.segment_kb)
+        kinds = ["legacy", "nocache", "hls_http"] if args.server == "all" else [args.server]
+        print(f"{args.clients} clients, {args.duration:.0f} s, {args.segment_kb} KB segments")
+        for kind in kinds:
+            run_load(kind, root, args.clients, args.duration, args.segments)
+
+
+if __name__ == "__main__":
+    main()
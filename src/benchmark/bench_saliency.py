@@ -0,0 +1,97 @@
+"""
+顕著度予測（SaliencyPredictor）のベンチマーク。
+
+テクスチャのある静止した背景の上を明るい円が動く合成映像を 720p / 1080p / 4K で作り、
+1フレームあたりの update + interest_points の時間と、30fps の予算（33.3 ms）に対する割合を表示する。
+あわせて、顕著点を障害物として渡した視線（gaze_saliency=True と同じ設定）と、ランダムな障害物の
+視線が、動く円からどれだけ離れているかを比べる。
+
+実行方法:
+    python -m src.benchmark.bench_saliency [--frames 120]
+"""
+import argparse
+import random
+import time
+import cv2
+import numpy as np
+from src.server.gaze_prediction import GazeEstimator
+from src.server.gaze_trajectory import default_boundary_points
+from src.server.saliency import SaliencyPredictor, SALIENCY_LAMBDA_E
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+}
+
+
+def moving_object_clip(width, height, count, seed):
+    """背景、ノイズ、円の軌跡を決めた合成映像のフレームと、各フレームの円の中心を返す。"""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+    radius = height // 27
+    frames = []
+    centers = []
+    for index in range(count):
+        t = index / count
+        center = (int(width * (0.15 + 0.7 * t)), int(height * (0.5 + 0.3 * np.sin(4 * np.pi * t))))
+        frame = background.copy()
+        cv2.circle(frame, center, radius, (255, 255, 255), -1)
+        cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8), dst=frame)
+        frames.append(frame)
+        centers.append(center)
+    return frames, centers
+
+
+def gaze_distances(width, height, frames, centers, saliency, seed):
+    """視線予測を配信ループと同じ手順で実行し、円の中心からの距離（最初の1秒を除く）を返す。"""
+    random.seed(seed)
+    estimator = GazeEstimator(width, height)
+    boundary_points = default_boundary_points(width, height)
+    last_gaze_position = (width // 2, height // 2)
+    obstacle_points = estimator.generate_random_obstacles()
+    if saliency is not None:
+        estimator.lambda_e = SALIENCY_LAMBDA_E
+    distances = []
+    for index, (frame, center) in enumerate(zip(frames, centers)):
+        if saliency is not None:
+            saliency.update(frame)
+            obstacle_points = saliency.interest_points()
+        elif index % 10 == 0:
+            obstacle_points = estimator.generate_random_obstacles()
+        last_gaze_position = estimator.generate_gaze_position(
+            last_gaze_position, boundary_points, obstacle_points, (1, 0)
+        )
+        if index >= 30:
+            distances.append(np.hypot(last_gaze_position[0] - center[0], last_gaze_position[1] - center[1]))
+    return np.array(distances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Saliency predictor benchmark")
+    parser.add_argument("--frames", type=int, default=120, help="フレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="合成映像とランダムな障害物の乱数シード")
+    args = parser.parse_args()
+
+    print(f"{'resolution':>10} {'ms/frame':>9} {'p99 ms':>7} {'of 30fps':>9} "
+          f"{'saliency gaze px':>17} {'random gaze px':>15}")
+    for name, (width, height) in RESOLUTIONS.items():
+        frames, centers = moving_object_clip(width, height, args.frames, args.seed)
+
+        predictor = SaliencyPredictor(width, height)
+        times = []
+        for frame in frames:
+            start = time.perf_counter()
+            predictor.update(frame)
+            predictor.interest_points()
+            times.append(time.perf_counter() - start)
+        times = np.array(times[1:]) * 1000
+
+        saliency_px = gaze_distances(width, height, frames, centers, SaliencyPredictor(width, height), args.seed)
+        random_px = gaze_distances(width, height, frames, centers, None, args.seed)
+        print(f"{name:>10} {np.median(times):>9.2f} {np.percentile(times, 99):>7.2f} "
+              f"{np.median(times) / (1000 / 30):>8.0%} {np.median(saliency_px):>17.0f} {np.median(random_px):>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+セグメント出力経路のベンチマーク。
+
+合成フレームをHLSの3画質にするまでの経路を比較し、CPU 1コアあたりのフレーム数（frames/s/core）を表示する。
+    legacy : cv2.VideoWriter（mp4v）→ libx264 で mp4 に再エンコード → HLS用に再エンコード（3回エンコード）
+    mp4    : SegmentWriter で libx264 の mp4 に直接エンコード → HLS用に再エンコード（2回エンコード）
+    direct : HLSSegmentWriter で合成フレームを直接HLSの各画質にエンコード（1回エンコード）
+CPU時間は本プロセスと子プロセス（ffmpeg）の合計で、入力動画のデコードも含む。
+入力動画を指定しない場合は ffmpeg の testsrc2 で 1080p のH.264動画を生成して使う。
+
+実行方法:
+    python -m src.benchmark.bench_segment_pipeline [--input video.mp4] [--frames 300] [--segment-time 2]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import cv2
+from src.benchmark.bench_frame_source import make_test_clip
+from src.server.hls_server import (
+    HLS_RESOLUTIONS, hls_rendition_bitrates, hls_segment_count, reserve_segment_indices, encode_hls_renditions
+)
+from src.server.segment_writer import SegmentWriter, HLSSegmentWriter
+
+VIDEO_BITRATE = "1000k"
+
+
+def cpu_seconds():
+    """本プロセスと終了済みの子プロセスのCPU時間の合計（秒）。"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def read_frames(input_video, frames):
+    """入力動画から frames 枚のフレームを順に返す。"""
+    capture = cv2.VideoCapture(input_video)
+    count = 0
+    while count < frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        yield frame
+        count += 1
+    capture.release()
+
+
+def run_legacy(input_video, frames, work_dir, fps, segment_time):
+    raw_path = os.path.join(work_dir, "segment_raw.mp4")
+    segment_path = os.path.join(work_dir, "segment.mp4")
+    writer = None
+    count = 0
+    for frame in read_frames(input_video, frames):
+        if writer is None:
+            height, width, _ = frame.shape
+            writer = cv2.VideoWriter(raw_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        writer.write(frame)
+        count += 1
+    writer.release()
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-i", raw_path,
+        "-c:v", "libx264", "-preset", "fast",
+        "-b:v", VIDEO_BITRATE, "-maxrate", VIDEO_BITRATE, "-bufsize", "3M", segment_path
+    ], check=True)
+    encode_hls_to(segment_path, work_dir, count, fps, segment_time)
+    return count
+
+
+def run_mp4(input_video, frames, work_dir, fps, segment_time):
+    segment_path = os.path.join(work_dir, "segment.mp4")
+    writer = None
+    for frame in read_frames(input_video, frames):
+        if writer is None:
+            height, width, _ = frame.shape
+            writer = SegmentWriter(segment_path, width, height, fps, VIDEO_BITRATE)
+        writer.write(frame)
+    writer.close()
+    encode_hls_to(segment_path, work_dir, writer.frame_count, fps, segment_time)
+    return writer.frame_count
+
+
+def run_direct(input_video, frames, work_dir, fps, segment_time):
+    output_dir = os.path.join(work_dir, "hls_file")
+    writer = None
+    for frame in read_frames(input_video, frames):
+        if writer is None:
+            height, width, _ = frame.shape
+            levels = list(hls_rendition_bitrates(VIDEO_BITRATE))
+            segment_count = hls_segment_count(frames, fps, segment_time)
+            start_index = reserve_segment_indices(output_dir, levels, segment_count, segment_time)
+            writer = HLSSegmentWriter(output_dir, HLS_RESOLUTIONS, width, height, fps, VIDEO_BITRATE,
+                                      start_index, segment_count, segment_time)
+        writer.write(frame)
+    writer.close()
+    return writer.frame_count
+
+
+def encode_hls_to(segment_path, work_dir, frame_count, fps, segment_time):
+    output_dir = os.path.join(work_dir, "hls_file")
+    levels = list(hls_rendition_bitrates(VIDEO_BITRATE))
+    start_index = reserve_segment_indices(output_dir, levels, hls_segment_count(frame_count, fps, segment_time),
+                                          segment_time)
+    encode_hls_renditions(segment_path, output_dir, HLS_RESOLUTIONS, VIDEO_BITRATE, start_index, segment_time, fps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment pipeline benchmark")
+    parser.add_argument("--input", help="1080p の入力動画（省略時は testsrc2 から生成）")
+    parser.add_argument("--frames", type=int, default=300, help="エンコードするフレーム数")
+    parser.add_argument("--segment-time", type=int, default=2, help="HLSセグメントの時間（秒）")
+    parser.add_argument("--fps", type=int, default=30, help="フレームレート")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_video = args.input
+        if input_video is None:
+            input_video = os.path.join(temp_dir, "bench_1080p.mp4")
+            print(f"Generating test clip: {input_video}")
+            make_test_clip(input_video, args.frames, fps=args.fps)
+
+        cases = [
+            ("legacy (mp4v + x264 + HLS)", run_legacy),
+            ("mp4 (x264 + HLS)", run_mp4),
+            ("direct (HLS)", run_direct),
+        ]
+        for name, run in cases:
+            work_dir = tempfile.mkdtemp(dir=temp_dir)
+            cpu_start = cpu_seconds()
+            wall_start = time.perf_counter()
+            count = run(input_video, args.frames, work_dir, args.fps, args.segment_time)
+            wall = time.perf_counter() - wall_start
+            cpu = cpu_seconds() - cpu_start
+            print(f"{name:>28}: {count / cpu:6.1f} frames/s/core ({count} frames, cpu {cpu:6.1f} s, wall {wall:6.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
-import time
-from src.client.hls_client import serve_hls
+from src.client.hls_client import PlaybackServer
 
 class VideoPlayback:
     def __init__(self, hls_dir):
@@ -16,14 +15,14 @@ class VideoPlayback:
         Args:
             duration (float): Time in seconds to keep the playback running.
         """
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            serve_hls(
-                output_directory=self.output_dir,
-                html_template_path="src/client/playback/hls_template.html",
-                html_file_path=self.html_file,
-                m3u8_url=self.m3u8_playlist_url
-            )
+        # The server starts once and stops when the duration elapses or on SIGINT/SIGTERM
+        server = PlaybackServer(
+            output_directory=self.output_dir,
+            html_template_path="src/client/playback/hls_template.html",
+            html_file_path=self.html_file,
+            m3u8_url=self.m3u8_playlist_url
+        )
+        server.serve(duration)
         print("Playback duration completed. Stopping the server.")
 
 def start_video_playback(hls_dir, fps, input_frame):
@@ -0,0 +1,97 @@
+"""
+Background writer for the playback events posted to /log_event.
+
+The request handler only parses the posted batch and puts it on an in-memory queue;
+EventWriter's thread drains everything that has accumulated and appends it to the log
+with a single VideoLogger.log_events call, so file I/O never runs on the thread that
+serves segments.
+"""
+import queue
+import threading
+from datetime import datetime
+
+# Events held in memory before new batches are dropped
+DEFAULT_MAX_PENDING = 100000
+
+_STOP = object()
+
+
+class EventWriter:
+    def __init__(self, logger, max_pending=DEFAULT_MAX_PENDING):
+        """
+        Args:
+            logger (VideoLogger): Destination of the events.
+            max_pending (int): Maximum number of queued events; further batches are dropped and counted.
+        """
+        self.logger = logger
+        self.max_pending = max_pending
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._pending = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, events):
+        """
+        Queue a batch of events without blocking. Each event is stamped with the receive time.
+
+        Args:
+            events (list): Event dictionaries from one request.
+
+        Returns:
+            bool: False if the batch was dropped because the queue is full.
+        """
+        received_at = datetime.now().isoformat()
+        stamped = [{"time": received_at, **event} for event in events]
+        with self._lock:
+            self.received += len(stamped)
+            if self._pending + len(stamped) > self.max_pending:
+                self.dropped += len(stamped)
+                return False
+            self._pending += len(stamped)
+        self._queue.put(stamped)
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = self._queue.get()
+            if batch is _STOP:
+                break
+            events = list(batch)
+            # Drain everything that arrived meanwhile into the same write
+            while True:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is _STOP:
+                    stopping = True
+                    break
+                events.extend(batch)
+            try:
+                self.logger.log_events(events)
+                self.written += len(events)
+                self.batches += 1
+            except Exception as e:
+                print(f"Error writing playback events: {e}")
+            with self._lock:
+                self._pending -= len(events)
+
+    def close(self):
+        """Write the queued events and stop the thread. Safe to call twice."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
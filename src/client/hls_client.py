@@ -1,11 +1,138 @@
-import http.server
-import socketserver
 import webbrowser
 import os
-import json
+import signal
+import threading
+import time
+from src.client.hls_http import HLSHTTPServer
 from src.client.playback.logger import VideoLogger
 
-def serve_hls(output_directory, html_template_path, html_file_path, m3u8_url):
+class PlaybackServer:
+    def __init__(self, output_directory, html_template_path, html_file_path, m3u8_url, port=8080,
+                 open_browser=True, log_dir="logs/video_streaming", log_requests=True):
+        """
+        Long-lived HLS playback server: renders the player page once, serves output_directory
+        on a background thread and stops on stop(), a duration or SIGINT/SIGTERM.
+
+        The process working directory is never changed; files are served from output_directory.
+
+        Args:
+            output_directory (str): Directory containing the HLS files.
+            html_template_path (str): Path to the HTML template file.
+            html_file_path (str): Path to save the final HTML file (inside output_directory).
+            m3u8_url (str): URL to the playlist file (playlist.m3u8).
+            port (int): Port to listen on; 0 picks a free port.
+            open_browser (bool): Open the player page in the browser after startup.
+            log_dir (str): Directory for the VideoLogger that records /log_event posts.
+            log_requests (bool): Print one access-log line per request.
+        """
+        self.output_directory = output_directory
+        self.html_template_path = html_template_path
+        self.html_file_path = html_file_path
+        self.m3u8_url = m3u8_url
+        self.port = port
+        self.open_browser = open_browser
+        self.log_dir = log_dir
+        self.log_requests = log_requests
+
+        self.logger = None
+        self.httpd = None
+        self.startup_time = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.port}/{os.path.basename(self.html_file_path)}"
+
+    def _render_page(self):
+        with open(self.html_template_path, "r") as template_file:
+            html_content = template_file.read()
+        html_content = html_content.replace("{m3u8_url}", self.m3u8_url)
+        os.makedirs(os.path.dirname(self.html_file_path), exist_ok=True)
+        with open(self.html_file_path, "w") as html_file:
+            html_file.write(html_content)
+
+    def start(self):
+        """
+        Render the page, bind the port and start serving in a background thread.
+
+        Returns:
+            float: Startup time in seconds (until the server accepts connections).
+        """
+        if self.httpd is not None:
+            return self.startup_time
+        started_at = time.perf_counter()
+        self.logger = VideoLogger(log_dir=self.log_dir)
+        self._render_page()
+        # One thread per connection, HTTP/1.1 keep-alive, sendfile for file bodies
+        self.httpd = HLSHTTPServer(("", self.port), self.output_directory, logger=self.logger,
+                                   log_requests=self.log_requests)
+        self.port = self.httpd.server_address[1]
+        # A short poll interval lets stop() return promptly
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05},
+                                        name="hls-playback-server", daemon=True)
+        self._thread.start()
+        self.startup_time = time.perf_counter() - started_at
+
+        print(f"Serving HLS files at {self.url} (startup {self.startup_time * 1000:.1f} ms)")
+        if self.open_browser:
+            # Launching the browser can take longer than the whole startup; do not wait for it
+            threading.Thread(target=webbrowser.open, args=(self.url,), daemon=True).start()
+        return self.startup_time
+
+    def wait(self, duration=None):
+        """
+        Block until stop() is called or duration seconds have passed.
+
+        Returns:
+            bool: True if the server was stopped, False if the duration elapsed first.
+        """
+        return self._stopped.wait(duration)
+
+    def stop(self):
+        """Stop accepting connections and release the port; in-flight responses finish on their own threads. Safe to call twice."""
+        self._stopped.set()
+        if self.httpd is None:
+            return
+        httpd, self.httpd = self.httpd, None
+        httpd.shutdown()
+        httpd.server_close()
+        self._thread.join()
+        if httpd.cache is not None:
+            print(f"Segment cache: {httpd.cache.stats()}")
+        if httpd.events is not None:
+            print(f"Playback events: {httpd.events.stats()}")
+        print("Server stopped.")
+
+    def serve(self, duration=None):
+        """
+        Start the server and keep it running until duration elapses or SIGINT/SIGTERM arrives.
+
+        Args:
+            duration (float, optional): Time in seconds to serve; None serves until a signal.
+        """
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: self._stopped.set())
+        try:
+            self.start()
+            print("Press Ctrl+C to stop the server.")
+            self.wait(duration)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def serve_hls(output_directory, html_template_path, html_file_path, m3u8_url, duration=None):
     """
     Serve HLS video and open it in Chrome, with real-time logging.
 
@@ -14,62 +141,6 @@ def serve_hls(output_directory, html_template_path, html_file_path, m3u8_url):
         html_template_path (str): Path to the HTML template file.
         html_file_path (str): Path to save the final HTML file.
         m3u8_url (str): URL to the playlist file (playlist.m3u8).
+        duration (float, optional): Time in seconds to serve; None serves until Ctrl+C.
     """
-    # Initialize the logger
-    logger = VideoLogger(log_dir="logs/video_streaming")
-
-    # Load HTML template
-    with open(html_template_path, "r") as template_file:
-        html_content = template_file.read()
-
-    # Replace placeholder with dynamic values
-    html_content = html_content.replace("{m3u8_url}", m3u8_url)
-
-    # Save the final HTML file
-    os.makedirs(os.path.dirname(html_file_path), exist_ok=True)
-    with open(html_file_path, "w") as html_file:
-        html_file.write(html_content)
-
-    # Start HTTP server with custom handler
-    os.chdir(output_directory)
-    port = 8080
-
-    class LoggingHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-        def do_GET(self):
-            try:
-                super().do_GET()
-            except ConnectionAbortedError:
-                print("Connection was aborted by the client.")
-            except Exception as e:
-                print(f"Unexpected error in GET request: {e}")
-
-        def do_POST(self):
-            try:
-                if self.path == "/log_event":
-                    try:
-                        content_length = int(self.headers['Content-Length'])
-                        post_data = self.rfile.read(content_length)
-                        event_data = json.loads(post_data)
-                        logger.log_event(event_data)
-                        self.send_response(200)
-                        self.end_headers()
-                    except Exception as e:
-                        print(f"Error handling POST request: {e}")
-                        self.send_response(500)
-                        self.end_headers()
-            except ConnectionResetError:
-                print("Connection reset by the client.")
-            except Exception as e:
-                print(f"Error in POST request: {e}")
-
-    try:
-        server_url = f"http://localhost:{port}/{os.path.basename(html_file_path)}"
-        print(f"Serving at {server_url}")
-        webbrowser.open(server_url)
-
-        with socketserver.TCPServer(("", port), LoggingHTTPRequestHandler) as httpd:
-            print(f"Serving HLS files at port {port}")
-            print("Press Ctrl+C to stop the server.")
-            httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("Server stopped.")
+    PlaybackServer(output_directory, html_template_path, html_file_path, m3u8_url).serve(duration)
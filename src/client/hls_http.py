@@ -0,0 +1,350 @@
+"""
+HTTP/1.1 server for the HLS output.
+
+HLSHTTPServer handles every connection on its own thread, so a slow viewer, a held
+LL-HLS blocking reload or a /log_event POST never delays other downloads. HLSRequestHandler
+keeps connections alive between requests, sends file bodies with socket.sendfile (zero-copy
+where the OS supports it), answers Range requests with 206 and If-None-Match with 304, and
+sets Cache-Control so that playlists are always revalidated while segments, whose URIs
+are unique per run, are cached as immutable.
+Recently served files are kept in a SegmentCache, so warm segments are sent from memory.
+Events posted to /log_event (a JSON object, a JSON array or NDJSON) are queued to an
+EventWriter and written to the log by a background thread.
+"""
+import http.server
+import json
+import os
+import time
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs
+from src.client.event_writer import EventWriter
+from src.client.segment_cache import SegmentCache, DEFAULT_CACHE_BYTES
+from src.server.playlist_manager import add_publish_listener, remove_publish_listener
+
+# Longest time a blocking playlist reload is held before answering 503 (seconds)
+BLOCKING_RELOAD_TIMEOUT = 6.0
+# Interval between playlist checks while a blocking reload is held (seconds)
+BLOCKING_RELOAD_POLL = 0.01
+
+# Playlists change whenever a segment is published, so clients must revalidate every time
+# (also used for the other non-segment files such as the player page)
+PLAYLIST_CACHE_CONTROL = "no-cache"
+# Segment and part URIs carry the run ID (PlaylistManager.segment_name) and a published
+# file is never rewritten, so a URI always names the same bytes and can be cached for good
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Largest accepted /log_event body (bytes)
+MAX_EVENT_BODY = 1024 * 1024
+
+
+def is_segment(path):
+    """Whether path is a media segment or part, whose URI names the same bytes for good."""
+    return path.endswith(".ts")
+
+
+def playlist_position(text):
+    """
+    Find how far a media playlist has progressed.
+
+    Args:
+        text (str): Contents of a media playlist.
+
+    Returns:
+        tuple: (next_msn, parts, ended) where next_msn is the media sequence number of the
+        first segment not yet listed, parts is the number of partial segments already listed
+        for it, and ended is True when the playlist has #EXT-X-ENDLIST.
+    """
+    media_sequence = 0
+    segments = 0
+    parts = 0
+    ended = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-PART:"):
+            parts += 1
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            segments += 1
+            parts = 0
+    return media_sequence + segments, parts, ended
+
+
+def wait_for_playlist(playlist_path, msn, part=None, timeout=BLOCKING_RELOAD_TIMEOUT, poll=BLOCKING_RELOAD_POLL):
+    """
+    Block until a media playlist contains segment msn (or partial segment part of it).
+
+    Implements the server side of LL-HLS blocking playlist reload (_HLS_msn / _HLS_part).
+    The playlist is re-read whenever its modification time changes; the server writes it
+    atomically, so a partially written file is never parsed.
+
+    Args:
+        playlist_path (str): Path of the media playlist on disk.
+        msn (int): Requested media sequence number.
+        part (int, optional): Requested partial segment index within msn.
+        timeout (float): Maximum time to wait in seconds.
+        poll (float): Interval between checks in seconds.
+
+    Returns:
+        bool: True if the playlist satisfies the request, False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(playlist_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != last_mtime:
+            last_mtime = mtime
+            with open(playlist_path, "r") as f:
+                next_msn, parts, ended = playlist_position(f.read())
+            if ended or msn < next_msn or (part is not None and msn == next_msn and part < parts):
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll)
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single-range Range header.
+
+    Args:
+        header (str): Value of the Range header (e.g. "bytes=0-1023", "bytes=500-", "bytes=-500").
+        size (int): Size of the file in bytes.
+
+    Returns:
+        tuple | None: (start, end) inclusive, or None if the header should be ignored
+        (not a byte range, or several ranges).
+
+    Raises:
+        ValueError: If the range cannot be satisfied (answer 416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(last))
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def parse_events(body):
+    """
+    Parse a /log_event body.
+
+    Args:
+        body (bytes): A JSON object, a JSON array of objects, or newline-delimited JSON objects.
+
+    Returns:
+        list: Event dictionaries.
+
+    Raises:
+        ValueError: If the body is not valid JSON/NDJSON or contains something other than objects.
+    """
+    text = body.decode("utf-8")
+    try:
+        parsed = json.loads(text)
+        events = parsed if isinstance(parsed, list) else [parsed]
+    except json.JSONDecodeError:
+        events = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not all(isinstance(event, dict) for event in events):
+        raise ValueError("Events must be JSON objects")
+    return events
+
+
+class HLSRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    extensions_map = {
+        **http.server.SimpleHTTPRequestHandler.extensions_map,
+        ".m3u8": "application/vnd.apple.mpegurl",
+        ".ts": "video/mp2t",
+    }
+
+    def __init__(self, request, client_address, server):
+        super().__init__(request, client_address, server, directory=server.directory)
+
+    def do_GET(self):
+        self._serve(head_only=False)
+
+    def do_HEAD(self):
+        self._serve(head_only=True)
+
+    def _serve(self, head_only):
+        try:
+            url = urlsplit(self.path)
+            path = self.translate_path(url.path)
+            query = parse_qs(url.query)
+            if url.path.endswith(".m3u8") and "_HLS_msn" in query:
+                # LL-HLS blocking playlist reload: hold the request until the segment/part exists
+                msn = int(query["_HLS_msn"][0])
+                part = int(query["_HLS_part"][0]) if "_HLS_part" in query else None
+                if not wait_for_playlist(path, msn, part):
+                    self.send_error(503, "Requested segment is not available yet")
+                    return
+            self._send_file(path, head_only)
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+            self.close_connection = True
+            print("Connection was aborted by the client.")
+        except Exception as e:
+            self.close_connection = True
+            print(f"Unexpected error in GET request: {e}")
+
+    def _send_file(self, path, head_only):
+        cache = self.server.cache
+        # Segments are invalidated by the publisher; anything else may be rewritten by another
+        # process, so it is revalidated with a stat
+        entry = cache.get(path, revalidate=not is_segment(path)) if cache is not None else None
+        if entry is not None:
+            self._send_content(path, entry.size, entry.mtime_ns, head_only, data=entry.data)
+            return
+
+        if os.path.isdir(path):
+            # index.html / directory listing from SimpleHTTPRequestHandler (never cached)
+            if head_only:
+                super().do_HEAD()
+            else:
+                super().do_GET()
+            return
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if cache is not None and cache.admits(stat.st_size):
+                entry = cache.put(path, f.read(), stat.st_mtime_ns)
+                self._send_content(path, entry.size, entry.mtime_ns, head_only, data=entry.data)
+            else:
+                self._send_content(path, stat.st_size, stat.st_mtime_ns, head_only, file=f)
+
+    def _send_content(self, path, size, mtime_ns, head_only, data=None, file=None):
+        """Send the headers and the (range of the) body from memory (data) or from an open file."""
+        etag = f'"{mtime_ns:x}-{size:x}"'
+        cache_control = SEGMENT_CACHE_CONTROL if is_segment(path) else PLAYLIST_CACHE_CONTROL
+
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header and size > 0:
+            try:
+                byte_range = parse_byte_range(range_header, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+        length = end - start + 1
+
+        self.send_response(status)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime_ns / 1e9, usegmt=True))
+        self.send_header("Cache-Control", cache_control)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        if head_only or length <= 0:
+            return
+        if data is not None:
+            self.wfile.write(memoryview(data)[start:end + 1])
+        else:
+            # Zero-copy from the file to the socket (falls back to send() where unsupported)
+            self.connection.sendfile(file, start, length)
+
+    def do_POST(self):
+        try:
+            if self.path != "/log_event":
+                self.send_error(404, "Unknown endpoint")
+                return
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length > MAX_EVENT_BODY:
+                self.send_error(413, "Event batch too large")
+                return
+            post_data = self.rfile.read(content_length)
+            try:
+                events = parse_events(post_data)
+            except ValueError as e:
+                print(f"Error handling POST request: {e}")
+                self.send_response(400)
+            else:
+                # Queued only; the EventWriter thread writes the log file
+                if self.server.events is not None:
+                    self.server.events.submit(events)
+                self.send_response(202)
+            # Keep-alive clients need an explicit empty body
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        except ConnectionResetError:
+            self.close_connection = True
+            print("Connection reset by the client.")
+        except Exception as e:
+            self.close_connection = True
+            print(f"Error in POST request: {e}")
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+
+class HLSHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, directory, logger=None, log_requests=True, cache_bytes=DEFAULT_CACHE_BYTES):
+        """
+        Threaded HTTP/1.1 server for a directory of HLS files.
+
+        Args:
+            server_address (tuple): (host, port) to bind; port 0 picks a free port.
+            directory (str): Root directory served to clients.
+            logger (VideoLogger, optional): Receives the events posted to /log_event.
+            log_requests (bool): Print one access-log line per request.
+            cache_bytes (int): Budget of the in-memory playlist/segment cache; 0 disables it.
+        """
+        self.directory = os.path.abspath(directory)
+        self.logger = logger
+        self.log_requests = log_requests
+        self.cache = SegmentCache(cache_bytes) if cache_bytes > 0 else None
+        self.events = EventWriter(logger) if logger is not None else None
+        super().__init__(server_address, HLSRequestHandler)
+        if self.cache is not None:
+            # The segment publisher in this process invalidates rewritten playlists and segments
+            add_publish_listener(self.cache.invalidate)
+
+    def server_close(self):
+        super().server_close()
+        if self.events is not None:
+            self.events.close()
+        if self.cache is not None:
+            remove_publish_listener(self.cache.invalidate)
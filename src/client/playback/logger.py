@@ -1,6 +1,12 @@
 import os
 import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+# One gaze sample in the binary gaze log (little-endian, 24 bytes, no padding)
+GAZE_DTYPE = np.dtype([("frame", "<i8"), ("time", "<f8"), ("x", "<f4"), ("y", "<f4")])
 
 class VideoLogger:
     def __init__(self, log_dir):
@@ -51,6 +57,22 @@ class VideoLogger:
             print(f"Error writing to log file: {e}")
             raise
 
+    def log_events(self, events):
+        """
+        Log several events with one open/append/close of the log file.
+
+        Args:
+            events (list): Event dictionaries; a "time" key, if present, is kept as the event time.
+        """
+        now = datetime.now().isoformat()
+        lines = [json.dumps({"time": now, **event}) + "\n" for event in events]
+        try:
+            with open(self.log_file_path, "a") as log_file:
+                log_file.writelines(lines)
+        except Exception as e:
+            print(f"Error writing to log file: {e}")
+            raise
+
     def log_gaze_position(self, gaze_x, gaze_y):
         """
         Log gaze position to the log file.
@@ -65,4 +87,141 @@ class VideoLogger:
                 log_file.write(log_entry)
         except Exception as e:
             print(f"Error logging gaze position: {e}")
-            raise
\ No newline at end of file
+            raise
+
+
+def read_gaze_log(path, mmap=True):
+    """
+    Open a binary gaze log written by GazeLogger.
+
+    Args:
+        path (str): Path of the .gaze file.
+        mmap (bool): Memory-map the file instead of reading it into memory.
+
+    Returns:
+        np.ndarray: Records with fields frame, time (perf_counter seconds), x and y.
+        A trailing partial record (e.g. after a crash) is ignored.
+    """
+    count = os.path.getsize(path) // GAZE_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=GAZE_DTYPE)
+    if mmap:
+        return np.memmap(path, dtype=GAZE_DTYPE, mode="r", shape=(count,))
+    return np.fromfile(path, dtype=GAZE_DTYPE, count=count)
+
+
+class GazeLogger:
+    def __init__(self, log_dir, capacity=4096, flush_interval=0.5, text=False):
+        """
+        Record gaze samples without I/O on the frame loop.
+
+        log_gaze_position() stores (frame, perf_counter time, x, y) in a preallocated ring;
+        a background thread appends the filled part of the ring to a binary file of
+        GAZE_DTYPE records (see read_gaze_log) every flush_interval seconds or when the ring
+        is half full. A JSON sidecar records the dtype and the wall-clock time of the start.
+
+        Args:
+            log_dir (str): Base directory; files go to log_dir/<date>/<start time>.gaze.
+            capacity (int): Number of samples held in memory. If the writer falls a whole
+                ring behind, the oldest unwritten samples are dropped (counted in dropped).
+            flush_interval (float): Seconds between background flushes.
+            text (bool): Also write a human-readable .txt log (from the background thread).
+        """
+        if capacity < 2:
+            raise ValueError("The gaze ring needs room for at least two samples")
+        self.log_dir = os.path.abspath(log_dir)
+        started = datetime.now()
+        self.daily_log_dir = os.path.join(self.log_dir, started.strftime("%Y-%m-%d"))
+        os.makedirs(self.daily_log_dir, exist_ok=True)
+        base = os.path.join(self.daily_log_dir, started.strftime("%H-%M-%S"))
+        self.log_file_path = f"{base}.gaze"
+        self.text_file_path = f"{base}.txt" if text else None
+
+        self.started_at = started
+        self.started_perf = time.perf_counter()
+        with open(f"{base}.json", "w") as meta_file:
+            json.dump({
+                "dtype": [(name, GAZE_DTYPE.fields[name][0].str) for name in GAZE_DTYPE.names],
+                "started_at": started.isoformat(),
+                "perf_counter_at_start": self.started_perf,
+            }, meta_file)
+
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._ring = np.zeros(capacity, dtype=GAZE_DTYPE)
+        self._count = 0      # samples recorded (written by the frame loop only)
+        self._flushed = 0    # samples handled by the writer (written by the writer only)
+        self.written = 0
+        self.dropped = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._file = open(self.log_file_path, "wb")
+        self._text_file = open(self.text_file_path, "w") if text else None
+        self._thread = threading.Thread(target=self._run, name="gaze-logger", daemon=True)
+        self._thread.start()
+
+    def log_gaze_position(self, gaze_x, gaze_y, frame_index=None):
+        """
+        Record one gaze sample (no I/O).
+
+        Args:
+            gaze_x (int): X-coordinate of the gaze.
+            gaze_y (int): Y-coordinate of the gaze.
+            frame_index (int, optional): Frame the gaze belongs to; defaults to the sample number.
+        """
+        count = self._count
+        self._ring[count % self.capacity] = (count if frame_index is None else frame_index,
+                                             time.perf_counter(), gaze_x, gaze_y)
+        self._count = count + 1
+        if self._count - self._flushed >= self.capacity // 2:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        end = self._count
+        start = self._flushed
+        if end - start > self.capacity:
+            # The frame loop lapped the writer; those samples are gone
+            self.dropped += end - start - self.capacity
+            start = end - self.capacity
+        if start == end:
+            return
+        first, last = start % self.capacity, end % self.capacity
+        if first < last:
+            batch = self._ring[first:last].copy()
+        else:
+            batch = np.concatenate((self._ring[first:], self._ring[:last]))
+        # Slots overwritten while copying (including one write that may be in progress)
+        overwritten = self._count + 1 - self.capacity - start
+        if overwritten > 0:
+            self.dropped += overwritten
+            batch = batch[overwritten:]
+        self._flushed = end
+
+        self._file.write(batch.tobytes())
+        self._file.flush()
+        self.written += len(batch)
+        if self._text_file is not None:
+            self._text_file.writelines(
+                f"{(self.started_at + timedelta(seconds=float(t) - self.started_perf)).strftime('%H:%M:%S.%f')}"
+                f" frame {int(frame)} - Gaze Position: ({x:g}, {y:g})\n"
+                for frame, t, x, y in batch
+            )
+            self._text_file.flush()
+
+    def close(self):
+        """Write the remaining samples and close the files. Safe to call twice."""
+        if self._thread.is_alive():
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+        if self._text_file is not None and not self._text_file.closed:
+            self._text_file.close()
@@ -0,0 +1,148 @@
+"""
+In-memory cache of playlists and segments for the HLS HTTP server.
+
+Many viewers of one stream request the same few segments, so HLSRequestHandler keeps
+recently served files in a SegmentCache bounded by bytes with LRU eviction. A warm
+segment is served from memory without touching the file system: segment names carry the
+run ID and are never rewritten, and the segment publisher invalidates every file it
+writes through playlist_manager.add_publish_listener. Playlists change on every publish,
+possibly from a publisher in another process that cannot notify this one, so only those
+lookups (get(path, revalidate=True)) are checked with one stat of the file's
+modification time and size.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# Default cache budget in bytes
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class CacheEntry:
+    def __init__(self, data, mtime_ns):
+        """
+        Args:
+            data (bytes): File contents.
+            mtime_ns (int): Modification time of the file when it was read.
+        """
+        self.data = data
+        self.mtime_ns = mtime_ns
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+class SegmentCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, max_entry_bytes=None):
+        """
+        Args:
+            max_bytes (int): Total size of cached file contents before LRU eviction.
+            max_entry_bytes (int, optional): Larger files are served from disk and never cached.
+                Defaults to a quarter of max_bytes.
+        """
+        if max_bytes <= 0:
+            raise ValueError("The segment cache needs a positive byte budget")
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admits(self, size):
+        """Whether a file of this size may be cached."""
+        return size <= self.max_entry_bytes
+
+    def get(self, path, revalidate=False):
+        """
+        Look up a cached file and mark it most recently used.
+
+        Args:
+            path (str): Absolute path of the file.
+            revalidate (bool): Stat the file and drop the entry when it no longer has the
+                cached modification time and size (rewritten, replaced or removed). Without
+                it a hit relies on invalidate() alone and makes no file system call.
+
+        Returns:
+            CacheEntry | None: The cached contents, or None on a miss.
+        """
+        current = None
+        if revalidate:
+            try:
+                stat = os.stat(path)
+                current = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and revalidate and (entry.mtime_ns, entry.size) != current:
+                self._remove(path)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+    def put(self, path, data, mtime_ns):
+        """
+        Cache the contents of a file, evicting the least recently used files to stay within budget.
+
+        Returns:
+            CacheEntry: The new entry.
+        """
+        entry = CacheEntry(data, mtime_ns)
+        if not self.admits(entry.size):
+            return entry
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, path):
+        """Drop a file that has been rewritten (called by the segment publisher)."""
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, path):
+        entry = self._entries.pop(path)
+        self.bytes -= entry.size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count, cached bytes and the hit/miss/eviction/invalidation counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -16,26 +16,317 @@ result=src1×α+src2×β+γ
     ).astype(np.uint8)
 
 よって現在は、条件分岐を使って合成を行っている。
+
+さらに、フレーム全体に対する np.where はマスク2枚と一時配列を毎フレーム確保するため、
+FoveatedCompositor では円形マスクの形状を (半径の組, フレームサイズ) ごとにキャッシュし、
+低解像度フレームを一度コピーした上で、中・高解像度の円の外接矩形（画面端でクリップ）
+だけを上書きする。出力は従来の np.where による合成と画素単位で一致し、
+合成コストはフレーム面積ではなく注視領域の面積に比例する。
+
+境界を滑らかにしたい場合は blend="soft" を指定する。αブレンドを浮動小数点で
+フレーム全体に行う代わりに、各円の境界を挟む幅 edge_width の円環内の画素だけを、
+事前計算した 0〜256 の固定小数点重み（uint16）で整数演算により合成する。
+result = (src_inner × w + src_outer × (256 - w) + 128) >> 8
+
+階層の数と半径・ビットレートは FoveationProfile（foveation_profile.py）で指定する。
+N階層の合成では、最外周の円の外接矩形について各画素の階層番号（uint8）を二乗距離の場から
+一度だけ求め、階層ごとのブールマスク（階層番号 >= k）とともにキャッシュする。合成時は
+内側の階層ごとにその円の外接矩形だけを np.copyto(where=マスク) で出力フレームへ書き込む。
+マスクも出力もスライス（ビュー）しか作らないため、フレームごとの一時的なメモリ確保はない
+（出力フレームを使い回す VideoStreaming(reuse_output_frame=True) の前提）。
+
+周辺の階層はウィンドウより低い解像度（FoveationTier.scale）で保持できる。
+最外周の階層は出力フレームへ直接 cv2.resize で一度だけ拡大し、それより内側の
+低解像度の階層は、合成に必要な外接矩形の範囲だけを cv2.warpAffine で拡大する
+（cv2.resize と同じ座標対応で、丸めによる差は最大1階調）。
 """
 import cv2
 import numpy as np
+from src.server.foveation_profile import DEFAULT_PROFILE
+
+class _TierIndexMap:
+    """
+    最外周の円の外接矩形 (2R+1)x(2R+1) について、各画素が属する階層番号を保持するクラス。
+    階層番号は二乗距離の場 dx²+dy² と各半径の二乗の比較で求める
+    （dx²+dy² <= r² は cv2.circle の整数ラスタライズと一致する）。
+    中心座標の平行移動に対して不変なので、任意の視線位置に切り出して使い回せる。
+    """
+    def __init__(self, radii):
+        self.radius = radii[0]
+        self.radii = tuple(radii)
+        r = self.radius
+        dy, dx = np.ogrid[-r:r + 1, -r:r + 1]
+        distance_sq = dx * dx + dy * dy
+
+        index = np.zeros(distance_sq.shape, dtype=np.uint8)
+        for radius in radii:
+            index += distance_sq <= radius * radius
+        self.index = index
+        # masks[k - 1] は階層 k 以上の画素（np.copyto の where にそのまま渡せるようチャンネル軸付き）
+        self.masks = [(index >= k)[..., np.newaxis] for k in range(1, len(radii) + 1)]
+
+    def clip(self, center_x, center_y, height, width, radius=None):
+        """
+        視線位置を中心とした半径 radius（省略時は最外周）の円の外接矩形をフレーム内にクリップする。
+
+        Returns:
+            Tuple[slice, slice, slice, slice] | None: フレーム側の (y, x) スライスと
+            パッチ側の (y, x) スライス。円がフレーム外に完全に出ている場合は None。
+        """
+        r = self.radius if radius is None else radius
+        y0, y1 = max(center_y - r, 0), min(center_y + r + 1, height)
+        x0, x1 = max(center_x - r, 0), min(center_x + r + 1, width)
+        if y0 >= y1 or x0 >= x1:
+            return None
+        # パッチは最外周の外接矩形なので、内側の円では中心までのずれを足す
+        py = y0 - (center_y - r) + self.radius - r
+        px = x0 - (center_x - r) + self.radius - r
+        return (
+            slice(y0, y1), slice(x0, x1),
+            slice(py, py + y1 - y0), slice(px, px + x1 - x0),
+        )
+
+
+class _EdgeBlend:
+    """
+    半径 r の円の境界を挟む円環（r - edge_width/2 < d < r + edge_width/2）の
+    画素オフセットと固定小数点の重みを保持するクラス。
+    重みは内側の階層に対するもので、0〜256 の uint16 として保持する。
+    """
+    def __init__(self, radius, edge_width, frame_width):
+        self.radius = radius
+        half = edge_width / 2.0
+        reach = int(np.ceil(radius + half))
+        dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+        distance = np.sqrt(dx * dx + dy * dy)
+
+        # 重みの計算はキャッシュ作成時の一度だけ（実行時は整数演算のみ）
+        weight = np.clip(np.rint((radius + half - distance) / edge_width * 256), 0, 256)
+        ring = (weight > 0) & (weight < 256)
+
+        self.reach = reach
+        self.dy = dy[ring].astype(np.int32)
+        self.dx = dx[ring].astype(np.int32)
+        self.offsets = (self.dy.astype(np.int64) * frame_width + self.dx).astype(np.intp)
+        self.weight = weight[ring].astype(np.uint16)[:, np.newaxis]
+        self.inverse_weight = (256 - self.weight).astype(np.uint16)
+
+    def blend(self, combined_frame, frame_inner, frame_outer, center_x, center_y):
+        """円環内の画素を内側・外側の階層から固定小数点で合成して書き込む。"""
+        height, width = combined_frame.shape[:2]
+        r = self.reach
+        weight, inverse_weight = self.weight, self.inverse_weight
+
+        contiguous = all(f.flags.c_contiguous for f in (combined_frame, frame_inner, frame_outer))
+        if contiguous and r <= center_x < width - r and r <= center_y < height - r:
+            # 円環がフレームに収まる場合は平坦化したオフセットをそのまま使う
+            index = self.offsets + (center_y * width + center_x)
+            inner = frame_inner.reshape(-1, frame_inner.shape[-1])[index]
+            outer = frame_outer.reshape(-1, frame_outer.shape[-1])[index]
+            target = combined_frame.reshape(-1, combined_frame.shape[-1])
+        else:
+            ys = self.dy + center_y
+            xs = self.dx + center_x
+            valid = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+            ys, xs = ys[valid], xs[valid]
+            weight, inverse_weight = weight[valid], inverse_weight[valid]
+            index = (ys, xs)
+            inner = frame_inner[index]
+            outer = frame_outer[index]
+            target = combined_frame
+
+        blended = inner.astype(np.uint16)
+        blended *= weight
+        blended += outer * inverse_weight
+        blended += 128
+        blended >>= 8
+        target[index] = blended
+
+
+def _clip_box(center_x, center_y, radius, height, width):
+    """中心と半径から外接矩形をフレーム内にクリップした (y, x) スライス。フレーム外なら None。"""
+    y0, y1 = max(center_y - radius, 0), min(center_y + radius + 1, height)
+    x0, x1 = max(center_x - radius, 0), min(center_x + radius + 1, width)
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return slice(y0, y1), slice(x0, x1)
+
+
+def _upscale_region(src, dst, fy, fx):
+    """
+    低解像度のフレーム src を dst の大きさに拡大したときの (fy, fx) の範囲だけを dst に書き込む。
+    cv2.resize（INTER_LINEAR）と同じ画素中心の対応 src = (dst + 0.5) * scale - 0.5 を使う。
+    """
+    height, width = dst.shape[:2]
+    scale_x = src.shape[1] / width
+    scale_y = src.shape[0] / height
+    matrix = np.array([
+        [scale_x, 0.0, (fx.start + 0.5) * scale_x - 0.5],
+        [0.0, scale_y, (fy.start + 0.5) * scale_y - 0.5],
+    ])
+    cv2.warpAffine(
+        src, matrix, (fx.stop - fx.start, fy.stop - fy.start), dst=dst[fy, fx],
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+class FoveatedCompositor:
+    """
+    外接矩形（ROI）だけを書き換えるフォビエイテッド合成エンジン。
+
+    Args:
+        radii (Sequence[int]): 外側から内側へ並べた各円の半径（例: FoveationProfile.radii）。
+        blend (str): "hard" は境界をそのまま切り替え、"soft" は境界の円環を固定小数点で合成する。
+        edge_width (int): blend="soft" のときの円環の幅（ピクセル、1以上）。
+    """
+    def __init__(self, radii, blend="hard", edge_width=16):
+        if blend not in ("hard", "soft"):
+            raise ValueError(f"Unknown blend mode: {blend}")
+        if int(edge_width) < 1:
+            # 円環の重みは edge_width で割って求めるため、0 以下では計算できない
+            raise ValueError(f"edge_width must be at least 1 pixel, got {edge_width}")
+        self.radii = tuple(int(r) for r in radii)
+        self.blend = blend
+        self.edge_width = int(edge_width)
+        self._geometry_cache = {}
+        self._upscale_buffers = {}
+
+    def geometry(self, height, width):
+        """(半径の組, フレームサイズ) に対応する階層番号のマップをキャッシュから取得する。"""
+        key = (self.radii, height, width)
+        geometry = self._geometry_cache.get(key)
+        if geometry is None:
+            tier_map = _TierIndexMap(self.radii) if self.radii else None
+            edges = None
+            if self.blend == "soft":
+                edges = [_EdgeBlend(r, self.edge_width, width) for r in self.radii]
+            geometry = (tier_map, edges)
+            self._geometry_cache[key] = geometry
+        return geometry
+
+    def _upscale_buffer(self, tier, shape, dtype):
+        """低解像度の階層を拡大する先の出力サイズのバッファ（階層ごとに使い回す）。"""
+        key = (tier, shape, dtype)
+        buffer = self._upscale_buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            self._upscale_buffers[key] = buffer
+        return buffer
+
+    def composite(self, frames, gaze_x, gaze_y, out=None, size=None):
+        """
+        外側の階層から順に重ね合わせたフレームを返す。
+
+        Args:
+            frames (Sequence[np.ndarray]): 外側から内側へ並べた各階層のフレーム（len(radii) + 1 枚）。
+                出力より小さいフレームは出力サイズに拡大して合成する。
+            gaze_x (int): 視線のX座標。
+            gaze_y (int): 視線のY座標。
+            out (np.ndarray, optional): 書き込み先のフレーム。指定時は新たな配列を確保しない。
+            size (Tuple[int, int], optional): 出力の (高さ, 幅)。未指定時は out、なければ最も内側の階層のサイズ。
+
+        Returns:
+            np.ndarray: 合成されたフレーム（out 指定時は out 自身）。
+        """
+        if len(frames) != len(self.radii) + 1:
+            raise ValueError(f"Expected {len(self.radii) + 1} tier frames, got {len(frames)}")
+
+        base = frames[0]
+        if size is None:
+            size = out.shape[:2] if out is not None else frames[-1].shape[:2]
+        height, width = size
+        shape = (height, width) + base.shape[2:]
+        gaze_x, gaze_y = int(gaze_x), int(gaze_y)
+
+        # 最外周のフレームを一度だけコピー（低解像度なら一度だけ拡大）する
+        combined_frame = np.empty(shape, dtype=base.dtype) if out is None else out
+        if base.shape[:2] == (height, width):
+            np.copyto(combined_frame, base)
+        else:
+            cv2.resize(base, (width, height), dst=combined_frame, interpolation=cv2.INTER_LINEAR)
+
+        tier_map, edges = self.geometry(height, width)
+        if tier_map is None:
+            return combined_frame
+
+        # 低解像度の内側の階層は、合成に使う外接矩形（ソフトエッジでは円環の外側まで）だけ拡大する
+        reach = max(edge.reach for edge in edges) if edges is not None else tier_map.radius
+        upscale_region = _clip_box(gaze_x, gaze_y, reach, height, width)
+        tier_frames = list(frames)
+        for tier, frame in enumerate(frames):
+            if frame.shape[:2] == (height, width) or upscale_region is None:
+                continue
+            if tier == 0 and edges is None:
+                # 最外周は拡大済みの出力フレームをそのまま使う
+                tier_frames[0] = combined_frame
+                continue
+            buffer = self._upscale_buffer(tier, shape, frame.dtype)
+            _upscale_region(frame, buffer, *upscale_region)
+            tier_frames[tier] = buffer
 
-low_res_output = "h264_outputs/low_res.mp4"
-med_res_output = "h264_outputs/med_res.mp4"
-high_res_output = "h264_outputs/high_res.mp4"
+        # 外側から順に、各階層の円の外接矩形だけを事前計算したマスクで上書きする（一時配列なし）
+        for tier, (radius, mask) in enumerate(zip(tier_map.radii, tier_map.masks), start=1):
+            region = tier_map.clip(gaze_x, gaze_y, height, width, radius)
+            if region is None:
+                continue
+            fy, fx, my, mx = region
+            np.copyto(combined_frame[fy, fx], tier_frames[tier][fy, fx], where=mask[my, mx])
 
-low_res_bitrate = "700k"
-med_res_bitrate = "1500k"
-high_res_bitrate = "3000k"
+        # 境界の円環だけを外側から順に合成し直す
+        if edges is not None:
+            for frame_outer, frame_inner, edge in zip(tier_frames[:-1], tier_frames[1:], edges):
+                edge.blend(combined_frame, frame_inner, frame_outer, gaze_x, gaze_y)
 
-med_radius = 400
-high_radius = 200
+        return combined_frame
 
-def merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y):
-    global low_res_output, med_res_output, high_res_output
-    global low_res_bitrate, med_res_bitrate, high_res_bitrate
-    global med_radius, high_radius
 
+_compositors = {}
+
+def get_compositor(radii, blend="hard", edge_width=16):
+    """半径の組と合成方法ごとに FoveatedCompositor を使い回す。"""
+    key = (tuple(radii), blend, edge_width)
+    compositor = _compositors.get(key)
+    if compositor is None:
+        compositor = FoveatedCompositor(radii, blend=blend, edge_width=edge_width)
+        _compositors[key] = compositor
+    return compositor
+
+
+def merge_tier_frames(frames, gaze_x, gaze_y, profile=DEFAULT_PROFILE, out=None, blend="hard", size=None):
+    """
+    FoveationProfile の全階層のフレームを視線位置を中心に合成する。
+
+    Args:
+        frames (Sequence[np.ndarray]): 外側から内側へ並べた各階層のフレーム（階層ごとの解像度でよい）。
+        gaze_x (int): 視線のX座標。
+        gaze_y (int): 視線のY座標。
+        profile (FoveationProfile): 階層構成。
+        out (np.ndarray, optional): 書き込み先のフレーム。
+        blend (str): "hard" または "soft"。
+        size (Tuple[int, int], optional): 出力の (高さ, 幅)。
+
+    Returns:
+        np.ndarray: 合成されたフレーム。
+    """
+    # チャンネル数と型の確認（解像度は階層ごとに異なってよい）
+    assert all(frame.shape[2:] == frames[0].shape[2:] and frame.dtype == frames[0].dtype for frame in frames), \
+        "Frame channels must match!"
+
+    compositor = get_compositor(profile.radii, blend=blend)
+    return compositor.composite(frames, gaze_x, gaze_y, out=out, size=size)
+
+
+def merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y, out=None, blend="hard"):
+    # フレームサイズ確認
+    assert frame_med.shape == frame_high.shape == frame_low.shape, "Frame sizes must match!"
+
+    return merge_tier_frames((frame_low, frame_med, frame_high), gaze_x, gaze_y, out=out, blend=blend)
+
+
+def _merge_frame_where(frame_low, frame_med, frame_high, gaze_x, gaze_y):
+    """
+    フレーム全体のマスクと np.where による従来の合成（検証・ベンチマーク用）。
+    """
     # フレームサイズ確認
     height, width, _ = frame_low.shape
     assert frame_med.shape == frame_high.shape == frame_low.shape, "Frame sizes must match!"
@@ -45,6 +336,7 @@ def merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y):
     high_mask = np.zeros((height, width), dtype=np.uint8)
 
     # マスクの作成（円形）
+    med_radius, high_radius = DEFAULT_PROFILE.radii
     cv2.circle(med_mask, (gaze_x, gaze_y), med_radius, 255, -1)
     cv2.circle(high_mask, (gaze_x, gaze_y), high_radius, 255, -1)
 
@@ -58,33 +350,111 @@ def merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y):
     return combined_frame
 
 
-def calculate_segment_bitrate(frame_width, frame_height):
-    global low_res_output, med_res_output, high_res_output
-    global low_res_bitrate, med_res_bitrate, high_res_bitrate
-    global med_radius, high_radius
-
+def calculate_segment_bitrate(frame_width, frame_height, profile=DEFAULT_PROFILE):
     # フレーム全体の面積
     frame_area = frame_width * frame_height
 
-    # 各円の面積
-    high_area = np.pi * high_radius**2
-    med_area = np.pi * med_radius**2
-
-    # 各領域の割合
-    high_ratio = high_area / frame_area
-    med_ratio = (med_area - high_area) / frame_area
-    low_ratio = 1 - high_ratio - med_ratio
-
-    # ビットレートを数値に変換（'k'を除外して数値に変換）
-    low_res_bitrate_num = int(low_res_bitrate.replace("k", ""))
-    med_res_bitrate_num = int(med_res_bitrate.replace("k", ""))
-    high_res_bitrate_num = int(high_res_bitrate.replace("k", ""))
-
-    # 全体ビットレートを計算
-    total_bitrate = (
-        low_ratio * low_res_bitrate_num +
-        med_ratio * med_res_bitrate_num +
-        high_ratio * high_res_bitrate_num
+    # 各円の面積（最外周の階層はフレーム全体）
+    disc_areas = [frame_area] + [np.pi * r**2 for r in profile.radii] + [0]
+
+    # 各階層の割合 × ビットレートで全体ビットレートを計算
+    total_bitrate = sum(
+        (outer - inner) / frame_area * bitrate
+        for outer, inner, bitrate in zip(disc_areas, disc_areas[1:], profile.bitrates_kbps)
     )
 
     return f"{int(total_bitrate)}k"
+
+
+class _DiscAreaTable:
+    """
+    半径 r の円（dx²+dy² <= r²）の積分画像（summed-area table）を保持するクラス。
+    フレーム端でクリップされた円の面積を4回の参照で O(1) に求める。
+    """
+    def __init__(self, radius):
+        self.radius = radius
+        dy, dx = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+        disc = (dx * dx + dy * dy <= radius * radius).astype(np.int64)
+        table = np.zeros((2 * radius + 2, 2 * radius + 2), dtype=np.int64)
+        table[1:, 1:] = disc.cumsum(axis=0).cumsum(axis=1)
+        self.table = table.tolist()
+
+    def area(self, center_x, center_y, height, width):
+        """視線位置を中心とした円のうち、フレーム内に収まる画素数を返す。"""
+        r = self.radius
+        y0, y1 = max(center_y - r, 0), min(center_y + r + 1, height)
+        x0, x1 = max(center_x - r, 0), min(center_x + r + 1, width)
+        if y0 >= y1 or x0 >= x1:
+            return 0
+        # パッチ座標に変換して積分画像を参照
+        py0, py1 = y0 - center_y + r, y1 - center_y + r
+        px0, px1 = x0 - center_x + r, x1 - center_x + r
+        table = self.table
+        return table[py1][px1] - table[py0][px1] - table[py1][px0] + table[py0][px0]
+
+
+_area_tables = {}
+
+def _get_area_table(radius):
+    table = _area_tables.get(radius)
+    if table is None:
+        table = _DiscAreaTable(radius)
+        _area_tables[radius] = table
+    return table
+
+
+class SegmentBitrateMeter:
+    """
+    セグメント内の各フレームの視線位置から、画面端でクリップされた各階層の実面積を
+    積算し、セグメントのビットレートを求めるクラス。1フレームあたり O(階層数)。
+
+    Args:
+        frame_width (int): フレームの幅。
+        frame_height (int): フレームの高さ。
+        profile (FoveationProfile): 階層構成。
+    """
+    def __init__(self, frame_width, frame_height, profile=DEFAULT_PROFILE):
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.profile = profile
+        self._tables = [_get_area_table(r) for r in profile.radii]
+        self._bitrates = profile.bitrates_kbps
+        self.reset()
+
+    def reset(self):
+        """次のセグメントに備えて積算値をクリアする。"""
+        self.frame_count = 0
+        self._weighted_area = 0
+
+    def add(self, gaze_x, gaze_y):
+        """
+        1フレーム分の視線位置を積算する。
+
+        Args:
+            gaze_x (int): 視線のX座標。
+            gaze_y (int): 視線のY座標。
+        """
+        gaze_x, gaze_y = int(gaze_x), int(gaze_y)
+        height, width = self.frame_height, self.frame_width
+
+        # 各円のクリップ後の面積（最外周の階層はフレーム全体）
+        disc_areas = [width * height]
+        disc_areas += [table.area(gaze_x, gaze_y, height, width) for table in self._tables]
+        disc_areas.append(0)
+
+        self._weighted_area += sum(
+            (outer - inner) * bitrate
+            for outer, inner, bitrate in zip(disc_areas, disc_areas[1:], self._bitrates)
+        )
+        self.frame_count += 1
+
+    def bitrate_kbps(self):
+        """積算したフレームの平均ビットレート（kbps）。フレームがない場合は円の面積による概算。"""
+        if self.frame_count == 0:
+            return int(calculate_segment_bitrate(self.frame_width, self.frame_height, self.profile).replace("k", ""))
+        frame_area = self.frame_width * self.frame_height
+        return int(self._weighted_area / (frame_area * self.frame_count))
+
+    def bitrate(self):
+        """セグメントエンコーダに渡すビットレート文字列（例: "984k"）。"""
+        return f"{self.bitrate_kbps()}k"
@@ -0,0 +1,135 @@
+"""
+フォビエイテッド圧縮の階層（tier）構成を表すプロファイル。
+
+各階層は (半径, ビットレート, 縮小率) で記述し、外側（周辺視野）から内側（注視領域）の順に並べる。
+最も外側の階層は画面全体を覆うため半径を持たない（None）。
+従来の低・中・高の3階層は DEFAULT_PROFILE として定義しており、
+4階層・5階層のプロファイルも同じ合成・ビットレート計算・H.264圧縮の経路で扱える。
+
+縮小率はウィンドウに対する幅・高さの倍率で、周辺の階層を実際に低い解像度で
+エンコード・デコードするために使う。MULTI_RESOLUTION_PROFILE では低解像度の階層を
+面積1/4、中解像度の階層を面積およそ1/2で保持する。
+
+compress_video_to_h264・mp4_create・start_video_streaming の profile には FoveationProfile のほか、
+FOVEATION_PROFILES の名前（"default" または "multi_resolution"）を渡せる。
+"""
+
+
+class FoveationTier:
+    def __init__(self, name, radius, bitrate, scale=1.0):
+        """
+        Args:
+            name (str): 階層名（出力ファイル名に使用、例: "low"）。
+            radius (int | None): 注視点を中心とした円の半径。最外周の階層は None。
+            bitrate (str): H.264圧縮時のビットレート（例: "700k"）。
+            scale (float): ウィンドウサイズに対する解像度の縮小率。
+        """
+        self.name = name
+        self.radius = None if radius is None else int(radius)
+        self.bitrate = bitrate
+        self.scale = float(scale)
+
+    def frame_size(self, window_width, window_height):
+        """
+        この階層のフレームサイズ（yuv420p でエンコードできるよう偶数に丸める）。
+
+        Returns:
+            Tuple[int, int]: (幅, 高さ)。
+        """
+        width = max(2, int(round(window_width * self.scale / 2)) * 2)
+        height = max(2, int(round(window_height * self.scale / 2)) * 2)
+        return width, height
+
+    @property
+    def bitrate_kbps(self):
+        """ビットレートを数値（kbps）に変換（'k'を除外）。"""
+        return int(str(self.bitrate).replace("k", ""))
+
+    def __repr__(self):
+        return f"FoveationTier({self.name!r}, radius={self.radius}, bitrate={self.bitrate!r}, scale={self.scale})"
+
+
+class FoveationProfile:
+    def __init__(self, tiers):
+        """
+        Args:
+            tiers (Sequence[FoveationTier]): 外側から内側へ並べた階層。
+        """
+        self.tiers = tuple(tiers)
+        if len(self.tiers) < 1:
+            raise ValueError("A foveation profile needs at least one tier")
+        if self.tiers[0].radius is not None:
+            raise ValueError("The outermost tier covers the whole frame and must not have a radius")
+
+        radii = [tier.radius for tier in self.tiers[1:]]
+        if any(r is None or r <= 0 for r in radii):
+            raise ValueError("Inner tiers need a positive radius")
+        if any(outer <= inner for outer, inner in zip(radii, radii[1:])):
+            raise ValueError("Tier radii must strictly decrease from the outermost to the innermost tier")
+
+    @classmethod
+    def from_tuples(cls, tiers):
+        """
+        (radius, bitrate, scale) のタプル列からプロファイルを作成する。
+
+        Args:
+            tiers (Sequence[tuple]): 外側から内側へ並べた (radius, bitrate, scale)。
+        """
+        return cls([
+            FoveationTier(f"tier{index}", radius, bitrate, scale)
+            for index, (radius, bitrate, scale) in enumerate(tiers)
+        ])
+
+    def __len__(self):
+        return len(self.tiers)
+
+    def __iter__(self):
+        return iter(self.tiers)
+
+    @property
+    def radii(self):
+        """最外周を除く各階層の半径（外側から内側の順）。"""
+        return tuple(tier.radius for tier in self.tiers[1:])
+
+    @property
+    def bitrates_kbps(self):
+        return tuple(tier.bitrate_kbps for tier in self.tiers)
+
+    def __repr__(self):
+        return f"FoveationProfile({list(self.tiers)!r})"
+
+
+DEFAULT_PROFILE = FoveationProfile([
+    FoveationTier("low", None, "700k"),
+    FoveationTier("med", 400, "1500k"),
+    FoveationTier("high", 200, "3000k"),
+])
+
+MULTI_RESOLUTION_PROFILE = FoveationProfile([
+    FoveationTier("low", None, "700k", scale=0.5),
+    FoveationTier("med", 400, "1500k", scale=0.71),
+    FoveationTier("high", 200, "3000k"),
+])
+
+# 名前で選べるプロファイル
+FOVEATION_PROFILES = {
+    "default": DEFAULT_PROFILE,
+    "multi_resolution": MULTI_RESOLUTION_PROFILE,
+}
+
+
+def get_profile(profile):
+    """
+    FoveationProfile またはプロファイル名（FOVEATION_PROFILES のキー）から FoveationProfile を返す。
+
+    Args:
+        profile (FoveationProfile | str): プロファイル、またはその名前。
+
+    Returns:
+        FoveationProfile: 階層構成。
+    """
+    if isinstance(profile, FoveationProfile):
+        return profile
+    if profile not in FOVEATION_PROFILES:
+        raise ValueError(f"Unknown foveation profile: {profile} (expected one of {tuple(FOVEATION_PROFILES)})")
+    return FOVEATION_PROFILES[profile]
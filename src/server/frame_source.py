@@ -0,0 +1,146 @@
+"""
+階層動画のフレーム取得元（frame source）。
+
+cv2.VideoCapture.read() はフレームごとに新しいBGR配列を確保し、デコーダのスレッド数や
+ピクセルフォーマットも指定できない。RawVideoPipe は ffmpeg を -f rawvideo で子プロセスとして起動し、
+標準出力を memoryview 経由で stdout.readinto() することで、事前確保した NumPy 配列に
+直接フレームを書き込む。read() / isOpened() / release() は cv2.VideoCapture と同じ形で呼べるため、
+open_frame_source() の backend を切り替えるだけで VideoStreaming や mp4_create の3本のキャプチャを置き換えられる。
+"""
+import json
+import subprocess
+import cv2
+import numpy as np
+
+# ピクセルフォーマットごとのチャンネル数
+PIXEL_FORMAT_CHANNELS = {
+    "bgr24": 3,
+    "rgb24": 3,
+    "bgra": 4,
+    "gray": 1,
+}
+
+# Linux でパイプの容量を広げ、1フレームあたりの readinto 回数を減らす
+_PIPE_SIZE = 1 << 20
+
+
+def probe_video_size(input_video):
+    """
+    ffprobe で動画の幅と高さを取得する。
+
+    Args:
+        input_video (str): 動画ファイルのパス。
+
+    Returns:
+        Tuple[int, int]: (幅, 高さ)。
+    """
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "json",
+        input_video
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    stream = json.loads(result.stdout)["streams"][0]
+    return int(stream["width"]), int(stream["height"])
+
+
+class RawVideoPipe:
+    def __init__(self, input_video, threads=0, pix_fmt="bgr24"):
+        """
+        Args:
+            input_video (str): 動画ファイルのパス。
+            threads (int): デコーダのスレッド数（0 は ffmpeg の自動設定）。
+            pix_fmt (str): 出力するピクセルフォーマット（PIXEL_FORMAT_CHANNELS のいずれか）。
+        """
+        if pix_fmt not in PIXEL_FORMAT_CHANNELS:
+            raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+        self.input_video = input_video
+        self.width, self.height = probe_video_size(input_video)
+        channels = PIXEL_FORMAT_CHANNELS[pix_fmt]
+        self.shape = (self.height, self.width, channels) if channels > 1 else (self.height, self.width)
+        self.frame_bytes = self.width * self.height * channels
+
+        command = [
+            "ffmpeg", "-v", "error",
+            "-threads", str(threads),
+            "-i", input_video,
+            "-an", "-f", "rawvideo", "-pix_fmt", pix_fmt,
+            "-"
+        ]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        self._stdout = self._process.stdout
+        try:
+            import fcntl
+            fcntl.fcntl(self._stdout.fileno(), fcntl.F_SETPIPE_SZ, _PIPE_SIZE)
+        except (ImportError, AttributeError, OSError):
+            pass
+
+        self._view_owner = None
+        self._view = None
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() in (None, 0)
+
+    def _buffer_view(self, image):
+        """書き込み先配列のバイト列ビュー。同じ配列が続く限り作り直さない。"""
+        if image is not self._view_owner:
+            self._view = memoryview(image).cast("B")
+            self._view_owner = image
+        return self._view
+
+    def read(self, image=None):
+        """
+        次のフレームを image に読み込む。
+
+        Args:
+            image (np.ndarray, optional): 書き込み先の配列。形状が一致しない場合や未指定の場合は新たに確保する。
+
+        Returns:
+            Tuple[bool, np.ndarray | None]: cv2.VideoCapture.read() と同じ (成功したか, フレーム)。
+        """
+        if self._process is None:
+            return False, None
+        if image is None or image.shape != self.shape or image.dtype != np.uint8 or not image.flags.c_contiguous:
+            image = np.empty(self.shape, dtype=np.uint8)
+
+        view = self._buffer_view(image)
+        filled = 0
+        while filled < self.frame_bytes:
+            count = self._stdout.readinto(view[filled:])
+            if not count:
+                return False, None
+            filled += count
+        return True, image
+
+    def release(self):
+        if self._process is None:
+            return
+        self._view_owner = None
+        self._view = None
+        self._stdout.close()
+        if self._process.poll() is None:
+            self._process.terminate()
+        self._process.wait()
+        self._process = None
+
+
+def open_frame_source(input_video, backend="opencv", threads=0, pix_fmt="bgr24"):
+    """
+    階層動画のフレーム取得元を開く。
+
+    Args:
+        input_video (str): 動画ファイルのパス。
+        backend (str): "opencv"（cv2.VideoCapture）または "ffmpeg"（RawVideoPipe）。
+        threads (int): backend="ffmpeg" のときのデコーダのスレッド数。
+        pix_fmt (str): backend="ffmpeg" のときのピクセルフォーマット。
+
+    Returns:
+        cv2.VideoCapture | RawVideoPipe: read() / release() を持つフレーム取得元。
+    """
+    if backend == "opencv":
+        return cv2.VideoCapture(input_video)
+    if backend == "ffmpeg":
+        return RawVideoPipe(input_video, threads=threads, pix_fmt=pix_fmt)
+    raise ValueError(f"Unknown frame source backend: {backend}")
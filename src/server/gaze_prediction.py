@@ -45,14 +45,69 @@ ECHO: An Efficient Heuristic Viewpoint Determination Method on Frontier-Based Au
 - 滑らかな視線移動を実現するため、スムージング関数（smooth_position）を追加し、フレーム間の移動速度を制限しています。
 - 視線の候補座標はウィンドウサイズ（window_width, window_height）全体にわたるグリッド上で評価されます。
 - 現在のコードでは障害物や境界点は動的に設定可能で、視線の予測を柔軟にカスタマイズできます。
+- 候補座標は (N, 2) の配列としてキャッシュし、compute_total_costs で全候補の4つのコストを
+  NumPy のブロードキャストでまとめて計算します。演算の順序は compute_total_cost と同じなので、
+  選ばれる候補（最小コストの先頭）は1候補ずつ計算した場合と一致します。
+- 境界コストは候補座標と境界点だけで決まる静的な項なので、重み付きの値を候補ごとの配列
+  （static_cost_field）としてキャッシュします。ウィンドウサイズ、グリッド、境界点、重みのいずれかが
+  変わったときだけ作り直し、作り直した回数を static_field_builds で確認できます。
+  フレームごとに計算するのは動的な項（障害物、方向変更、距離）だけです。
+- search_mode="hierarchical" では、粗いグリッドで評価した上位 refine_count 個の周囲を
+  refine_factor 分の1の間隔で評価し直すことを停止条件（refine_tolerance）を満たすまで繰り返し、
+  候補を数百点に抑えたまま 1〜数ピクセルの精度で視線を決めます。refine_tolerance には
+  ピクセル数か、(間隔, 最小コスト, 前の段の最小コスト) を受け取って停止するかを返す関数を渡せます。
 """
 import random
 import numpy as np
 from scipy.spatial.distance import euclidean
 from math import acos, sqrt
 
+# 候補座標の探索方法（grid: 固定間隔のグリッド全体、hierarchical: 粗いグリッドから段階的に細かくする）
+GAZE_SEARCH_MODES = ("grid", "hierarchical")
+# hierarchical で停止条件を満たさない場合でも細分化を打ち切る段数
+MAX_REFINE_LEVELS = 16
+
+
+def pixel_tolerance(pixels):
+    """
+    グリッドの間隔が pixels 以下になったら細分化を止める停止条件を返す。
+    """
+    def stop(step, best_cost, previous_cost):
+        return step <= pixels
+    return stop
+
+
+def cost_tolerance(min_improvement, pixels=1):
+    """
+    1段の細分化で最小コストが min_improvement 以上下がらなくなったら（または間隔が pixels 以下に
+    なったら）細分化を止める停止条件を返す。
+    """
+    def stop(step, best_cost, previous_cost):
+        if step <= pixels:
+            return True
+        return previous_cost is not None and previous_cost - best_cost < min_improvement
+    return stop
+
+
 class GazeEstimator:
-    def __init__(self, window_width, window_height):
+    def __init__(self, window_width, window_height, search_mode="grid", grid_step=100,
+                 refine_count=3, refine_factor=4, refine_tolerance=1):
+        """
+        Args:
+            window_width (int): ウィンドウの幅。
+            window_height (int): ウィンドウの高さ。
+            search_mode (str): "grid" または "hierarchical"。
+            grid_step (int): 候補グリッドの間隔（hierarchical では最初の粗いグリッドの間隔）。
+            refine_count (int): hierarchical で次の段に残す候補の数。
+            refine_factor (int): hierarchical で1段ごとにグリッドの間隔を割る数。
+            refine_tolerance (float | callable): hierarchical の停止条件。数値の場合は間隔が
+                その値（ピクセル）以下になったら止める。関数の場合は stop(step, best_cost, previous_cost)
+                が True を返したら止める（previous_cost は最初の段では None）。
+        """
+        if search_mode not in GAZE_SEARCH_MODES:
+            raise ValueError(f"Unknown gaze search mode: {search_mode} (expected one of {GAZE_SEARCH_MODES})")
+        if refine_count < 1 or refine_factor < 2:
+            raise ValueError("Hierarchical search needs refine_count >= 1 and refine_factor >= 2")
         self.window_width = window_width
         self.window_height = window_height
         # 重み設定
@@ -63,6 +118,19 @@ class GazeEstimator:
         self.lambda_bp = 0.5
         self.lambda_bl = 0.5
         self.max_speed = 50  # 視線移動速度の最大値（ピクセル/フレーム）
+        # 候補座標のグリッド（画面端から grid_margin 離れた範囲を grid_step 間隔で並べる）
+        self.grid_step = grid_step
+        self.grid_margin = 100
+        self.search_mode = search_mode
+        self.refine_count = refine_count
+        self.refine_factor = refine_factor
+        self.refine_tolerance = refine_tolerance
+        self._candidates = None
+        self._candidate_key = None
+        # 静的なコスト（境界コスト）の候補ごとのキャッシュと、作り直した回数
+        self._static_field = None
+        self._static_key = None
+        self.static_field_builds = 0
 
     def compute_boundary_cost(self, target_position, boundary_points):
         c_bp = min(euclidean(target_position, bp) for bp in boundary_points)
@@ -121,79 +189,222 @@ class GazeEstimator:
         smoothed_y = max(0, min(smoothed_y, self.window_height))
         return smoothed_x, smoothed_y
 
-    def generate_gaze_position(self, last_gaze_position, boundary_points, obstacle_points, current_vector):
-        # 候補座標を画面全体に分布
-        possible_positions = [
-            (x, y)
-            for x in range(100, self.window_width - 100, 100)
-            for y in range(100, self.window_height - 100, 100)
-        ]
-
-        min_cost = float("inf")
-        best_position = None
-
-        # コスト計算
-        for position in possible_positions:
-            cost = self.compute_total_cost(
-                last_gaze_position, position, boundary_points, obstacle_points, current_vector
-            )
-            if cost < min_cost:
-                min_cost = cost
-                best_position = position
-
-        # スムージング処理を強化（平均化で揺れを軽減）
-        smoothed_position = self.smooth_position(last_gaze_position, best_position)
-
-        # 画面範囲内に制限
-        smoothed_x = max(0, min(smoothed_position[0], self.window_width))
-        smoothed_y = max(0, min(smoothed_position[1], self.window_height))
-
-        return smoothed_x, smoothed_y
-
-    def generate_random_obstacles(self):
-        """ランダムに障害物のポイントを生成"""
-        num_obstacles = 3
-        return [
-            (
-                random.randint(100, self.window_width - 100),
-                random.randint(100, self.window_height - 100)
-            )
-            for _ in range(num_obstacles)
-        ]
-
-        dx = new_position[0] - last_position[0]
-        dy = new_position[1] - last_position[1]
-        distance = sqrt(dx**2 + dy**2)
-        if distance > self.max_speed:
-            scale = self.max_speed / distance
-            dx *= scale
-            dy *= scale
-        smoothed_x = int(last_position[0] + dx)
-        smoothed_y = int(last_position[1] + dy)
-        # 画面範囲内に制限
-        smoothed_x = max(0, min(smoothed_x, self.window_width))
-        smoothed_y = max(0, min(smoothed_y, self.window_height))
-        return smoothed_x, smoothed_y
+    def candidate_positions(self):
+        """
+        視線の候補座標を (N, 2) の配列で返す。
+
+        並びは x を外側、y を内側にしたループと同じ。ウィンドウサイズかグリッドの設定が
+        変わったときだけ作り直す。
+        """
+        key = (self.window_width, self.window_height, self.grid_step, self.grid_margin)
+        if self._candidate_key != key:
+            xs = np.arange(self.grid_margin, self.window_width - self.grid_margin, self.grid_step, dtype=np.float64)
+            ys = np.arange(self.grid_margin, self.window_height - self.grid_margin, self.grid_step, dtype=np.float64)
+            candidates = np.empty((len(xs) * len(ys), 2))
+            candidates[:, 0] = np.repeat(xs, len(ys))
+            candidates[:, 1] = np.tile(ys, len(xs))
+            self._candidates = candidates
+            # 列ごとに連続した配列を持っておく（コスト計算で毎回コピーしないため）
+            self._candidate_x = np.ascontiguousarray(candidates[:, 0])
+            self._candidate_y = np.ascontiguousarray(candidates[:, 1])
+            self._candidate_key = key
+        return self._candidates
+
+    def compute_static_costs(self, boundary_points):
+        """
+        全候補座標の静的なコスト（重み付きの境界コスト λ_b * c_b）を計算する。
+
+        Args:
+            boundary_points (list): 境界点の座標のリスト。
+
+        Returns:
+            np.ndarray: candidate_positions() と同じ順のコスト（長さ N）。
+        """
+        self.candidate_positions()
+        return self._static_costs(self._candidate_x, self._candidate_y, boundary_points)
+
+    def _static_costs(self, x, y, boundary_points):
+        """座標 (x, y) の配列に対する重み付きの境界コスト。"""
+        # 境界点ごとに候補全体の距離を求めて最小値を更新する
+        c_bp = c_bl = None
+        for bx, by in boundary_points:
+            dx = x - bx
+            dy = y - by
+            distance = np.sqrt(dx * dx + dy * dy)
+            np.abs(dx, out=dx)
+            if c_bp is None:
+                c_bp, c_bl = distance, dx
+            else:
+                np.minimum(c_bp, distance, out=c_bp)
+                np.minimum(c_bl, dx, out=c_bl)
+        c_b = self.lambda_bp * c_bp + self.lambda_bl * c_bl
+        return self.lambda_b * c_b
+
+    def static_cost_field(self, boundary_points):
+        """
+        静的なコストをキャッシュから返す。
+
+        ウィンドウサイズ、グリッドの設定、境界点、境界コストの重みのいずれかが前回と
+        異なる場合だけ compute_static_costs で作り直す。
+        """
+        key = (
+            self.window_width, self.window_height, self.grid_step, self.grid_margin,
+            tuple(tuple(point) for point in boundary_points),
+            self.lambda_b, self.lambda_bp, self.lambda_bl,
+        )
+        if self._static_key != key:
+            self._static_field = self.compute_static_costs(boundary_points)
+            self._static_key = key
+            self.static_field_builds += 1
+        return self._static_field
+
+    def invalidate_static_costs(self):
+        """キャッシュした静的なコストを破棄する（次の計算で作り直す）。"""
+        self._static_field = None
+        self._static_key = None
+
+    def compute_dynamic_costs(self, current_position, obstacle_points, current_vector):
+        """
+        全候補座標の動的なコストを、重みを掛けた項ごとに計算する。
+
+        Args:
+            current_position (tuple): 現在の視線座標。
+            obstacle_points (list): 障害物の座標のリスト。
+            current_vector (tuple): 現在の移動ベクトル。
+
+        Returns:
+            list: [λ_e * c_e, λ_d * c_d, λ_dis * c_dis]。各項は長さ N の配列（項が 0 の場合は 0）。
+        """
+        self.candidate_positions()
+        return self._dynamic_costs(self._candidate_x, self._candidate_y, current_position, obstacle_points, current_vector)
+
+    def _dynamic_costs(self, x, y, current_position, obstacle_points, current_vector):
+        """座標 (x, y) の配列に対する重み付きの動的なコストの項。"""
+        # 環境構造コスト: 障害物までの距離の平均（足す順序はスカラー版と同じ）
+        if obstacle_points:
+            c_e = None
+            for ox, oy in obstacle_points:
+                dx = x - ox
+                dy = y - oy
+                distance = np.sqrt(dx * dx + dy * dy)
+                if c_e is None:
+                    c_e = distance
+                else:
+                    c_e += distance
+            c_e /= len(obstacle_points)
+        else:
+            c_e = 0
+
+        # 距離コストと方向変更コスト（どちらも現在位置から候補へのベクトルを使う）
+        vx = x - current_position[0]
+        vy = y - current_position[1]
+        c_dis = np.sqrt(vx * vx + vy * vy)
+        norm_current_vector = sqrt(current_vector[0] * current_vector[0] + current_vector[1] * current_vector[1])
+        if norm_current_vector == 0:
+            c_d = 0
+        else:
+            # 候補が現在位置と同じ場合は cos = 1（角度 0）のままにして方向変更を無視する
+            cos_angle = np.ones(len(x))
+            np.divide(vx * current_vector[0] + vy * current_vector[1], c_dis * norm_current_vector,
+                      out=cos_angle, where=c_dis != 0)
+            np.minimum(cos_angle, 1.0, out=cos_angle)  # 安全範囲に制限
+            np.maximum(cos_angle, -1.0, out=cos_angle)
+            c_d = np.arccos(cos_angle)
+
+        return [self.lambda_e * c_e, self.lambda_d * c_d, self.lambda_dis * c_dis]
+
+    def compute_total_costs(self, current_position, boundary_points, obstacle_points, current_vector):
+        """
+        全候補座標の総コストをまとめて計算する（compute_total_cost のベクトル版）。
+
+        静的なコストはキャッシュを使い、動的なコストの項をスカラー版と同じ順序で足す。
+
+        Args:
+            current_position (tuple): 現在の視線座標。
+            boundary_points (list): 境界点の座標のリスト。
+            obstacle_points (list): 障害物の座標のリスト。
+            current_vector (tuple): 現在の移動ベクトル。
+
+        Returns:
+            np.ndarray: candidate_positions() と同じ順の総コスト（長さ N）。
+        """
+        costs = self.static_cost_field(boundary_points).copy()
+        for term in self.compute_dynamic_costs(current_position, obstacle_points, current_vector):
+            costs += term
+        return costs
+
+    def _best_candidates(self, points, costs):
+        """コストの小さい順に最大 refine_count 個の座標と、その中の最小コストを返す。"""
+        count = min(self.refine_count, len(costs))
+        if count < len(costs):
+            indices = np.argpartition(costs, count - 1)[:count]
+            indices = indices[np.argsort(costs[indices], kind="stable")]
+        else:
+            indices = np.argsort(costs, kind="stable")
+        return points[indices], costs[indices[0]]
+
+    def _should_stop(self, step, best_cost, previous_cost):
+        tolerance = self.refine_tolerance
+        if callable(tolerance):
+            return tolerance(step, best_cost, previous_cost)
+        return step <= tolerance
+
+    def search_hierarchical(self, current_position, boundary_points, obstacle_points, current_vector):
+        """
+        粗いグリッドから段階的に細かくして最小コストの座標を探す。
+
+        1段ごとに、コストの小さい refine_count 個の座標を中心として、前の段の間隔の範囲を
+        refine_factor 分の1の間隔で評価し直す。中心自身も評価し直すので、最小コストは段を
+        重ねても増えない。
+
+        Returns:
+            tuple: 最小コストの座標 (x, y)（float）。候補がない場合は None。
+        """
+        candidates = self.candidate_positions()
+        if len(candidates) == 0:
+            return None
+        costs = self.compute_total_costs(current_position, boundary_points, obstacle_points, current_vector)
+        centers, best_cost = self._best_candidates(candidates, costs)
+
+        factor = self.refine_factor
+        offsets = np.arange(-factor, factor + 1, dtype=np.float64)
+        offset_x = np.repeat(offsets, len(offsets))
+        offset_y = np.tile(offsets, len(offsets))
+        upper_x = self.window_width - self.grid_margin
+        upper_y = self.window_height - self.grid_margin
+
+        step = float(self.grid_step)
+        previous_cost = None
+        for _ in range(MAX_REFINE_LEVELS):
+            if self._should_stop(step, best_cost, previous_cost):
+                break
+            step /= factor
+            # 各中心の周囲 ±(前の段の間隔) を新しい間隔で並べる（グリッドの範囲内に制限）
+            x = (centers[:, 0:1] + offset_x * step).ravel()
+            y = (centers[:, 1:2] + offset_y * step).ravel()
+            np.clip(x, self.grid_margin, upper_x, out=x)
+            np.clip(y, self.grid_margin, upper_y, out=y)
+            costs = self._static_costs(x, y, boundary_points)
+            for term in self._dynamic_costs(x, y, current_position, obstacle_points, current_vector):
+                costs += term
+            previous_cost = best_cost
+            centers, best_cost = self._best_candidates(np.column_stack((x, y)), costs)
+        return float(centers[0, 0]), float(centers[0, 1])
 
     def generate_gaze_position(self, last_gaze_position, boundary_points, obstacle_points, current_vector):
-        # 候補座標を画面全体に分布
-        possible_positions = [
-            (x, y)
-            for x in range(100, self.window_width - 100, 100)
-            for y in range(100, self.window_height - 100, 100)
-        ]
-
-        min_cost = float("inf")
-        best_position = None
-
-        # コスト計算
-        for position in possible_positions:
-            cost = self.compute_total_cost(
-                last_gaze_position, position, boundary_points, obstacle_points, current_vector
-            )
-            if cost < min_cost:
-                min_cost = cost
-                best_position = position
+        if self.search_mode == "hierarchical":
+            best = self.search_hierarchical(last_gaze_position, boundary_points, obstacle_points, current_vector)
+        else:
+            candidates = self.candidate_positions()
+            best = None
+            if len(candidates) > 0:
+                # 全候補のコストを一度に計算し、最小コストの候補（同じ値なら先頭）を選ぶ
+                costs = self.compute_total_costs(last_gaze_position, boundary_points, obstacle_points, current_vector)
+                best = candidates[np.argmin(costs)]
+        if best is None:
+            # ウィンドウが小さく候補がない場合は視線を動かさない
+            return last_gaze_position
+        best_position = (int(round(best[0])), int(round(best[1])))
 
         # スムージング処理を強化（平均化で揺れを軽減）
         smoothed_position = self.smooth_position(last_gaze_position, best_position)
@@ -204,14 +415,19 @@ class GazeEstimator:
 
         return smoothed_x, smoothed_y
 
+    def generate_random_obstacles(self, rng=None):
+        """
+        ランダムに障害物のポイントを生成
 
-    def generate_random_obstacles(self):
-        """ランダムに障害物のポイントを生成"""
+        Args:
+            rng (random.Random, optional): 使用する乱数生成器（シードを固定する場合）。省略時は random モジュール。
+        """
+        rng = rng if rng is not None else random
         num_obstacles = 3
         return [
             (
-                random.randint(100, self.window_width - 100),
-                random.randint(100, self.window_height - 100)
+                rng.randint(100, self.window_width - 100),
+                rng.randint(100, self.window_height - 100)
             )
             for _ in range(num_obstacles)
         ]
@@ -0,0 +1,235 @@
+"""
+クリップ全体の視線の軌跡を事前に計算し、.npy ファイルに保存する。
+
+配信ループの視線予測は、直前の視線と一定間隔で更新する障害物だけで決まり、フレームの内容を
+使わない。そこで plan_gaze_trajectory は配信ループと同じ手順（画面中央から開始し、
+obstacle_interval フレームごとに障害物を更新）をシード付きの乱数で先に実行する。結果は
+フレーム番号 i の視線 (x, y) を i 行目に持つ (フレーム数, 2) の int32 配列として、
+メモリマップした .npy に書き出す。行は各階層の動画のフレーム番号に対応する。
+
+計算の条件（ウィンドウサイズ、フレーム数、シード、探索方法）は同じ名前の .json に書く。
+plan_or_load_gaze_trajectory は条件が一致すれば既存のファイルを再利用する。
+VideoStreaming(gaze_trajectory=path) はファイルをメモリマップで開き、GazeEstimator を呼ばずに
+フレーム番号で視線を読む。
+
+saliency_video に低画質の階層の動画を指定すると、ランダムな障害物の代わりに SaliencyPredictor が
+各フレームから求めた顕著点を使う（配信時の gaze_saliency=True と同じ）。
+
+実行方法:
+    python -m src.server.gaze_trajectory --width 1920 --height 1080 --frames 900 [--seed 0] [--output gaze.npy]
+        [--saliency-video video/low.mp4]
+"""
+import argparse
+import json
+import os
+import random
+import numpy as np
+from src.server.frame_source import open_frame_source
+from src.server.gaze_prediction import GazeEstimator, GAZE_SEARCH_MODES
+from src.server.saliency import SaliencyPredictor, SALIENCY_LAMBDA_E
+
+TRAJECTORY_DTYPE = np.int32
+# 障害物を更新する間隔（フレーム）。配信ループと同じ
+OBSTACLE_INTERVAL = 10
+
+
+def default_boundary_points(window_width, window_height):
+    """VideoStreaming と同じ、画面の四隅付近の境界点。"""
+    return [
+        (50, 50),
+        (window_width - 50, 50),
+        (50, window_height - 50),
+        (window_width - 50, window_height - 50)
+    ]
+
+
+def trajectory_metadata_path(path):
+    return f"{os.path.splitext(path)[0]}.json"
+
+
+def read_trajectory_metadata(path):
+    """軌跡ファイルの計算条件を読む。サイドカーがなければ None。"""
+    try:
+        with open(trajectory_metadata_path(path), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def saliency_source_info(saliency_video):
+    """サイドカーに記録する顕著度の入力動画の情報（動画が変わったら計算し直すため）。"""
+    if saliency_video is None:
+        return None
+    stat = os.stat(saliency_video)
+    return {"path": os.path.abspath(saliency_video), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def plan_gaze_trajectory(path, window_width, window_height, frame_count, seed=0, search_mode="grid",
+                         obstacle_interval=OBSTACLE_INTERVAL, saliency_video=None):
+    """
+    視線の軌跡を計算して .npy に書き出す。
+
+    配列は一時ファイルにメモリマップで1行ずつ書き、完成してから置き換える。サイドカーは
+    .npy を置き換える前に削除し、置き換えた後に書くため、途中で中断しても書きかけのファイルや
+    古い条件のサイドカーと組み合わさったファイルが再利用されることはない。
+
+    Args:
+        path (str): 書き出す .npy のパス。
+        window_width (int): ウィンドウの幅。
+        window_height (int): ウィンドウの高さ。
+        frame_count (int): 計算するフレーム数。
+        seed (int): 障害物の乱数シード。同じシードなら同じ軌跡になる。
+        search_mode (str): GazeEstimator の探索方法（"grid" または "hierarchical"）。
+        obstacle_interval (int): 障害物を更新する間隔（フレーム）。
+        saliency_video (str, optional): 顕著点を求める低画質の階層の動画。指定した場合は毎フレーム
+            その動画の同じ番号のフレームから障害物を求める（動画が先に終わったら最後の顕著点を使う）。
+
+    Returns:
+        np.ndarray: 書き出した軌跡（読み取り専用のメモリマップ）。
+    """
+    if search_mode not in GAZE_SEARCH_MODES:
+        raise ValueError(f"Unknown gaze search mode: {search_mode} (expected one of {GAZE_SEARCH_MODES})")
+    if frame_count < 1:
+        raise ValueError("A gaze trajectory needs at least one frame")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    estimator = GazeEstimator(window_width, window_height, search_mode=search_mode)
+    boundary_points = default_boundary_points(window_width, window_height)
+    current_vector = (1, 0)
+    last_gaze_position = (window_width // 2, window_height // 2)
+    rng = random.Random(seed)
+    obstacle_points = estimator.generate_random_obstacles(rng)
+    saliency = source = frame = None
+    if saliency_video is not None:
+        saliency = SaliencyPredictor(window_width, window_height)
+        estimator.lambda_e = SALIENCY_LAMBDA_E
+        source = open_frame_source(saliency_video)
+
+    temp_path = f"{path}.tmp.npy"
+    trajectory = np.lib.format.open_memmap(temp_path, mode="w+", dtype=TRAJECTORY_DTYPE, shape=(frame_count, 2))
+    for frame_index in range(frame_count):
+        if saliency is not None:
+            ret = False
+            if source is not None:
+                ret, frame = source.read(frame)
+            if ret:
+                saliency.update(frame)
+                obstacle_points = saliency.interest_points()
+            elif source is not None:
+                source.release()
+                source = None
+        elif frame_index % obstacle_interval == 0:
+            obstacle_points = estimator.generate_random_obstacles(rng)
+        last_gaze_position = estimator.generate_gaze_position(
+            last_gaze_position, boundary_points, obstacle_points, current_vector
+        )
+        trajectory[frame_index] = last_gaze_position
+    if source is not None:
+        source.release()
+    trajectory.flush()
+    del trajectory
+
+    # 古いサイドカーを消す → .npy を置き換える → 新しいサイドカーを一時ファイルから置き換える
+    metadata_path = trajectory_metadata_path(path)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+    os.replace(temp_path, path)
+
+    temp_metadata_path = f"{metadata_path}.tmp"
+    with open(temp_metadata_path, "w") as f:
+        json.dump({
+            "window_width": window_width,
+            "window_height": window_height,
+            "frame_count": frame_count,
+            "seed": seed,
+            "search_mode": search_mode,
+            "obstacle_interval": obstacle_interval,
+            "saliency_video": saliency_source_info(saliency_video),
+        }, f)
+    os.replace(temp_metadata_path, metadata_path)
+    return load_gaze_trajectory(path)
+
+
+def load_gaze_trajectory(path):
+    """軌跡ファイルを読み取り専用のメモリマップで開く。"""
+    return np.load(path, mmap_mode="r")
+
+
+def plan_or_load_gaze_trajectory(path, window_width, window_height, frame_count, seed=0, search_mode="grid",
+                                 obstacle_interval=OBSTACLE_INTERVAL, saliency_video=None):
+    """
+    条件が同じ軌跡ファイルがあれば再利用し、なければ plan_gaze_trajectory で計算する。
+
+    フレーム数が足りる既存のファイルは、同じシードで先頭から計算した結果と同じなので再利用する。
+
+    Returns:
+        np.ndarray: 軌跡（読み取り専用のメモリマップ）。
+    """
+    metadata = read_trajectory_metadata(path)
+    if (
+        os.path.exists(path)
+        and metadata is not None
+        and metadata.get("window_width") == window_width
+        and metadata.get("window_height") == window_height
+        and metadata.get("seed") == seed
+        and metadata.get("search_mode") == search_mode
+        and metadata.get("obstacle_interval") == obstacle_interval
+        and metadata.get("frame_count", 0) >= frame_count
+        and metadata.get("saliency_video") == saliency_source_info(saliency_video)
+    ):
+        return load_gaze_trajectory(path)
+    return plan_gaze_trajectory(path, window_width, window_height, frame_count, seed, search_mode, obstacle_interval,
+                                saliency_video)
+
+
+class GazeTrajectory:
+    def __init__(self, path):
+        """
+        配信ループから事前計算した視線を読む。
+
+        Args:
+            path (str): plan_gaze_trajectory で書き出した .npy のパス。
+        """
+        self.path = path
+        self.positions = load_gaze_trajectory(path)
+        if self.positions.ndim != 2 or self.positions.shape[1] != 2:
+            raise ValueError(f"{path} is not a gaze trajectory (expected shape (frames, 2), got {self.positions.shape})")
+        self.metadata = read_trajectory_metadata(path) or {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def position(self, frame_index):
+        """
+        フレーム番号の視線を返す。軌跡より後のフレームでは最後の視線を返す。
+
+        Returns:
+            tuple: 視線の座標 (x, y)。
+        """
+        if len(self.positions) == 0:
+            raise ValueError(f"Gaze trajectory {self.path} is empty")
+        x, y = self.positions[min(frame_index, len(self.positions) - 1)]
+        return int(x), int(y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan a gaze trajectory ahead of streaming")
+    parser.add_argument("--width", type=int, required=True, help="ウィンドウの幅")
+    parser.add_argument("--height", type=int, required=True, help="ウィンドウの高さ")
+    parser.add_argument("--frames", type=int, required=True, help="フレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="障害物の乱数シード")
+    parser.add_argument("--search", choices=GAZE_SEARCH_MODES, default="grid", help="視線の探索方法")
+    parser.add_argument("--output", default="segments/gaze_trajectory.npy", help="書き出す .npy のパス")
+    parser.add_argument("--saliency-video", default=None, help="顕著点を求める低画質の階層の動画")
+    parser.add_argument("--force", action="store_true", help="条件が同じファイルがあっても計算し直す")
+    args = parser.parse_args()
+
+    plan = plan_gaze_trajectory if args.force else plan_or_load_gaze_trajectory
+    trajectory = plan(args.output, args.width, args.height, args.frames, args.seed, args.search,
+                      saliency_video=args.saliency_video)
+    print(f"Gaze trajectory for {len(trajectory)} frames: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,40 +31,32 @@
 
 
 import subprocess
+from src.server.foveation_profile import DEFAULT_PROFILE, get_profile
 
-def compress_video_to_h264(input_video, window_width, window_height):
+def compress_video_to_h264(input_video, window_width, window_height, profile=DEFAULT_PROFILE):
     """
-    入力動画を3種類のビットレートでH.264圧縮し、指定された解像度で出力する関数。
+    入力動画をフォビエイテッド圧縮の階層ごとのビットレートでH.264圧縮し、
+    ウィンドウサイズに各階層の縮小率を掛けた解像度で出力する関数。
 
     Args:
         input_video (str): 入力動画のパス。
-        window_width (int): 出力動画の幅。
-        window_height (int): 出力動画の高さ。
+        window_width (int): ウィンドウ（合成後の動画）の幅。
+        window_height (int): ウィンドウ（合成後の動画）の高さ。
+        profile (FoveationProfile | str): 階層構成またはその名前（既定は low, med, high の3階層、
+            "multi_resolution" は周辺の階層を低い解像度で出力する）。
 
     Returns:
-        Tuple[str, str, str]: low, medium, highの解像度で圧縮された動画のパス。
+        Tuple[str, ...]: 外側から内側の階層の順に、圧縮された動画のパス。
     """
-    low_res_output = "h264_outputs/low_res.mp4"
-    med_res_output = "h264_outputs/med_res.mp4"
-    high_res_output = "h264_outputs/high_res.mp4"
-
-    low_res_bitrate = "700k"
-    med_res_bitrate = "1500k"
-    high_res_bitrate = "3000k"
-
-    # 圧縮用の設定
-    bitrates = {
-        low_res_output: low_res_bitrate,
-        med_res_output: med_res_bitrate,
-        high_res_output: high_res_bitrate
-    }
-
     outputs = []
 
-    for output_file, bitrate in bitrates.items():
+    for tier in get_profile(profile):
+        output_file = f"h264_outputs/{tier.name}_res.mp4"
+        bitrate = tier.bitrate
+        width, height = tier.frame_size(window_width, window_height)
         command = [
             "ffmpeg", "-y", "-i", input_video,
-            "-vf", f"scale={window_width}:{window_height}",
+            "-vf", f"scale={width}:{height}",
             "-b:v", bitrate, "-maxrate", bitrate,
             "-bufsize", "2M", "-c:v", "libx264", "-preset", "medium",
             "-tune", "film", output_file
@@ -1,8 +1,14 @@
+import math
 import os
+import shutil
 import subprocess
+from src.server.playlist_manager import get_playlist_manager, read_playlist_segments, write_playlist_atomic
 
-# グローバル変数でセグメント番号を追跡
-segment_indices = {}
+# HLSの各画質の解像度（low, medium, high）
+HLS_RESOLUTIONS = [(640, 360), (1280, 720), (1920, 1080)]
+
+# セグメントの長さ（秒）。1セグメントあたりのフレーム数、GOP、hls_time、EXT-X-TARGETDURATION をすべてこの値から決める
+SEGMENT_DURATION = 6
 
 def get_video_bitrate(input_file):
     """
@@ -23,54 +29,6 @@ def get_video_bitrate(input_file):
         print(f"Error fetching bitrate: {e}")
         return None
 
-def get_next_segment_index(output_dir, level):
-    """
-    次のセグメント番号を取得。
-    """
-    if level not in segment_indices:
-        segment_files = [
-            f for f in os.listdir(os.path.join(output_dir, level))
-            if f.startswith(f"segment-{level}-") and f.endswith(".ts")
-        ]
-        if segment_files:
-            max_index = max(
-                int(f.split('-')[-1].split('.')[0]) for f in segment_files
-            )
-        else:
-            max_index = -1
-        segment_indices[level] = max_index + 1
-    return segment_indices[level]
-
-def update_segment_index(level, count):
-    """
-    セグメント番号を更新。
-    """
-    segment_indices[level] += count
-
-def append_to_m3u8(output_dir, level, target_duration=10):
-    """
-    m3u8ファイルを全セグメント情報を記述。
-    """
-    m3u8_path = os.path.join(output_dir, level, f"{level}.m3u8")
-    segment_files = sorted([
-        f for f in os.listdir(os.path.join(output_dir, level))
-        if f.startswith(f"segment-{level}-") and f.endswith(".ts")
-    ])
-    if not segment_files:
-        print(f"No segments found for {level}. Skipping m3u8 generation.")
-        return
-
-    with open(m3u8_path, 'w') as f:
-        f.write("#EXTM3U\n")
-        f.write("#EXT-X-VERSION:3\n")
-        f.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
-        f.write("#EXT-X-MEDIA-SEQUENCE:0\n")
-        f.write("#EXT-X-PLAYLIST-TYPE:VOD\n")
-        for segment in segment_files:
-            f.write(f"#EXTINF:{target_duration}.000000,\n")
-            f.write(f"{segment}\n")
-        f.write("#EXT-X-ENDLIST\n")
-
 def create_master_m3u8(output_dir):
     """
     master.m3u8ファイルを生成。
@@ -88,72 +46,229 @@ def create_master_m3u8(output_dir):
         "medium": "1280x720",
         "high": "1920x1080"
     }
-    with open(master_path, 'w') as f:
-        f.write("#EXTM3U\n")
-        for level, bitrate in bitrates.items():
-            playlist_path = os.path.join(level, f"{level}.m3u8")
-            f.write(f"#EXT-X-STREAM-INF:BANDWIDTH={bitrate},RESOLUTION={resolutions[level]}\n")
-            f.write(f"{playlist_path}\n")
+    lines = ["#EXTM3U\n"]
+    for level, bitrate in bitrates.items():
+        playlist_path = os.path.join(level, f"{level}.m3u8")
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bitrate},RESOLUTION={resolutions[level]}\n")
+        lines.append(f"{playlist_path}\n")
+    write_playlist_atomic(master_path, "".join(lines))
 
-def create_hls_with_dynamic_bitrate(input_file, output_dir, resolutions, base_bitrate, segment_time=10):
+def publish_hls_renditions(output_dir, segments, segment_time=SEGMENT_DURATION):
     """
-    動的に元動画のビットレートを反映したHLSストリーミングファイルを作成。
+    完成したセグメントを各画質の m3u8 に追記し、master.m3u8 を生成する。
 
     Args:
-        input_file (str): 入力動画ファイルのパス。
-        output_dir (str): 出力ディレクトリ。
-        resolutions (list): 解像度のリスト (width, height)。
-        base_bitrate (int): 元動画の総ビットレート（kbps）。
-        segment_time (int): 各セグメントの時間（秒）。
+        output_dir (str): HLSファイルの出力ディレクトリ。
+        segments (dict): 画質名から (セグメントのファイル名, 長さ（秒）) のリストへの辞書
+            （collect_hls_renditions の戻り値）。
+        segment_time (float): セグメントの目標の長さ（秒）。
     """
-    os.makedirs(output_dir, exist_ok=True)
+    get_playlist_manager(output_dir, segment_time).publish(segments)
+    create_master_m3u8(output_dir)
 
-    bitrates = {
+def hls_rendition_bitrates(base_bitrate):
+    """
+    元動画のビットレートから各画質のビットレート（kbps）を求める。
+
+    Args:
+        base_bitrate (int | str): 元動画の総ビットレート（3000 または "3000k"）。
+
+    Returns:
+        dict: 画質名からビットレート（kbps）への辞書。
+    """
+    base_bitrate = int(str(base_bitrate).replace("k", ""))
+    return {
         "low": max(100, base_bitrate // 3),
         "medium": max(300, base_bitrate),
         "high": max(600, base_bitrate * 3)
     }
 
-    for (width, height), (level, bitrate) in zip(resolutions, bitrates.items()):
-        subdir = os.path.join(output_dir, level).replace("\\", "/")
-        os.makedirs(subdir, exist_ok=True)
-
-        next_index = get_next_segment_index(output_dir, level)
-        segment_pattern = os.path.join(subdir, f"segment-{level}-%03d.ts").replace("\\", "/")
-        playlist_path = os.path.join(subdir, f"{level}.m3u8").replace("\\", "/")
-
-        command = [
-            "ffmpeg",
-            "-i", input_file,
-            "-map", "0",
-            "-an",
-            "-s", f"{width}x{height}",
-            "-b:v", f"{bitrate}k",
-            "-maxrate", f"{bitrate}k",
-            "-bufsize", "2M",
-            "-f", "hls",
-            "-hls_time", str(segment_time),
-            "-hls_playlist_type", "vod",
-            "-hls_segment_filename", segment_pattern,
-            "-start_number", str(next_index),
-            "-g", str(30 * segment_time),
-            "-force_key_frames", f"expr:gte(t,n_forced*{segment_time})",
-            playlist_path  # プレイリストの出力先
+def reserve_segment_indices(output_dir, levels, count, segment_time=SEGMENT_DURATION):
+    """
+    全画質で共通の count 個のセグメント番号を予約し、先頭の番号を返す。
+
+    全画質を1回の ffmpeg で生成するため、-start_number は画質間で共有される。
+    番号は PlaylistManager がメモリ上で管理し、ディレクトリは走査しない。
+    """
+    for level in levels:
+        os.makedirs(os.path.join(output_dir, level), exist_ok=True)
+    return get_playlist_manager(output_dir, segment_time).reserve(count)
+
+def hls_segment_count(frame_count, fps, segment_time):
+    """
+    frame_count 枚のフレームから生成されるHLSセグメント数。
+
+    強制キーフレームで segment_time ごとに分割されるため、エンコード前に決まる。
+    """
+    duration = frame_count / fps
+    return max(1, math.ceil(duration / segment_time - 1e-6))
+
+def hls_run_id(output_dir, segment_time=SEGMENT_DURATION):
+    """出力ディレクトリの配信のID（セグメントのファイル名に含める）。"""
+    return get_playlist_manager(output_dir, segment_time).run_id
+
+def hls_segment_name(output_dir, level, index, segment_time=SEGMENT_DURATION):
+    """画質 level の index 番のセグメントのファイル名。"""
+    return get_playlist_manager(output_dir, segment_time).segment_name(level, index)
+
+def hls_staging_dir(output_dir, start_index):
+    """start_index 番から始まるジョブの作業ディレクトリ。"""
+    return os.path.join(output_dir, f".job-{start_index:03d}")
+
+def hls_filter_args(resolutions, base_bitrate):
+    """
+    入力の映像を split / scale で全画質に分岐し、画質ごとのビットレートを指定する ffmpeg の引数を作る。
+
+    Args:
+        resolutions (list): 解像度のリスト (width, height)。
+        base_bitrate (int | str): 元動画の総ビットレート（kbps）。
+
+    Returns:
+        Tuple[list, list]: (画質名, ffmpeg の引数)。
+    """
+    renditions = list(zip(resolutions, hls_rendition_bitrates(base_bitrate).items()))
+    levels = [level for _, (level, _) in renditions]
+
+    # 一度デコードしたフレームを画質の数に分岐し、それぞれの解像度に縮小
+    outputs = [f"[v{n}]" for n in range(len(renditions))]
+    filters = [f"[0:v]split={len(renditions)}{''.join(outputs)}"]
+    for n, ((width, height), _) in enumerate(renditions):
+        filters.append(f"[v{n}]scale={width}:{height}[out{n}]")
+
+    args = ["-filter_complex", ";".join(filters)]
+    for n, (_, (level, bitrate)) in enumerate(renditions):
+        args += [
+            "-map", f"[out{n}]",
+            f"-b:v:{n}", f"{bitrate}k",
+            f"-maxrate:v:{n}", f"{bitrate}k",
+            f"-bufsize:v:{n}", "2M",
         ]
+    return levels, args
+
+def hls_rendition_args(resolutions, base_bitrate, staging_dir, start_index, run_id, segment_time=SEGMENT_DURATION, fps=30):
+    """
+    入力の映像を全画質に分岐し、HLSとして書き出す ffmpeg の出力引数を作る。
 
-        try:
-            subprocess.run(command, check=True)
-            print(f"HLS segments created for resolution {width}x{height}, bitrate {bitrate}k.")
+    各画質は同じフレームに強制キーフレームを置き（シーンチェンジ検出は無効）、
+    セグメントの境界が画質間でそろうようにする。
 
-            # セグメント番号を更新
-            update_segment_index(level, 3)
+    Args:
+        resolutions (list): 解像度のリスト (width, height)。
+        base_bitrate (int | str): 元動画の総ビットレート（kbps）。
+        staging_dir (str): セグメントとプレイリストを書き出す作業ディレクトリ。
+        start_index (int): 先頭セグメントの番号（全画質で共通）。
+        run_id (str): セグメントのファイル名に含める配信のID（hls_run_id）。
+        segment_time (float): 各セグメントの時間（秒）。
+        fps (int): 動画のフレームレート。
+
+    Returns:
+        Tuple[list, list]: (画質名, ffmpeg の引数)。
+    """
+    levels, args = hls_filter_args(resolutions, base_bitrate)
 
-            # m3u8ファイルを全セグメントで書き直し
-            append_to_m3u8(output_dir, level, target_duration=segment_time)
+    # PlaylistManager.segment_name と同じ名前になるようにする
+    segment_pattern = os.path.join(staging_dir, f"segment-{run_id}-%v-%03d.ts").replace("\\", "/")
+    playlist_pattern = os.path.join(staging_dir, "%v.m3u8").replace("\\", "/")
+    args += [
+        "-an",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-g", str(max(1, round(fps * segment_time))),
+        "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_time})",
+        "-f", "hls",
+        "-hls_time", str(segment_time),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", segment_pattern,
+        "-start_number", str(start_index),
+        "-var_stream_map", " ".join(f"v:{n},name:{level}" for n, level in enumerate(levels)),
+        playlist_pattern  # ジョブ専用の一時プレイリスト
+    ]
+    return levels, args
 
-        except subprocess.CalledProcessError as e:
-            print(f"Error during HLS creation for {level}: {e}")
+def collect_hls_renditions(output_dir, staging_dir, levels):
+    """
+    作業ディレクトリの完成したセグメントを各画質のディレクトリへ移し、作業ディレクトリを削除する。
 
-    # master.m3u8を生成
-    create_master_m3u8(output_dir)
+    Returns:
+        dict: 画質名から (セグメントのファイル名, 長さ（秒）) のリストへの辞書。
+        長さは ffmpeg がジョブ専用のプレイリストに書いた実際の値。
+    """
+    segments = {}
+    try:
+        for level in levels:
+            segments[level] = read_playlist_segments(os.path.join(staging_dir, f"{level}.m3u8"))
+            os.makedirs(os.path.join(output_dir, level), exist_ok=True)
+            for name, _ in segments[level]:
+                os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, level, name))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return segments
+
+def encode_hls_renditions(input_file, output_dir, resolutions, base_bitrate, start_index, segment_time=SEGMENT_DURATION, fps=30):
+    """
+    1回の ffmpeg で入力を一度だけデコードし、split / scale で全画質のHLSセグメントを生成する。
+
+    ffmpeg はこのジョブ専用の作業ディレクトリに書き出し、完成したセグメントを各画質の
+    ディレクトリへ移してから作業ディレクトリを削除する。公開用の {level}.m3u8 は
+    publish_hls_renditions で追記するため、複数のジョブを並列に実行しても衝突しない。
+
+    Args:
+        input_file (str): 入力動画ファイルのパス。
+        output_dir (str): 出力ディレクトリ。
+        resolutions (list): 解像度のリスト (width, height)。
+        base_bitrate (int | str): 元動画の総ビットレート（kbps）。
+        start_index (int): 先頭セグメントの番号（全画質で共通）。
+        segment_time (float): 各セグメントの時間（秒）。
+        fps (int): 動画のフレームレート。
+
+    Returns:
+        dict: 画質名から (セグメントのファイル名, 長さ（秒）) のリストへの辞書。
+    """
+    staging_dir = hls_staging_dir(output_dir, start_index)
+    os.makedirs(staging_dir, exist_ok=True)
+    levels, args = hls_rendition_args(resolutions, base_bitrate, staging_dir, start_index,
+                                      hls_run_id(output_dir, segment_time), segment_time, fps)
+
+    try:
+        subprocess.run(["ffmpeg", "-i", input_file] + args, check=True)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    segments = collect_hls_renditions(output_dir, staging_dir, levels)
+
+    for (width, height), (level, bitrate) in zip(resolutions, hls_rendition_bitrates(base_bitrate).items()):
+        print(f"HLS segments created for resolution {width}x{height}, bitrate {bitrate}k.")
+    return segments
+
+def create_hls_with_dynamic_bitrate(input_file, output_dir, resolutions, base_bitrate, segment_time=SEGMENT_DURATION,
+                                    segment_count=1, fps=30):
+    """
+    動的に元動画のビットレートを反映したHLSストリーミングファイルを作成。
+
+    Args:
+        input_file (str): 入力動画ファイルのパス。
+        output_dir (str): 出力ディレクトリ。
+        resolutions (list): 解像度のリスト (width, height)。
+        base_bitrate (int | str): 元動画の総ビットレート（kbps）。
+        segment_time (float): 各セグメントの時間（秒）。
+        segment_count (int): 入力動画から生成されるセグメント数（hls_segment_count で求める）。
+        fps (int): 動画のフレームレート。
+
+    Returns:
+        bool: プレイリストに公開できたか。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    levels = list(hls_rendition_bitrates(base_bitrate))[:len(resolutions)]
+    start_index = reserve_segment_indices(output_dir, levels, segment_count, segment_time)
+    try:
+        segments = encode_hls_renditions(input_file, output_dir, resolutions, base_bitrate, start_index, segment_time, fps)
+
+    except subprocess.CalledProcessError as e:
+        print(f"Error during HLS creation: {e}")
+        create_master_m3u8(output_dir)
+        return False
 
+    publish_hls_renditions(output_dir, segments, segment_time)
+    return True
@@ -0,0 +1,317 @@
+"""
+LL-HLS（Low-Latency HLS）出力。
+
+視線に合わせて合成した映像は数秒で古くなるため、セグメント（SEGMENT_DURATION 秒）の完成を待たずに
+PART_DURATION 秒ごとのパーシャルセグメント（EXT-X-PART）として公開する。
+
+ffmpeg の hls マルチプレクサは EXT-X-PART を出力できないため、LLHLSWriter は ffmpeg を起動し、
+split_by_time でパートの長さごとに .ts を書き出させる（temp_file によりファイルは完成時に現れる）。
+x264 のビットレートは起動後に変えられないため、set_bitrate() で次のセグメントのビットレートが
+変わったときはセグメントの境界で ffmpeg を起動し直す。新しいプロセスはパート番号（-start_number）と
+タイムスタンプ（-output_ts_offset）を引き継ぐので、連結したセグメントの時刻は連続する。
+キーフレームはセグメントの先頭にのみ置くので、セグメントの先頭パートだけが INDEPENDENT=YES になる。公開スレッドは全画質のパートがそろうたびに EXT-X-PART を追加し、
+次のパートを EXT-X-PRELOAD-HINT として示す。セグメント分のパートがそろったら連結して
+segment-{run_id}-{level}-NNN.ts とし、EXTINF として追加する。パートの名前にも配信ごとの run_id を含め、
+前回の配信と同じURIにならないようにする。プレイリストは書き込みのたびに一時ファイルから
+置き換えるため、ブロッキングリロード（_HLS_msn / _HLS_part）で待っているクライアントが
+書きかけのファイルを読むことはない。
+"""
+import math
+import os
+import shutil
+import threading
+import time
+from src.server.hls_server import (
+    SEGMENT_DURATION, hls_filter_args, hls_run_id, hls_segment_name, reserve_segment_indices, create_master_m3u8
+)
+from src.server.playlist_manager import write_playlist_atomic, notify_published
+from src.server.segment_writer import SegmentWriter
+
+# パーシャルセグメントの長さ（秒）
+PART_DURATION = 0.2
+
+
+class LLHLSPlaylist:
+    def __init__(self, target_duration, part_target, media_sequence=0, retained_segments=3):
+        """
+        Args:
+            target_duration (float): セグメントの長さ（秒）。
+            part_target (float): パートの長さ（秒）。
+            media_sequence (int): 先頭セグメントのメディアシーケンス番号。
+            retained_segments (int): EXT-X-PART を残す直近のセグメント数。
+        """
+        self.target_duration = target_duration
+        self.part_target = part_target
+        self.media_sequence = media_sequence
+        self.retained_segments = retained_segments
+        self.segments = []  # [uri, duration, parts]（古いセグメントの parts は None）
+        self.parts = []     # 完成前のセグメントのパート (uri, duration, independent)
+        self.preload_hint = None
+        self.ended = False
+
+    def add_part(self, uri, duration, independent):
+        self.parts.append((uri, duration, independent))
+
+    def complete_segment(self, uri):
+        """現在のパートを1つのセグメントとして確定する。"""
+        duration = sum(part[1] for part in self.parts)
+        self.segments.append([uri, duration, self.parts])
+        self.parts = []
+        if len(self.segments) > self.retained_segments:
+            self.segments[-self.retained_segments - 1][2] = None
+
+    def finish(self):
+        self.preload_hint = None
+        self.ended = True
+
+    def render(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:6",
+            f"#EXT-X-TARGETDURATION:{math.ceil(self.target_duration)}",
+            f"#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for uri, duration, parts in self.segments:
+            lines.extend(self._part_lines(parts or ()))
+            lines.append(f"#EXTINF:{duration:.6f},")
+            lines.append(uri)
+        lines.extend(self._part_lines(self.parts))
+        if self.preload_hint is not None:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{self.preload_hint}"')
+        if self.ended:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _part_lines(parts):
+        for uri, duration, independent in parts:
+            attributes = f'DURATION={duration:.6f},URI="{uri}"'
+            if independent:
+                attributes += ",INDEPENDENT=YES"
+            yield f"#EXT-X-PART:{attributes}"
+
+    def write(self, path):
+        write_playlist_atomic(path, self.render())
+
+
+class LLHLSWriter(SegmentWriter):
+    def __init__(self, output_dir, resolutions, width, height, fps, video_bitrate, segment_duration=SEGMENT_DURATION,
+                 part_duration=PART_DURATION, latency_meter=None, pix_fmt="bgr24", preset="veryfast"):
+        """
+        合成フレームを ffmpeg に流し、LL-HLSのパートとセグメントを公開するライター。
+
+        Args:
+            output_dir (str): HLSファイルの出力ディレクトリ。
+            resolutions (list): 解像度のリスト (width, height)。
+            width (int): 合成フレームの幅。
+            height (int): 合成フレームの高さ。
+            fps (int): フレームレート。
+            video_bitrate (str | int): 最初のセグメントのHLS各画質の基準となるビットレート（例: "3000k"）。
+            segment_duration (float): セグメントの長さ（秒）。パートの長さの整数倍に丸める。
+            part_duration (float): パートの長さ（秒）。フレーム数の整数倍に丸める。
+            latency_meter (PlaylistLatencyMeter, optional): パートの公開時に glass-to-playlist レイテンシを記録する。
+            pix_fmt (str): 書き込むフレームのピクセルフォーマット。
+            preset (str): libx264 のプリセット。
+        """
+        self.output_dir = output_dir
+        self.segment_path = output_dir
+        self.fps = fps
+        self.frames_per_part = max(1, round(fps * part_duration))
+        self.parts_per_segment = max(1, round(fps * segment_duration / self.frames_per_part))
+        self.part_duration = self.frames_per_part / fps
+        self.segment_duration = self.part_duration * self.parts_per_segment
+        self.frames_per_segment = self.frames_per_part * self.parts_per_segment
+        self.latency_meter = latency_meter
+        self.resolutions = resolutions
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        self.preset = preset
+        self.video_bitrate = video_bitrate
+        self._next_bitrate = video_bitrate
+
+        self.levels, _ = hls_filter_args(resolutions, video_bitrate)
+        for level in self.levels:
+            level_dir = os.path.join(output_dir, level)
+            os.makedirs(level_dir, exist_ok=True)
+            # 前回の実行のパートを公開しないよう削除する
+            for name in os.listdir(level_dir):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(level_dir, name))
+
+        media_sequence = reserve_segment_indices(output_dir, self.levels, 0, self.segment_duration)
+        self.run_id = hls_run_id(output_dir, self.segment_duration)
+        self.playlists = {
+            level: LLHLSPlaylist(self.segment_duration, self.part_duration, media_sequence)
+            for level in self.levels
+        }
+        self.published_parts = 0
+        self._segment_parts = []  # 確定済みセグメントごとのパート番号の範囲
+        self._frame_times = {}
+        self._lock = threading.Lock()
+
+        self._start(width, height, fps, pix_fmt, self._encoder_args(video_bitrate, 0))
+
+        create_master_m3u8(output_dir)
+        for level, playlist in self.playlists.items():
+            playlist.preload_hint = self._part_name(0)
+            playlist.write(self._playlist_path(level))
+
+        self._stop = threading.Event()
+        self._publisher = threading.Thread(target=self._publish_loop, name="ll-hls-publisher", daemon=True)
+        self._publisher.start()
+
+    def _encoder_args(self, video_bitrate, start_part):
+        """start_part 番のパートから書き出す ffmpeg の出力引数を作る。"""
+        _, filter_args = hls_filter_args(self.resolutions, video_bitrate)
+        return filter_args + [
+            "-an",
+            "-c:v", "libx264", "-preset", self.preset, "-tune", "zerolatency",
+            "-pix_fmt", "yuv420p",
+            "-g", str(self.frames_per_segment),
+            "-sc_threshold", "0",
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_duration})",
+            "-output_ts_offset", f"{start_part * self.part_duration:.6f}",
+            "-f", "hls",
+            "-hls_time", str(self.part_duration),
+            "-hls_flags", "split_by_time+temp_file",
+            "-hls_list_size", "3",
+            "-hls_segment_filename", os.path.join(self.output_dir, "%v", f"part-{self.run_id}-%05d.ts").replace("\\", "/"),
+            "-start_number", str(start_part),
+            "-var_stream_map", " ".join(f"v:{n},name:{level}" for n, level in enumerate(self.levels)),
+            os.path.join(self.output_dir, "%v", ".ffmpeg.m3u8").replace("\\", "/")
+        ]
+
+    def set_bitrate(self, video_bitrate):
+        """
+        次のセグメントから使うビットレートを設定する。変わった場合はセグメントの境界で ffmpeg を起動し直す。
+
+        Args:
+            video_bitrate (str | int): HLS各画質の基準となるビットレート（例: "3000k"）。
+        """
+        self._next_bitrate = video_bitrate
+
+    def _restart_encoder(self):
+        """現在のセグメントを書き終えた ffmpeg を終了し、次のビットレートで続きのパートから起動し直す。"""
+        super().close()
+        frame_count, first_frame_at, last_frame_at = self.frame_count, self.first_frame_at, self.last_frame_at
+        self.video_bitrate = self._next_bitrate
+        start_part = frame_count // self.frames_per_part
+        self._start(self.width, self.height, self.fps, self.pix_fmt, self._encoder_args(self.video_bitrate, start_part))
+        # パートの長さと glass-to-playlist の計測はストリーム全体のフレーム数で数える
+        self.frame_count, self.first_frame_at, self.last_frame_at = frame_count, first_frame_at, last_frame_at
+
+    def _part_name(self, index):
+        return f"part-{self.run_id}-{index:05d}.ts"
+
+    def _playlist_path(self, level):
+        return os.path.join(self.output_dir, level, f"{level}.m3u8")
+
+    def write(self, frame):
+        index = self.frame_count
+        if index > 0 and index % self.frames_per_segment == 0 and self._next_bitrate != self.video_bitrate:
+            self._restart_encoder()
+        super().write(frame)
+        self._frame_times[index] = self.last_frame_at
+
+    def _publish_loop(self):
+        interval = self.part_duration / 8
+        while not self._stop.wait(interval):
+            try:
+                self._publish_ready()
+            except Exception as e:
+                print(f"Error publishing LL-HLS parts: {e}")
+
+    def _publish_ready(self):
+        """全画質でそろったパートを番号順に公開する。"""
+        with self._lock:
+            while all(
+                os.path.exists(os.path.join(self.output_dir, level, self._part_name(self.published_parts)))
+                for level in self.levels
+            ):
+                self._publish_part(self.published_parts)
+                self.published_parts += 1
+
+    def _publish_part(self, index):
+        first_frame = index * self.frames_per_part
+        frame_count = max(1, min(self.frames_per_part, self.frame_count - first_frame))
+        duration = frame_count / self.fps
+        independent = index % self.parts_per_segment == 0
+
+        for level, playlist in self.playlists.items():
+            notify_published(os.path.join(self.output_dir, level, self._part_name(index)))
+            playlist.add_part(self._part_name(index), duration, independent)
+            playlist.preload_hint = self._part_name(index + 1)
+        if (index + 1) % self.parts_per_segment == 0:
+            self._complete_segment(index + 1 - self.parts_per_segment, index)
+        for level, playlist in self.playlists.items():
+            playlist.write(self._playlist_path(level))
+
+        published_at = time.perf_counter()
+        times = [self._frame_times.pop(n, None) for n in range(first_frame, first_frame + frame_count)]
+        times = [t for t in times if t is not None]
+        if self.latency_meter is not None and times:
+            self.latency_meter.record_times(index, times[0], times[-1], published_at)
+
+    def _complete_segment(self, first_part, last_part):
+        """パートを連結してセグメントファイルを作り、プレイリストに EXTINF として追加する。"""
+        msn = reserve_segment_indices(self.output_dir, self.levels, 1, self.segment_duration)
+        for level, playlist in self.playlists.items():
+            level_dir = os.path.join(self.output_dir, level)
+            segment_name = hls_segment_name(self.output_dir, level, msn, self.segment_duration)
+            temp_path = os.path.join(level_dir, f".{segment_name}.tmp")
+            with open(temp_path, "wb") as segment_file:
+                for index in range(first_part, last_part + 1):
+                    with open(os.path.join(level_dir, self._part_name(index)), "rb") as part_file:
+                        shutil.copyfileobj(part_file, segment_file)
+            os.replace(temp_path, os.path.join(level_dir, segment_name))
+            notify_published(os.path.join(level_dir, segment_name))
+            playlist.complete_segment(segment_name)
+
+        # プレイリストから外れたパートのファイルを削除する
+        self._segment_parts.append((first_part, last_part))
+        retained = self.playlists[self.levels[0]].retained_segments
+        if len(self._segment_parts) > retained + 1:
+            old_first, old_last = self._segment_parts.pop(0)
+            for level in self.levels:
+                for index in range(old_first, old_last + 1):
+                    path = os.path.join(self.output_dir, level, self._part_name(index))
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def close(self):
+        """
+        エンコードの完了を待ち、残りのパートと最後のセグメントを公開して EXT-X-ENDLIST を付ける。
+
+        Returns:
+            str: HLSファイルの出力ディレクトリ。
+        """
+        try:
+            super().close()
+        finally:
+            self._stop.set()
+            self._publisher.join()
+        self._publish_ready()
+        with self._lock:
+            segment_start = self.published_parts - self.published_parts % self.parts_per_segment
+            if self.published_parts > segment_start:
+                self._complete_segment(segment_start, self.published_parts - 1)
+            for level, playlist in self.playlists.items():
+                playlist.finish()
+                playlist.write(self._playlist_path(level))
+        return self.output_dir
+
+    def abort(self):
+        """エンコードを中断する。公開済みのパートとセグメントはそのまま残す。"""
+        self._stop.set()
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._publisher.join()
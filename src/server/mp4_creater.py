@@ -1,24 +1,36 @@
 
-import cv2
 import os
-import subprocess
 import traceback
-from src.server.foveated_compression import merge_frame, calculate_segment_bitrate
+from src.server.foveated_compression import merge_tier_frames, SegmentBitrateMeter
+from src.server.foveation_profile import DEFAULT_PROFILE, get_profile
 from src.server.server_function import frame_segmented
-from src.server.hls_server import get_video_bitrate
+from src.server.tier_reader import TierReader
+from src.server.frame_source import open_frame_source
+from src.server.segment_writer import SegmentWriter
+from src.server.hls_server import get_video_bitrate, SEGMENT_DURATION
 from src.server.gaze_prediction import GazeEstimator
-from src.client.playback.logger import VideoLogger
+from src.client.playback.logger import GazeLogger
 from src.bar_making import ProgressBar
     
-frame_buffer = []
+segment_writer = None
+segment_frame_count = 0
 segment_index = 0
 
-def mp4_create(input_video, input_frame, video_bitrate, low_res_path, med_res_path, high_res_path, window_width, window_height):
-    low_cap = cv2.VideoCapture(low_res_path)
-    med_cap = cv2.VideoCapture(med_res_path)
-    high_cap = cv2.VideoCapture(high_res_path)
+def mp4_create(input_video, input_frame, video_bitrate, low_res_path, med_res_path, high_res_path, window_width, window_height,
+               prefetch_depth=0, frame_source="opencv", segment_duration=SEGMENT_DURATION, profile=DEFAULT_PROFILE,
+               tier_paths=None, blend="hard"):
+    # 階層構成（外側から内側）と各階層の動画。profile は FoveationProfile またはその名前で、
+    # 周辺の階層が低い解像度でも合成時にウィンドウサイズへ拡大する
+    profile = get_profile(profile)
+    if tier_paths is None:
+        tier_paths = (low_res_path, med_res_path, high_res_path)
+    if len(tier_paths) != len(profile):
+        raise ValueError(f"Profile has {len(profile)} tiers but {len(tier_paths)} videos were given")
+    tier_caps = [open_frame_source(path, backend=frame_source) for path in tier_paths]
+    # ffmpeg のパイプでは前フレームの配列をデコード先として再利用する
+    reuse_buffers = frame_source == "ffmpeg"
     input_frame = input_frame
-    gaze_log = VideoLogger(log_dir="logs/gaze_prediction")
+    gaze_log = GazeLogger(log_dir="logs/gaze_prediction")
     progress_bar = ProgressBar(input_frame=input_frame)
 
     window_width = window_width
@@ -38,18 +50,32 @@ def mp4_create(input_video, input_frame, video_bitrate, low_res_path, med_res_pa
         (window_width - 50, window_height - 50)
     ]
     obstacle_points = gaze_estimator.generate_random_obstacles()
+    bitrate_meter = SegmentBitrateMeter(window_width, window_height, profile)
+    encoder_bitrate = None
     current_vector = (1, 0)
     last_gaze_position = (window_width // 2, window_height // 2)
 
-    while frame_counter < input_frame:
-        ret_low, frame_low = low_cap.read()
-        ret_med, frame_med = med_cap.read()
-        ret_high, frame_high = high_cap.read()
+    # 0より大きい場合は各階層を別スレッドで先読みデコードする
+    reader = None
+    if prefetch_depth > 0:
+        reader = TierReader(tier_caps, depth=prefetch_depth, reuse_buffers=reuse_buffers)
 
-        if not (ret_low and ret_med and ret_high):
+    frames = [None] * len(tier_caps)
+    while frame_counter < input_frame:
+        if reader is not None:
+            ret, _, frames = reader.read()
+        else:
+            ret = True
+            for index, cap in enumerate(tier_caps):
+                if reuse_buffers:
+                    ret_tier, frames[index] = cap.read(frames[index])
+                else:
+                    ret_tier, frames[index] = cap.read()
+                ret = ret and ret_tier
+
+        if not ret:
             break
 
-
         # フレームごとに障害物を更新（適切な頻度で更新）
         if frame_counter % 10 == 0:
             obstacle_points = gaze_estimator.generate_random_obstacles()
@@ -63,87 +89,120 @@ def mp4_create(input_video, input_frame, video_bitrate, low_res_path, med_res_pa
         )
 
         last_gaze_position = (gaze_x, gaze_y)
-        gaze_log.log_gaze_position(gaze_x, gaze_y)
+        gaze_log.log_gaze_position(gaze_x, gaze_y, frame_counter)
+        bitrate_meter.add(gaze_x, gaze_y)
 
         try:
-            combined_frame = merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y)
+            combined_frame = merge_tier_frames(frames, gaze_x, gaze_y, profile, blend=blend,
+                                               size=(window_height, window_width))
         except Exception as e:
             print(f"Error during frame merging: {e}\n")
             break
         
-        if frame_counter == 0:
-            video_bitrate = calculate_segment_bitrate(window_width, window_height)
-            
-        mp4_create_frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir)
+        # セグメントが完成したら次のセグメントの軌跡を積算し直す
+        video_bitrate = bitrate_meter.bitrate()
+        if mp4_create_frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir, segment_duration,
+                                      encoder_bitrate):
+            # 次のセグメントのエンコーダは、完成したセグメント全体の軌跡のビットレートで起動する
+            encoder_bitrate = video_bitrate
+            bitrate_meter.reset()
+        if reader is not None:
+            reader.release(frames)
 
         frame_counter += 1
         progress_bar.update(frame_counter)
 
-    low_cap.release()
-    med_cap.release()
-    high_cap.release()
+    if reader is not None:
+        reader.close()
+    # 規定数に満たない最後のセグメントも保存する
+    finish_segments()
+    gaze_log.close()
+    for cap in tier_caps:
+        cap.release()
 
-def mp4_create_frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir="segments/segmented_video", segment_duration=6):
+def mp4_create_frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir="segments/segmented_video",
+                               segment_duration=SEGMENT_DURATION, encoder_bitrate=None):
     """
     合成フレームをセグメント化します。
 
+    フレームはセグメントごとに起動した ffmpeg（libx264）の標準入力へ逐次書き込みます。
+    x264 のビットレートは起動時に決まるため、encoder_bitrate（直前のセグメント全体の
+    視線軌跡から求めたビットレート）を使います。
+
     Args:
         combined_frame (np.ndarray): 合成されたフレーム。
         input_frame (int): 1セグメントあたりのフレーム数。
         video_bitrate (str): ビットレート（例: "3000k"）。
         fps (int): 動画のフレームレート。
         segment_dir (str): セグメントファイルを保存するディレクトリ。
-        segment_duration (int): セグメントの長さ（秒単位）。
+        segment_duration (float): セグメントの長さ（秒単位）。
+        encoder_bitrate (str, optional): セグメントを始めるときに x264 に渡すビットレート。
+            None（最初のセグメント）の場合は video_bitrate を使う。
     """
-    global frame_buffer, segment_index
+    global segment_writer, segment_frame_count, segment_index
 
     # セグメントディレクトリを作成
     segment_dir = os.path.abspath(segment_dir)
     os.makedirs(segment_dir, exist_ok=True)
 
-    thirty_sec = fps * 30
-
-    frame_buffer.append(combined_frame)
+    frames_per_segment = max(1, round(fps * segment_duration))
 
-    # フレームが規定数に達したらセグメントを保存
-    if len(frame_buffer) >= thirty_sec:
-        segment_path = os.path.join(segment_dir, f"segment_{segment_index:04d}.mp4")
-        temp_raw_file = os.path.join(segment_dir, f"segment_{segment_index:04d}_raw.mp4")
+    segment_path = os.path.join(segment_dir, f"segment_{segment_index:04d}.mp4")
 
-        try:
-            # OpenCVを使用して一時ファイルを作成
-            height, width, _ = frame_buffer[0].shape
-            out = cv2.VideoWriter(temp_raw_file, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
-            for frame in frame_buffer:
-                out.write(frame)
-            out.release()
-
-            print(f"未エンコードセグメントを保存しました: {temp_raw_file}")
-
-            # FFmpegを使用してエンコード
-            video_bitrate_str = f"{video_bitrate}k" if isinstance(video_bitrate, int) else video_bitrate
-            ffmpeg_command = [
-                "ffmpeg", "-y", "-i", temp_raw_file,
-                "-c:v", "libx264", "-preset", "fast",
-                "-b:v", video_bitrate_str, "-maxrate", video_bitrate_str,
-                "-bufsize", "3M", segment_path
-            ]
-            subprocess.run(ffmpeg_command, check=True)
+    try:
+        if segment_writer is None:
+            height, width, _ = combined_frame.shape
+            segment_writer = SegmentWriter(segment_path, width, height, fps, encoder_bitrate or video_bitrate)
+        segment_writer.write(combined_frame)
+        segment_frame_count += 1
 
+        # フレームが規定数に達したらセグメントを保存
+        if segment_frame_count >= frames_per_segment:
+            segment_writer.close()
+            segment_writer = None
+            segment_frame_count = 0
             print(f"セグメントを保存しました: {segment_path}")
+            segment_index += 1
+            return True
+
+    except Exception as e:
+        print(f"セグメント保存エラー: {segment_path}")
+        print(traceback.format_exc())
+        if segment_writer is not None:
+            segment_writer.abort()
+        segment_writer = None
+        segment_frame_count = 0
+        return False
 
-            # 一時ファイルを削除
-            os.remove(temp_raw_file)
-
-        except Exception as e:
-            print(f"セグメント保存エラー: {segment_path}")
-            print(traceback.format_exc())
-            frame_buffer.clear()
-            return False
+    return False
 
-        # フレームバッファをクリアし、次のセグメントの準備
-        frame_buffer.clear()
-        segment_index += 1
-        return True
+def finish_segments():
+    """
+    フレームループの終了時に、規定数に満たない書き込み中のセグメントを保存する。
+    フレームを1枚も書いていないライターは破棄する。
 
-    return False
+    Returns:
+        bool: セグメントを保存したか。
+    """
+    global segment_writer, segment_frame_count, segment_index
+
+    if segment_writer is None:
+        return False
+    writer = segment_writer
+    segment_writer = None
+    frame_count = segment_frame_count
+    segment_frame_count = 0
+    if frame_count == 0:
+        writer.abort()
+        return False
+
+    try:
+        writer.close()
+    except Exception as e:
+        print(f"セグメント保存エラー: {writer.segment_path}")
+        print(traceback.format_exc())
+        writer.abort()
+        return False
+    print(f"セグメントを保存しました: {writer.segment_path}")
+    segment_index += 1
+    return True
@@ -0,0 +1,92 @@
+"""
+合成したフレームがプレイリストに載るまでの時間（glass-to-playlist レイテンシ）の計測。
+
+セグメントの先頭フレームは、セグメント長のバッファリング・エンコード・HLS生成をすべて待つため
+最も遅れてプレイリストに載る。最後のフレームはエンコードとHLS生成の待ち時間だけを含む。
+SegmentWriter が記録した書き込み時刻と、各画質の m3u8 に公開した時刻の差を
+セグメントごとに記録し、平均・95パーセンタイル・最大を表示する。
+"""
+import threading
+import time
+import numpy as np
+
+
+class PlaylistLatencyMeter:
+    def __init__(self, verbose=True):
+        """
+        Args:
+            verbose (bool): セグメントを記録するたびにレイテンシを表示する。
+        """
+        self.verbose = verbose
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def record(self, segment_index, segment_writer, published_at=None):
+        """
+        公開したセグメントのレイテンシを記録する。
+
+        Args:
+            segment_index (int): セグメント番号。
+            segment_writer (SegmentWriter): フレームの書き込み時刻を持つライター。
+            published_at (float, optional): プレイリストに公開した時刻（time.perf_counter()）。
+
+        Returns:
+            Tuple[float, float]: (先頭フレームのレイテンシ, 最後のフレームのレイテンシ)（秒）。
+        """
+        if segment_writer.first_frame_at is None:
+            return None
+        return self.record_times(segment_index, segment_writer.first_frame_at, segment_writer.last_frame_at,
+                                 published_at)
+
+    def record_times(self, index, first_frame_at, last_frame_at, published_at=None):
+        """
+        書き込み時刻を直接指定してレイテンシを記録する（LL-HLSのパートなど）。
+
+        Args:
+            index (int): セグメントまたはパートの番号。
+            first_frame_at (float): 先頭フレームを書き込んだ時刻（time.perf_counter()）。
+            last_frame_at (float): 最後のフレームを書き込んだ時刻（time.perf_counter()）。
+            published_at (float, optional): プレイリストに公開した時刻（time.perf_counter()）。
+
+        Returns:
+            Tuple[float, float]: (先頭フレームのレイテンシ, 最後のフレームのレイテンシ)（秒）。
+        """
+        if published_at is None:
+            published_at = time.perf_counter()
+        first = published_at - first_frame_at
+        last = published_at - last_frame_at
+        with self._lock:
+            self.samples.append((index, first, last))
+        if self.verbose:
+            print(f"Glass-to-playlist latency (segment {index}): "
+                  f"first frame {first * 1000:.0f} ms, last frame {last * 1000:.0f} ms")
+        return first, last
+
+    def summary(self):
+        """
+        記録したレイテンシの統計。
+
+        Returns:
+            dict: セグメント数と、先頭・最後のフレームそれぞれの平均・95パーセンタイル・最大（ms）。
+        """
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return {"segments": 0}
+        result = {"segments": len(samples)}
+        for name, column in (("first_frame", 1), ("last_frame", 2)):
+            values = np.array([sample[column] for sample in samples]) * 1000
+            result[f"{name}_mean_ms"] = float(values.mean())
+            result[f"{name}_p95_ms"] = float(np.percentile(values, 95))
+            result[f"{name}_max_ms"] = float(values.max())
+        return result
+
+    def report(self):
+        summary = self.summary()
+        if summary["segments"] == 0:
+            print("Glass-to-playlist latency: no segments were published")
+            return
+        print(f"Glass-to-playlist latency over {summary['segments']} segments:")
+        for name in ("first_frame", "last_frame"):
+            print(f"  {name.replace('_', ' ')}: mean {summary[f'{name}_mean_ms']:.0f} ms, "
+                  f"p95 {summary[f'{name}_p95_ms']:.0f} ms, max {summary[f'{name}_max_ms']:.0f} ms")
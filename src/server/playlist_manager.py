@@ -0,0 +1,256 @@
+"""
+各画質のメディアプレイリスト（{level}.m3u8）をメモリ上のセグメント一覧から書き出す。
+
+従来の append_to_m3u8 はセグメントを公開するたびに os.listdir と文字列ソートでディレクトリを走査し、
+実際の長さではなく目標の長さを EXTINF に書き、毎回 PLAYLIST-TYPE:VOD と EXT-X-ENDLIST を付けていた。
+そのため長時間の配信では処理が O(セグメント数²) になり、ライブ再生もできなかった。
+
+PlaylistManager はセグメント番号と各画質のセグメント一覧をメモリに持ち、ffmpeg が計測した
+実際の長さで EXTINF を追加する。モードは次の2つ。
+    event   : PLAYLIST-TYPE:EVENT。セグメントを削除せず追記する（途中から見始めても先頭に戻れる）。
+    sliding : 直近 window_size 個のセグメントだけを載せ、外れた分だけ EXT-X-MEDIA-SEQUENCE を進める。
+配信の終了時に finish() で EXT-X-ENDLIST を付ける。プレイリストは一時ファイルに書いてから
+置き換えるため、プレイヤーが書きかけのファイルを読むことはない。
+
+公開したセグメントと書き出したプレイリストのパスは add_publish_listener で登録した関数に通知する
+（同じプロセスで動く配信サーバーがキャッシュを無効化するため）。
+
+セグメントのファイル名には配信ごとの run_id を含める（segment_name）。セグメント番号は配信ごとに
+0 から振り直すため、番号だけの名前では前回の配信と同じURIが別の内容を指し、ブラウザや
+中継キャッシュが古いセグメントを再生してしまう。URIが一意なら、公開したセグメントの内容は
+変わらないので、配信サーバーはセグメントを immutable としてキャッシュさせられる。
+"""
+import math
+import os
+import tempfile
+import threading
+import uuid
+from collections import deque
+
+PLAYLIST_MODES = ("event", "sliding")
+
+# 出力ディレクトリごとの PlaylistManager
+playlist_managers = {}
+_managers_lock = threading.Lock()
+
+# セグメントやプレイリストを公開するたびに、変更したファイルの絶対パスを渡して呼ぶ関数
+publish_listeners = []
+
+
+def add_publish_listener(listener):
+    """公開の通知を受け取る関数を登録する。"""
+    publish_listeners.append(listener)
+
+
+def remove_publish_listener(listener):
+    if listener in publish_listeners:
+        publish_listeners.remove(listener)
+
+
+def notify_published(path):
+    """path（セグメントまたはプレイリスト）が書き換わったことを登録済みの関数に通知する。"""
+    path = os.path.abspath(path)
+    for listener in list(publish_listeners):
+        try:
+            listener(path)
+        except Exception as e:
+            print(f"Error notifying publish listener: {e}")
+
+
+def write_playlist_atomic(path, text):
+    """
+    プレイリストを一時ファイルに書き出してから置き換える（プレイヤーが書きかけのファイルを読まないため）。
+
+    一時ファイルは書き込みごとに別の名前で作るため、複数のスレッドが同じプレイリストを書いても
+    互いの一時ファイルを置き換えることはない。失敗した場合は一時ファイルを削除する。
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.",
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp は所有者のみ読める権限で作るため、通常のファイルと同じ権限にする
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    notify_published(path)
+
+
+def read_playlist_segments(path):
+    """
+    メディアプレイリストからセグメントと長さの一覧を読み出す。
+
+    Args:
+        path (str): メディアプレイリストのパス。
+
+    Returns:
+        list: (セグメントのファイル名, 長さ（秒）) のリスト。
+    """
+    segments = []
+    duration = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            elif line and not line.startswith("#") and duration is not None:
+                segments.append((line, duration))
+                duration = None
+    return segments
+
+
+class MediaPlaylist:
+    def __init__(self, path, target_duration, mode="event", window_size=6):
+        """
+        Args:
+            path (str): 書き出すメディアプレイリストのパス。
+            target_duration (float): セグメントの目標の長さ（秒）。
+            mode (str): "event" または "sliding"。
+            window_size (int): sliding モードでプレイリストに残すセグメント数。
+        """
+        if mode not in PLAYLIST_MODES:
+            raise ValueError(f"Unknown playlist mode: {mode} (expected one of {PLAYLIST_MODES})")
+        if window_size < 1:
+            raise ValueError("The playlist window needs at least one segment")
+        self.path = path
+        self.mode = mode
+        self.window_size = window_size
+        self.target_duration = math.ceil(target_duration)
+        self.media_sequence = 0
+        self.segments = deque()  # 各要素は描画済みの "#EXTINF:...\nsegment.ts\n"
+        self.ended = False
+
+    def append(self, uri, duration):
+        """セグメントを1つ追加する。sliding モードでは窓から外れた先頭を取り除く。"""
+        # EXT-X-TARGETDURATION は途中で変えてはならないため、構築時の値のまま警告だけ出す
+        # （EXTINF を四捨五入した値がこれを超えると、プレイヤーによっては再生が止まる）
+        if round(duration) > self.target_duration:
+            print(f"Segment {uri} is {duration:.3f}s, longer than EXT-X-TARGETDURATION {self.target_duration}s")
+        self.segments.append(f"#EXTINF:{duration:.6f},\n{uri}\n")
+        if self.mode == "sliding":
+            while len(self.segments) > self.window_size:
+                self.segments.popleft()
+                self.media_sequence += 1
+
+    def render(self):
+        header = [
+            "#EXTM3U\n",
+            "#EXT-X-VERSION:3\n",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}\n",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}\n",
+        ]
+        if self.mode == "event":
+            header.append("#EXT-X-PLAYLIST-TYPE:EVENT\n")
+        footer = ["#EXT-X-ENDLIST\n"] if self.ended else []
+        return "".join(header + list(self.segments) + footer)
+
+    def write(self):
+        write_playlist_atomic(self.path, self.render())
+
+
+class PlaylistManager:
+    def __init__(self, output_dir, target_duration, mode="event", window_size=6):
+        """
+        Args:
+            output_dir (str): HLSファイルの出力ディレクトリ。
+            target_duration (float): セグメントの目標の長さ（秒）。
+            mode (str): "event" または "sliding"。
+            window_size (int): sliding モードでプレイリストに残すセグメント数。
+        """
+        if mode not in PLAYLIST_MODES:
+            raise ValueError(f"Unknown playlist mode: {mode} (expected one of {PLAYLIST_MODES})")
+        self.output_dir = output_dir
+        self.target_duration = target_duration
+        self.mode = mode
+        self.window_size = window_size
+        self.playlists = {}
+        self.next_index = 0
+        # セグメントのファイル名に含める配信ごとのID
+        self.run_id = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        """
+        全画質で共通の count 個のセグメント番号を予約し、先頭の番号を返す。
+        """
+        with self._lock:
+            start_index = self.next_index
+            self.next_index += count
+            return start_index
+
+    def segment_name(self, level, index):
+        """画質 level の index 番のセグメントのファイル名。"""
+        return f"segment-{self.run_id}-{level}-{index:03d}.ts"
+
+    def playlist(self, level):
+        """画質 level のメディアプレイリスト（初回に作成）。"""
+        if level not in self.playlists:
+            path = os.path.join(self.output_dir, level, f"{level}.m3u8")
+            self.playlists[level] = MediaPlaylist(path, self.target_duration, self.mode, self.window_size)
+        return self.playlists[level]
+
+    def publish(self, segments):
+        """
+        セグメントをプレイリストに追加し、変更した画質のプレイリストを書き出す。
+
+        Args:
+            segments (dict): 画質名から (セグメントのファイル名, 長さ（秒）) のリストへの辞書。
+        """
+        with self._lock:
+            for level, entries in segments.items():
+                if not entries:
+                    print(f"No segments found for {level}. Skipping m3u8 generation.")
+                    continue
+                playlist = self.playlist(level)
+                for uri, duration in entries:
+                    notify_published(os.path.join(self.output_dir, level, uri))
+                    playlist.append(uri, duration)
+                playlist.write()
+
+    def finish(self):
+        """すべてのプレイリストに EXT-X-ENDLIST を付けて書き出す。"""
+        with self._lock:
+            for playlist in self.playlists.values():
+                playlist.ended = True
+                playlist.write()
+
+
+def open_playlist_manager(output_dir, target_duration, mode="event", window_size=6):
+    """
+    出力ディレクトリの PlaylistManager を新しく作る（配信の開始時に呼ぶ）。
+
+    セグメント番号は 0 から振り直し、既存のプレイリストは最初の公開で置き換わる。
+    前回までの配信のセグメントはどのプレイリストにも載らなくなるため削除する。
+    """
+    manager = PlaylistManager(output_dir, target_duration, mode, window_size)
+    remove_previous_segments(output_dir)
+    with _managers_lock:
+        playlist_managers[os.path.abspath(output_dir)] = manager
+    return manager
+
+
+def remove_previous_segments(output_dir):
+    """各画質のディレクトリから前回までの配信のセグメント（segment-*.ts）を削除する。"""
+    if not os.path.isdir(output_dir):
+        return
+    for level in os.listdir(output_dir):
+        level_dir = os.path.join(output_dir, level)
+        if not os.path.isdir(level_dir):
+            continue
+        for name in os.listdir(level_dir):
+            if name.startswith("segment-") and name.endswith(".ts"):
+                os.remove(os.path.join(level_dir, name))
+
+
+def get_playlist_manager(output_dir, target_duration):
+    """出力ディレクトリの PlaylistManager を返す。まだなければ event モードで作成する。"""
+    key = os.path.abspath(output_dir)
+    with _managers_lock:
+        if key not in playlist_managers:
+            playlist_managers[key] = PlaylistManager(output_dir, target_duration)
+        return playlist_managers[key]
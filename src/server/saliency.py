@@ -0,0 +1,150 @@
+"""
+低解像度の階層のフレームから、視線が向かいやすい点（顕著点）を求める。
+
+generate_random_obstacles の障害物はランダムなので、視線（高解像度の領域）は映像の内容と
+関係なく動いていた。SaliencyPredictor は低画質の階層のフレームを小さなサムネイル
+（既定で幅 160 px）に縮小し、次の2つの安価な手がかりから顕著度マップを作る。
+    動き         : 前のサムネイルとのフレーム差分
+    コントラスト : サムネイルとその平滑化（周辺の平均）との差
+マップはフレームごとに指数移動平均で更新し、値の大きい点を重ならないように points 個選んで
+ウィンドウ座標に変換する。GazeEstimator の環境構造コストは障害物までの平均距離なので、
+この点を障害物として渡すと、視線は動きやコントラストの大きい場所に寄る。ただし論文の重み
+（λ_e=0.3）では画面の四隅への境界コスト（λ_b=0.4）が勝ってしまうため、顕著点を使うときは
+GazeEstimator.lambda_e を SALIENCY_LAMBDA_E に上げる。
+
+縮小後だけを処理するため、1080p の入力でも1フレームあたり数ミリ秒で、1コアで 30fps に間に合う。
+"""
+import cv2
+import numpy as np
+
+# サムネイルの幅（ピクセル）。高さは入力のアスペクト比から決める
+THUMBNAIL_WIDTH = 160
+# 顕著点を障害物として使うときの GazeEstimator.lambda_e（境界コストより顕著点を優先する）
+SALIENCY_LAMBDA_E = 1.0
+
+
+class SaliencyPredictor:
+    def __init__(self, window_width, window_height, thumbnail_width=THUMBNAIL_WIDTH, points=3, decay=0.7,
+                 motion_weight=1.0, contrast_weight=0.5, surround=9, suppression=0.15, min_saliency=2.0,
+                 relative_saliency=0.5, margin=100):
+        """
+        Args:
+            window_width (int): 視線の座標系（合成後のウィンドウ）の幅。
+            window_height (int): 視線の座標系の高さ。
+            thumbnail_width (int): 顕著度を計算するサムネイルの幅。
+            points (int): 1回に返す顕著点の最大数。
+            decay (float): 顕著度マップの指数移動平均で前のマップに掛ける重み（0 なら毎フレーム作り直す）。
+            motion_weight (float): フレーム差分の重み。
+            contrast_weight (float): 局所コントラストの重み。
+            surround (int): コントラストの周辺とする平滑化の大きさ（サムネイルのピクセル）。
+            suppression (float): 選んだ点の周囲で次の点を選ばない範囲（サムネイルの幅に対する割合）。
+            min_saliency (float): これより顕著度の低い点は返さない（何も動かない平坦な映像など）。
+            relative_saliency (float): 2点目以降は、最も顕著な点の顕著度にこの割合を掛けた値以上の点だけを返す
+                （障害物の平均距離が弱い点に引きずられないため）。
+            margin (int): 顕著点をウィンドウの端から離す距離（generate_random_obstacles と同じ範囲に収める）。
+        """
+        if not 0 <= decay < 1:
+            raise ValueError("decay must be in [0, 1)")
+        self.window_width = window_width
+        self.window_height = window_height
+        self.thumbnail_width = thumbnail_width
+        self.points = points
+        self.decay = decay
+        self.motion_weight = motion_weight
+        self.contrast_weight = contrast_weight
+        self.surround = surround
+        self.suppression = suppression
+        self.min_saliency = min_saliency
+        self.relative_saliency = relative_saliency
+        self.margin = margin
+        self.thumbnail_size = None
+        self.saliency_map = None
+        self.frames = 0
+        self._previous = None
+        self._gray = None
+        self._scratch = None
+
+    def _thumbnail(self, frame):
+        """フレームを縮小してグレースケールの float32 にする（縮小してから変換するので安い）。"""
+        if self.thumbnail_size is None:
+            height, width = frame.shape[:2]
+            thumbnail_height = max(1, round(self.thumbnail_width * height / width))
+            self.thumbnail_size = (self.thumbnail_width, thumbnail_height)
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self._gray is None:
+            self._gray = np.empty(small.shape, dtype=np.float32)
+        np.copyto(self._gray, small, casting="unsafe")
+        return self._gray
+
+    def update(self, frame):
+        """
+        低画質の階層のフレームを1枚取り込み、顕著度マップを更新する。
+
+        Args:
+            frame (np.ndarray): BGR またはグレースケールのフレーム（大きさは任意）。
+
+        Returns:
+            np.ndarray: 更新後の顕著度マップ（サムネイルの大きさ、float32）。
+        """
+        gray = self._thumbnail(frame)
+
+        # 局所コントラスト: 周辺の平均との差
+        saliency = cv2.blur(gray, (self.surround, self.surround))
+        cv2.absdiff(gray, saliency, dst=saliency)
+        saliency *= self.contrast_weight
+
+        # 動き: 前のサムネイルとの差分
+        if self._previous is None:
+            self._previous = gray.copy()
+            self._scratch = np.empty_like(gray)
+        else:
+            cv2.absdiff(gray, self._previous, dst=self._scratch)
+            cv2.scaleAdd(self._scratch, self.motion_weight, saliency, dst=saliency)
+            np.copyto(self._previous, gray)
+
+        # 指数移動平均でフレーム間のちらつきを抑える
+        if self.saliency_map is None:
+            self.saliency_map = saliency
+        else:
+            cv2.addWeighted(self.saliency_map, self.decay, saliency, 1 - self.decay, 0, dst=self.saliency_map)
+        self.frames += 1
+        return self.saliency_map
+
+    def interest_points(self):
+        """
+        顕著度の大きい点をウィンドウ座標で返す（GazeEstimator に障害物として渡す）。
+
+        一度選んだ点の周囲を除外しながら最大値を points 回探す。2点目以降は最も顕著な点に比べて
+        十分に顕著な点（relative_saliency）だけを返す。
+
+        Returns:
+            list: (x, y) のリスト。顕著度マップがまだないか、十分に顕著な点がなければ空。
+        """
+        if self.saliency_map is None:
+            return []
+        # 近い画素の最大値に引きずられないよう、少し平滑化してから探す
+        saliency = cv2.GaussianBlur(self.saliency_map, (5, 5), 0)
+        thumbnail_width, thumbnail_height = self.thumbnail_size
+        radius = max(1, int(self.suppression * thumbnail_width))
+        scale_x = self.window_width / thumbnail_width
+        scale_y = self.window_height / thumbnail_height
+
+        points = []
+        threshold = self.min_saliency
+        for _ in range(self.points):
+            index = int(np.argmax(saliency))
+            y, x = divmod(index, thumbnail_width)
+            if saliency[y, x] < threshold:
+                break
+            if not points:
+                threshold = max(threshold, self.relative_saliency * float(saliency[y, x]))
+            saliency[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = 0
+            # 画素の中心をウィンドウ座標に変換し、端から margin の範囲に収める
+            window_x = int((x + 0.5) * scale_x)
+            window_y = int((y + 0.5) * scale_y)
+            window_x = max(self.margin, min(window_x, self.window_width - self.margin))
+            window_y = max(self.margin, min(window_y, self.window_height - self.margin))
+            points.append((window_x, window_y))
+        return points
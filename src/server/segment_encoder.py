@@ -0,0 +1,229 @@
+"""
+セグメントのエンコードとHLS生成をバックグラウンドで行うサービス。
+
+frame_segmented がセグメントの完成時に SegmentWriter の終了待ちと3画質分のHLS生成を
+同期的に実行すると、その間フレームの合成が止まり、出力が断続的になる。
+SegmentEncodeService は上限付きのジョブキューと複数のエンコードワーカーを持ち、
+完成したセグメントをキューに積むだけでフレームループに戻る。キューが満杯のときだけ
+submit() がブロックし、VideoStreaming.run に背圧をかける。
+
+ワーカーは並列に処理を終えるが、プレイリストへの公開はセグメントの投入順に行う。
+HLSのセグメント番号は投入時に予約するため、後続のセグメントが先に完成しても
+番号が入れ替わることはない。失敗したセグメントは failures に記録し、公開をスキップする。
+
+HLSSegmentWriter（direct モード）のセグメントは書き込み時点でHLSとしてエンコード済みのため、
+ワーカーはエンコードの完了を待って公開するだけで、再エンコードは行わない。
+"""
+import os
+import queue
+import threading
+import time
+import traceback
+from src.server.hls_server import (
+    HLS_RESOLUTIONS, SEGMENT_DURATION, hls_rendition_bitrates, hls_segment_count, reserve_segment_indices, encode_hls_renditions,
+    publish_hls_renditions, hls_segment_name
+)
+from src.server.segment_writer import HLSSegmentWriter
+
+_STOP = object()
+
+
+class SegmentJob:
+    def __init__(self, sequence, segment_index, segment_writer, video_bitrate, fps, levels, hls_start_index, hls_segment_count):
+        """
+        Args:
+            sequence (int): 投入順の通し番号（公開順）。
+            segment_index (int): セグメント番号。
+            segment_writer (SegmentWriter): フレームを書き終えたセグメントのライター。
+            video_bitrate (str): HLS生成に使うビットレート（例: "3000k"）。
+            fps (int): 動画のフレームレート。
+            levels (list): 生成する画質名。
+            hls_start_index (int): 予約済みの先頭HLSセグメント番号（全画質で共通）。
+            hls_segment_count (int): 画質ごとに予約したHLSセグメント数。
+        """
+        self.sequence = sequence
+        self.segment_index = segment_index
+        self.segment_writer = segment_writer
+        self.segment_path = segment_writer.segment_path
+        self.video_bitrate = video_bitrate
+        self.fps = fps
+        self.levels = levels
+        self.hls_start_index = hls_start_index
+        self.hls_segment_count = hls_segment_count
+        self.direct = isinstance(segment_writer, HLSSegmentWriter)
+        self.segments = None  # 各画質の (セグメントのファイル名, 長さ（秒）) のリスト
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.finished_at = None
+
+    @property
+    def hls_last_index(self):
+        return self.hls_start_index + self.hls_segment_count - 1
+
+
+class SegmentEncodeService:
+    def __init__(self, workers=2, max_pending=4, hls_output_dir="segments/hls_file", resolutions=HLS_RESOLUTIONS,
+                 segment_time=SEGMENT_DURATION, on_published=None, latency_meter=None):
+        """
+        Args:
+            workers (int): エンコードワーカーのスレッド数。
+            max_pending (int): 処理待ちジョブの上限。超えると submit() がブロックする。
+            hls_output_dir (str): HLSファイルの出力ディレクトリ。
+            resolutions (list): 解像度のリスト (width, height)。
+            segment_time (float): HLSセグメントの時間（秒）。
+            on_published (callable, optional): セグメントを公開するたびに SegmentJob を渡して呼ぶ関数。
+            latency_meter (PlaylistLatencyMeter, optional): 公開時に glass-to-playlist レイテンシを記録する。
+        """
+        if workers < 1:
+            raise ValueError("The segment encoder needs at least one worker")
+        if max_pending < 1:
+            raise ValueError("The segment job queue needs room for at least one job")
+        self.hls_output_dir = hls_output_dir
+        self.resolutions = resolutions
+        self.segment_time = segment_time
+        self.on_published = on_published
+        self.latency_meter = latency_meter
+
+        self.published = []
+        self.failures = {}
+        self.backpressure_waits = 0
+
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._finished = {}
+        self._next_sequence = 0
+        self._next_publish = 0
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"segment-encoder-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def pending(self):
+        """処理待ちのジョブ数。"""
+        return self._jobs.qsize()
+
+    def submit(self, segment_index, segment_writer, video_bitrate, fps):
+        """
+        フレームを書き終えたセグメントをエンコードキューに積む。キューが満杯の場合は空くまで待つ。
+
+        Args:
+            segment_index (int): セグメント番号。
+            segment_writer (SegmentWriter): フレームを書き終えたセグメントのライター。
+            video_bitrate (str): HLS生成に使うビットレート（例: "3000k"）。
+            fps (int): 動画のフレームレート。
+        """
+        if self._closed:
+            raise RuntimeError("The segment encoder has been closed")
+
+        if isinstance(segment_writer, HLSSegmentWriter):
+            # direct モードでは書き込み開始時に番号を予約済み
+            levels = segment_writer.levels
+            start_index = segment_writer.start_index
+            segment_count = segment_writer.segment_count
+        else:
+            # 強制キーフレームで segment_time ごとに分割されるため、生成されるHLSセグメント数は事前に決まる
+            segment_count = hls_segment_count(segment_writer.frame_count, fps, self.segment_time)
+            levels = list(hls_rendition_bitrates(video_bitrate))[:len(self.resolutions)]
+            start_index = reserve_segment_indices(self.hls_output_dir, levels, segment_count, self.segment_time)
+
+        job = SegmentJob(self._next_sequence, segment_index, segment_writer, video_bitrate, fps,
+                         levels, start_index, segment_count)
+        self._next_sequence += 1
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            # キューが満杯のときだけフレームループを待たせる
+            self.backpressure_waits += 1
+            self._jobs.put(job)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is _STOP:
+                return
+            try:
+                self._encode(job)
+            except Exception as e:
+                job.error = e
+                print(f"セグメントのエンコードに失敗しました: {job.segment_path}")
+                print(traceback.format_exc())
+            job.finished_at = time.perf_counter()
+            self._finish(job)
+
+    def _encode(self, job):
+        """セグメントのエンコード完了を待ち、予約した番号でHLSの全画質を1回の ffmpeg で生成する。"""
+        try:
+            job.segment_writer.close()
+        except Exception:
+            job.segment_writer.abort()
+            raise
+        if job.direct:
+            job.segments = job.segment_writer.segments
+            return
+        print(f"セグメントを保存しました: {job.segment_path}")
+
+        job.segments = encode_hls_renditions(job.segment_path, self.hls_output_dir, self.resolutions, job.video_bitrate,
+                              job.hls_start_index, self.segment_time, job.fps)
+
+    def _finish(self, job):
+        """完了したジョブを記録し、投入順で先頭から連続して完了しているものを公開する。"""
+        with self._lock:
+            self._finished[job.sequence] = job
+            while self._next_publish in self._finished:
+                ready = self._finished.pop(self._next_publish)
+                self._next_publish += 1
+                if ready.error is None:
+                    try:
+                        self._publish(ready)
+                    except Exception as e:
+                        # 公開の失敗でワーカーを止めず、後続のセグメントの公開を続ける
+                        ready.error = e
+                        self.failures[ready.segment_index] = e
+                        print(f"セグメントの公開に失敗しました: {ready.segment_path}")
+                        print(traceback.format_exc())
+                else:
+                    self._discard(ready)
+
+    def _publish(self, job):
+        publish_hls_renditions(self.hls_output_dir, job.segments, self.segment_time)
+        if self.latency_meter is not None:
+            self.latency_meter.record(job.segment_index, job.segment_writer)
+        self.published.append(job.segment_index)
+        print(f"HLSファイルを生成しました: {self.hls_output_dir}")
+        if self.on_published is not None:
+            self.on_published(job)
+
+    def _discard(self, job):
+        """失敗したセグメントを記録し、生成途中のHLSセグメントを削除する。"""
+        self.failures[job.segment_index] = job.error
+        for level in job.levels:
+            for index in range(job.hls_start_index, job.hls_last_index + 1):
+                name = hls_segment_name(self.hls_output_dir, level, index, self.segment_time)
+                path = os.path.join(self.hls_output_dir, level, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        """
+        投入済みのジョブをすべて処理してからワーカーを停止する。
+
+        Returns:
+            dict: セグメント番号から例外への辞書（失敗したセグメント）。
+        """
+        if not self._closed:
+            self._closed = True
+            for _ in self._workers:
+                self._jobs.put(_STOP)
+            for worker in self._workers:
+                worker.join()
+        return self.failures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
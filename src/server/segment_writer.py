@@ -0,0 +1,177 @@
+"""
+合成フレームを ffmpeg（libx264）の標準入力へ直接流し込むセグメントライター。
+
+従来は1セグメント分（30秒 = 900フレーム、1080pで約5.6GB）のフレームをリストに溜め、
+cv2.VideoWriter（mp4v）で一時ファイル _raw.mp4 に書き出してから ffmpeg で libx264 に
+再エンコードしていた。SegmentWriter はセグメントごとに ffmpeg -f rawvideo -i - を起動し、
+合成されたフレームをその都度標準入力に書き込むため、フレームのリスト・一時ファイル・
+mp4v による劣化した中間エンコードが不要になり、ピークメモリは数フレーム分に収まる。
+
+x264 のビットレートはプロセス起動時に決める必要があるため、呼び出し側は直前のセグメント
+全体の視線軌跡から求めたビットレートを渡す（最初のセグメントだけは先頭フレームの時点の値）。
+
+HLSSegmentWriter（direct モード）は同じパイプから全画質のHLSセグメントを直接書き出し、
+mp4 へのエンコードとHLS用の再エンコードの2回目を省く。
+"""
+import os
+import shutil
+import subprocess
+import time
+import numpy as np
+from src.server.hls_server import (
+    SEGMENT_DURATION, hls_rendition_args, hls_run_id, hls_staging_dir, collect_hls_renditions
+)
+
+
+class SegmentWriter:
+    def __init__(self, segment_path, width, height, fps, video_bitrate, pix_fmt="bgr24",
+                 preset="fast", bufsize="3M", extra_args=()):
+        """
+        Args:
+            segment_path (str): 出力するセグメントファイルのパス。
+            width (int): フレームの幅。
+            height (int): フレームの高さ。
+            fps (int): フレームレート。
+            video_bitrate (str | int): ビットレート（例: "3000k" または 3000）。
+            pix_fmt (str): 書き込むフレームのピクセルフォーマット。
+            preset (str): libx264 のプリセット。
+            bufsize (str): レート制御のバッファサイズ。
+            extra_args (Sequence[str]): 出力ファイルの直前に追加する ffmpeg の引数。
+        """
+        self.segment_path = segment_path
+        video_bitrate_str = f"{video_bitrate}k" if isinstance(video_bitrate, int) else video_bitrate
+
+        output_args = [
+            "-an",
+            "-c:v", "libx264", "-preset", preset,
+            "-b:v", video_bitrate_str, "-maxrate", video_bitrate_str,
+            "-bufsize", bufsize, "-pix_fmt", "yuv420p",
+            *extra_args,
+            segment_path
+        ]
+        self._start(width, height, fps, pix_fmt, output_args)
+
+    def _start(self, width, height, fps, pix_fmt, output_args):
+        """標準入力から生のフレームを受け取る ffmpeg を起動する。"""
+        self.frame_count = 0
+        # 最初と最後のフレームを書き込んだ時刻（glass-to-playlist の計測用）
+        self.first_frame_at = None
+        self.last_frame_at = None
+        self.command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", pix_fmt,
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            *output_args
+        ]
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        """
+        合成フレームを1枚エンコーダに渡す。呼び出し後は frame を再利用してよい。
+
+        Args:
+            frame (np.ndarray): (高さ, 幅, 3) の uint8 フレーム。
+        """
+        if not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame)
+        try:
+            self._process.stdin.write(frame.data)
+        except BrokenPipeError:
+            returncode = self._process.wait()
+            raise subprocess.CalledProcessError(returncode, self.command)
+        self.last_frame_at = time.perf_counter()
+        if self.first_frame_at is None:
+            self.first_frame_at = self.last_frame_at
+        self.frame_count += 1
+
+    def close(self):
+        """
+        標準入力を閉じてエンコードの完了を待つ。
+
+        Returns:
+            str: 出力したセグメントファイルのパス。
+        """
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+        return self.segment_path
+
+    def abort(self):
+        """エンコードを中断し、書きかけのセグメントファイルを削除する。"""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        if os.path.exists(self.segment_path):
+            os.remove(self.segment_path)
+
+
+class HLSSegmentWriter(SegmentWriter):
+    def __init__(self, output_dir, resolutions, width, height, fps, video_bitrate, start_index, segment_count,
+                 segment_time=SEGMENT_DURATION, pix_fmt="bgr24"):
+        """
+        合成フレームを1回のエンコードで全画質のHLSセグメントに書き出すライター（direct モード）。
+
+        中間の segment_XXXX.mp4 を作らず、標準入力の生フレームを split / scale で各解像度に分岐して
+        libx264 でエンコードする。セグメントは作業ディレクトリに書き出し、close() で各画質の
+        ディレクトリへ移す。
+
+        Args:
+            output_dir (str): HLSファイルの出力ディレクトリ。
+            resolutions (list): 解像度のリスト (width, height)。
+            width (int): 合成フレームの幅。
+            height (int): 合成フレームの高さ。
+            fps (int): フレームレート。
+            video_bitrate (str | int): HLS各画質の基準となるビットレート（例: "3000k"）。
+            start_index (int): 予約済みの先頭HLSセグメント番号（全画質で共通）。
+            segment_count (int): 予約したHLSセグメント数。
+            segment_time (float): 各HLSセグメントの時間（秒）。
+            pix_fmt (str): 書き込むフレームのピクセルフォーマット。
+        """
+        self.output_dir = output_dir
+        self.start_index = start_index
+        self.segment_count = segment_count
+        # close() 後に各画質の (セグメントのファイル名, 長さ（秒）) のリストが入る
+        self.segments = None
+        self.segment_path = hls_staging_dir(output_dir, start_index)
+        os.makedirs(self.segment_path, exist_ok=True)
+
+        self.levels, output_args = hls_rendition_args(
+            resolutions, video_bitrate, self.segment_path, start_index, hls_run_id(output_dir, segment_time),
+            segment_time, fps
+        )
+        self._start(width, height, fps, pix_fmt, output_args)
+
+    def close(self):
+        """
+        エンコードの完了を待ち、完成したセグメントを各画質のディレクトリへ移す。
+
+        Returns:
+            str: HLSファイルの出力ディレクトリ。
+        """
+        try:
+            super().close()
+        except Exception:
+            shutil.rmtree(self.segment_path, ignore_errors=True)
+            raise
+        self.segments = collect_hls_renditions(self.output_dir, self.segment_path, self.levels)
+        return self.output_dir
+
+    def abort(self):
+        """エンコードを中断し、作業ディレクトリを削除する。"""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        shutil.rmtree(self.segment_path, ignore_errors=True)
@@ -3,85 +3,182 @@ import os
 import subprocess
 import traceback
 import json
-from src.server.hls_server import get_video_bitrate, create_hls_with_dynamic_bitrate
+from src.server.hls_server import (
+    get_video_bitrate, create_hls_with_dynamic_bitrate, HLS_RESOLUTIONS, SEGMENT_DURATION,
+    hls_rendition_bitrates, hls_segment_count, reserve_segment_indices, publish_hls_renditions
+)
+from src.server.segment_writer import SegmentWriter, HLSSegmentWriter
 
-frame_buffer = []
+segment_writer = None
+segment_frame_count = 0
 segment_index = 0
 
 
-def frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir="segments/segmented_video", segment_duration=6):
+def frame_segmented(combined_frame, input_frame, video_bitrate, fps, segment_dir="segments/segmented_video",
+                    segment_duration=SEGMENT_DURATION, encoder=None, direct_hls=False, hls_output_dir="segments/hls_file",
+                    latency_meter=None, encoder_bitrate=None):
     """
     合成フレームをセグメント化し、H.264形式でエンコードして保存します。
 
+    フレームは受け取った時点で ffmpeg（libx264）の標準入力へ書き込むため、呼び出し後に
+    combined_frame を再利用（VideoStreaming の出力フレームの上書きなど）しても問題ありません。
+    x264 のビットレートはエンコーダの起動時（セグメントの先頭フレーム）に決まるため、
+    encoder_bitrate（直前のセグメント全体の視線軌跡から求めたビットレート）を使います。
+    HLS生成にはセグメント完成時点の video_bitrate を使います。
+    encoder（SegmentEncodeService）を渡した場合、完成したセグメントの終了待ちとHLS生成は
+    バックグラウンドのワーカーで行い、キューが満杯のときだけ待ちます。
+    direct_hls=True では segment_XXXX.mp4 を作らず、合成フレームを1回のエンコードで
+    全画質のHLSセグメントとして書き出します（HLSSegmentWriter）。
+    最後の規定数に満たないセグメントは、フレームループの終了後に finish_segments で保存します。
+
     Args:
         combined_frame (np.ndarray): 合成されたフレーム。
         input_frame (int): 1セグメントあたりのフレーム数。
         video_bitrate (str): ビットレート（例: "3000k"）。
         fps (int): 動画のフレームレート。
         segment_dir (str): セグメントファイルを保存するディレクトリ。
-        segment_duration (int): セグメントの長さ（秒単位）。
+        segment_duration (float): セグメントの長さ（秒単位）。1セグメントのフレーム数、GOP、
+            HLSのセグメント長と EXT-X-TARGETDURATION はすべてこの値で決まる。
+        encoder (SegmentEncodeService, optional): セグメントのエンコードを任せるサービス。
+        direct_hls (bool): 合成フレームを直接HLSとしてエンコードする。
+        hls_output_dir (str): HLSファイルの出力ディレクトリ。
+        latency_meter (PlaylistLatencyMeter, optional): 公開時に glass-to-playlist レイテンシを記録する。
+        encoder_bitrate (str, optional): セグメントを始めるときに x264 に渡すビットレート。
+            None（最初のセグメント）の場合はその時点の video_bitrate を使う。
+
+    Returns:
+        bool: このフレームでセグメントが完成したか。
     """
-    global frame_buffer, segment_index
+    global segment_writer, segment_frame_count
 
-    # セグメントディレクトリを作成
+    # セグメントディレクトリを作成（direct モードでは mp4 を書き出さない）
     segment_dir = os.path.abspath(segment_dir)
-    os.makedirs(segment_dir, exist_ok=True)
+    if not direct_hls:
+        os.makedirs(segment_dir, exist_ok=True)
+
+    frames_per_segment = max(1, round(fps * segment_duration))
 
-    thirty_sec = fps * 30
+    segment_path = os.path.join(segment_dir, f"segment_{segment_index:04d}.mp4")
+    if encoder_bitrate is None:
+        encoder_bitrate = video_bitrate
 
-    frame_buffer.append(combined_frame)
+    try:
+        # セグメントの先頭フレームでエンコーダを起動し、以降は逐次書き込む
+        if segment_writer is None:
+            height, width, _ = combined_frame.shape
+            if direct_hls:
+                # エンコーダの -start_number に渡すため、HLSのセグメント番号を先に予約する
+                levels = list(hls_rendition_bitrates(encoder_bitrate))[:len(HLS_RESOLUTIONS)]
+                segment_count = hls_segment_count(frames_per_segment, fps, segment_duration)
+                start_index = reserve_segment_indices(hls_output_dir, levels, segment_count, segment_duration)
+                segment_writer = HLSSegmentWriter(hls_output_dir, HLS_RESOLUTIONS, width, height, fps, encoder_bitrate,
+                                                  start_index, segment_count, segment_duration)
+            else:
+                segment_writer = SegmentWriter(segment_path, width, height, fps, encoder_bitrate)
+        segment_writer.write(combined_frame)
+        segment_frame_count += 1
+    except Exception as e:
+        print(f"セグメント保存エラー: {segment_path}")
+        print(traceback.format_exc())
+        _reset_segment_writer(abort=True)
+        return False
 
     # フレームが規定数に達したらセグメントを保存
-    if len(frame_buffer) >= thirty_sec:
-        segment_path = os.path.join(segment_dir, f"segment_{segment_index:04d}.mp4")
-        temp_raw_file = os.path.join(segment_dir, f"segment_{segment_index:04d}_raw.mp4")
+    if segment_frame_count >= frames_per_segment:
+        return _save_segment(video_bitrate, fps, segment_duration, encoder, direct_hls, hls_output_dir, latency_meter)
+
+    return False
 
+def finish_segments(video_bitrate, fps, segment_duration=SEGMENT_DURATION, encoder=None, direct_hls=False,
+                    hls_output_dir="segments/hls_file", latency_meter=None):
+    """
+    フレームループの終了時に、規定数に満たない書き込み中のセグメントを保存する。
+
+    encoder がある場合はキューに積み（公開は encoder.close() で待つ）、ない場合は
+    エンコードの完了を待って公開する。フレームを1枚も書いていないライターは破棄する。
+    encoder.close() と PlaylistManager.finish() より前に呼ぶこと。
+
+    Args:
+        video_bitrate (str): HLS生成に使うビットレート（最後のセグメントの視線軌跡から求めた値）。
+        fps (int): 動画のフレームレート。
+        segment_duration (float): セグメントの長さ（秒単位）。
+        encoder (SegmentEncodeService, optional): セグメントのエンコードを任せるサービス。
+        direct_hls (bool): 合成フレームを直接HLSとしてエンコードする。
+        hls_output_dir (str): HLSファイルの出力ディレクトリ。
+        latency_meter (PlaylistLatencyMeter, optional): 公開時に glass-to-playlist レイテンシを記録する。
+
+    Returns:
+        bool: セグメントを保存したか。
+    """
+    if segment_writer is None:
+        return False
+    if segment_frame_count == 0:
+        _reset_segment_writer(abort=True)
+        return False
+    return _save_segment(video_bitrate, fps, segment_duration, encoder, direct_hls, hls_output_dir, latency_meter)
+
+def _save_segment(video_bitrate, fps, segment_duration, encoder, direct_hls, hls_output_dir, latency_meter):
+    """書き込み中のセグメントを閉じてHLSとして公開する（encoder があればキューに積む）。"""
+    global segment_writer, segment_index
+
+    writer = segment_writer
+    segment_path = writer.segment_path
+    if encoder is not None:
+        # 終了待ちとHLS生成はワーカーに任せ、すぐにフレームループへ戻る
+        encoder.submit(segment_index, writer, video_bitrate, fps)
+        segment_writer = None
+        _reset_segment_writer()
+        segment_index += 1
+        return True
+
+    try:
+        # エンコードの完了を待つ
+        writer.close()
+        segment_writer = None
+
+        if direct_hls:
+            publish_hls_renditions(hls_output_dir, writer.segments, segment_duration)
+            print(f"HLSファイルを生成しました: {hls_output_dir}")
+            if latency_meter is not None:
+                latency_meter.record(segment_index, writer)
+            _reset_segment_writer()
+            segment_index += 1
+            return True
+
+        print(f"セグメントを保存しました: {segment_path}")
+
+        # HLS生成
         try:
-            # OpenCVを使用して一時ファイルを作成
-            height, width, _ = frame_buffer[0].shape
-            out = cv2.VideoWriter(temp_raw_file, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
-            for frame in frame_buffer:
-                out.write(frame)
-            out.release()
-
-            print(f"未エンコードセグメントを保存しました: {temp_raw_file}")
-
-            # FFmpegを使用してエンコード
-            video_bitrate_str = f"{video_bitrate}k" if isinstance(video_bitrate, int) else video_bitrate
-            ffmpeg_command = [
-                "ffmpeg", "-y", "-i", temp_raw_file,
-                "-c:v", "libx264", "-preset", "fast",
-                "-b:v", video_bitrate_str, "-maxrate", video_bitrate_str,
-                "-bufsize", "3M", segment_path
-            ]
-            subprocess.run(ffmpeg_command, check=True)
-
-            print(f"セグメントを保存しました: {segment_path}")
-
-            # 一時ファイルを削除
-            os.remove(temp_raw_file)
-
-            # HLS生成
-            try:
-                hls_output_dir = "segments/hls_file"
-                resolutions = [(640, 360), (1280, 720), (1920, 1080)]  # 解像度リスト
-                create_hls_with_dynamic_bitrate(segment_path, hls_output_dir, resolutions, video_bitrate)
+            segment_count = hls_segment_count(writer.frame_count, fps, segment_duration)
+            if create_hls_with_dynamic_bitrate(segment_path, hls_output_dir, HLS_RESOLUTIONS, video_bitrate,
+                                               segment_duration, segment_count, fps):
                 print(f"HLSファイルを生成しました: {hls_output_dir}")
-            except Exception as e:
-                print(f'Video Encoding for HLS failed: {e}')
-                
+                if latency_meter is not None:
+                    latency_meter.record(segment_index, writer)
         except Exception as e:
-            print(f"セグメント保存エラー: {segment_path}")
-            print(traceback.format_exc())
-            frame_buffer.clear()
-            return False
+            print(f'Video Encoding for HLS failed: {e}')
+            
+    except Exception as e:
+        print(f"セグメント保存エラー: {segment_path}")
+        print(traceback.format_exc())
+        _reset_segment_writer(abort=True)
+        return False
 
-        # フレームバッファをクリアし、次のセグメントの準備
-        frame_buffer.clear()
-        segment_index += 1
-        return True
+    # 次のセグメントの準備
+    _reset_segment_writer()
+    segment_index += 1
+    return True
 
-    return False
+def _reset_segment_writer(abort=False):
+    """書き込み中のセグメントを閉じ（abort=True なら破棄し）、フレーム数をリセットする。"""
+    global segment_writer, segment_frame_count
+    if segment_writer is not None:
+        if abort:
+            segment_writer.abort()
+        else:
+            segment_writer.close()
+        segment_writer = None
+    segment_frame_count = 0
 
 def get_video_frame_count(input_video):
     """
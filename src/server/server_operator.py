@@ -3,24 +3,51 @@
 最も好ましい。しかし、現在は全てのフレームを参照するようになっている。
 """
 
-import cv2
 import os
 import random
 import numpy as np
-from src.server.foveated_compression import merge_frame, calculate_segment_bitrate
-from src.server.server_function import frame_segmented
-from src.server.hls_server import get_video_bitrate
+from src.server.foveated_compression import merge_tier_frames, SegmentBitrateMeter
+from src.server.foveation_profile import DEFAULT_PROFILE, get_profile
+from src.server.server_function import frame_segmented, finish_segments
+from src.server.segment_encoder import SegmentEncodeService
+from src.server.tier_reader import TierReader
+from src.server.frame_source import open_frame_source
+from src.server.hls_server import get_video_bitrate, SEGMENT_DURATION, HLS_RESOLUTIONS
+from src.server.ll_hls import LLHLSWriter, PART_DURATION
+from src.server.playlist_manager import open_playlist_manager
+from src.server.playlist_latency import PlaylistLatencyMeter
 from src.server.gaze_prediction import GazeEstimator
-from src.client.playback.logger import VideoLogger
+from src.server.gaze_trajectory import GazeTrajectory
+from src.server.saliency import SaliencyPredictor, SALIENCY_LAMBDA_E
+from src.client.playback.logger import GazeLogger
 from src.bar_making import ProgressBar
 
 class VideoStreaming:
-    def __init__(self, input_video, input_frame, low_res_path, med_res_path, high_res_path, window_width, window_height):
-        self.low_cap = cv2.VideoCapture(low_res_path)
-        self.med_cap = cv2.VideoCapture(med_res_path)
-        self.high_cap = cv2.VideoCapture(high_res_path)
+    def __init__(self, input_video, input_frame, low_res_path, med_res_path, high_res_path, window_width, window_height,
+                 reuse_output_frame=False, blend="hard", profile=DEFAULT_PROFILE, tier_paths=None,
+                 prefetch_depth=0, frame_source="opencv", decoder_threads=0, encode_workers=0, encode_queue=4,
+                 direct_hls=False, segment_duration=SEGMENT_DURATION, ll_hls=False, part_duration=PART_DURATION,
+                 playlist_mode="event", playlist_window=6, gaze_log_text=False, gaze_search="grid",
+                 gaze_trajectory=None, gaze_saliency=False):
+        # 階層構成（外側から内側）と各階層の動画。tier_paths 未指定時は low, med, high の3階層。
+        # profile は FoveationProfile またはその名前（"multi_resolution" では周辺の階層を低い解像度で読む）
+        self.profile = get_profile(profile)
+        if tier_paths is None:
+            tier_paths = (low_res_path, med_res_path, high_res_path)
+        if len(tier_paths) != len(self.profile):
+            raise ValueError(f"Profile has {len(self.profile)} tiers but {len(tier_paths)} videos were given")
+        # frame_source="ffmpeg" では ffmpeg の rawvideo 出力を事前確保した配列に直接読み込む
+        self.tier_caps = [
+            open_frame_source(path, backend=frame_source, threads=decoder_threads)
+            for path in tier_paths
+        ]
+        self.reuse_tier_buffers = reuse_output_frame or frame_source == "ffmpeg"
+
+        # 0より大きい場合は各階層を別スレッドで先読みデコードする
+        self.prefetch_depth = prefetch_depth
         self.input_frame = input_frame
-        self.gaze_log = VideoLogger(log_dir="logs/gaze_prediction")
+        # 視線はリングバッファに記録し、バックグラウンドでバイナリ（gaze_log_text=True ならテキストも）に書き出す
+        self.gaze_log = GazeLogger(log_dir="logs/gaze_prediction", text=gaze_log_text)
         self.progress_bar = ProgressBar(input_frame=self.input_frame)
 
         self.window_width = window_width
@@ -32,7 +59,44 @@ class VideoStreaming:
         self.fps = 30
         self.frame_counter = 0
 
-        self.gaze_estimator = GazeEstimator(self.window_width, self.window_height)
+        # セグメントの長さ（秒）。フレーム数、GOP、HLSのセグメント長をすべてこの値で決める
+        self.segment_duration = segment_duration
+        # 各画質のプレイリスト（"event" は全セグメントを追記、"sliding" は直近 playlist_window 個だけを載せる）
+        self.playlist_manager = open_playlist_manager("segments/hls_file", segment_duration, playlist_mode, playlist_window)
+
+        # 合成からプレイリスト公開までの時間を計測する（LL-HLS ではパートごとに記録するため表示しない）
+        self.latency_meter = PlaylistLatencyMeter(verbose=not ll_hls)
+
+        # 0より大きい場合はセグメントのエンコードとHLS生成をバックグラウンドのワーカーで行う
+        self.segment_encoder = None
+        if encode_workers > 0:
+            self.segment_encoder = SegmentEncodeService(workers=encode_workers, max_pending=encode_queue,
+                                                        segment_time=segment_duration, latency_meter=self.latency_meter)
+
+        # True の場合は中間の mp4 を作らず、合成フレームを直接HLSの各画質にエンコードする
+        self.direct_hls = direct_hls
+
+        # True の場合はストリーム全体を1本の ffmpeg でエンコードし、LL-HLS のパートとして公開する
+        self.ll_hls = ll_hls
+        self.part_duration = part_duration
+        self.ll_hls_writer = None
+
+        # 事前確保した1枚の出力フレームに毎フレーム合成する（定常状態でメモリ確保なし）。
+        # SegmentWriter / LLHLSWriter の write() は戻る前にフレームを ffmpeg のパイプへ書き終えるため、
+        # 次のフレームで同じバッファを上書きしてよい（複数枚のリングは不要）
+        self.reuse_output_frame = reuse_output_frame
+        self.output_frame = None
+
+        # 円の境界の合成方法（"hard" または固定小数点の "soft"）
+        self.blend = blend
+
+        # セグメント内の視線軌跡から求めるビットレート
+        self.bitrate_meter = SegmentBitrateMeter(self.window_width, self.window_height, self.profile)
+        # 次のセグメントのエンコーダに渡すビットレート（直前のセグメント全体の軌跡から求めた値）
+        self.encoder_bitrate = None
+
+        # 視線の探索方法（"grid" は 100px 間隔の候補全体、"hierarchical" は粗いグリッドから1px精度まで細かくする）
+        self.gaze_estimator = GazeEstimator(self.window_width, self.window_height, search_mode=gaze_search)
         self.boundary_points = [
             (50, 50), 
             (self.window_width - 50, 50), 
@@ -42,6 +106,25 @@ class VideoStreaming:
         self.obstacle_points = self.generate_random_obstacles()
         self.current_vector = (1, 0)
         self.last_gaze_position = (self.window_width // 2, self.window_height // 2)
+
+        # True の場合はランダムな障害物の代わりに、低画質の階層（最も外側）のフレームから求めた顕著点を使う
+        self.saliency = None
+        if gaze_saliency:
+            self.saliency = SaliencyPredictor(self.window_width, self.window_height)
+            self.gaze_estimator.lambda_e = SALIENCY_LAMBDA_E
+
+        # 事前に計算した視線の軌跡（gaze_trajectory.py の .npy）。指定した場合は GazeEstimator を呼ばず、
+        # フレーム番号で視線を読む
+        self.gaze_trajectory = None
+        if gaze_trajectory is not None:
+            self.gaze_trajectory = GazeTrajectory(gaze_trajectory)
+            planned_size = (self.gaze_trajectory.metadata.get("window_width"), self.gaze_trajectory.metadata.get("window_height"))
+            if planned_size != (None, None) and planned_size != (self.window_width, self.window_height):
+                raise ValueError(f"Gaze trajectory {gaze_trajectory} was planned for {planned_size[0]}x{planned_size[1]}, "
+                                 f"not {self.window_width}x{self.window_height}")
+            if len(self.gaze_trajectory) < self.input_frame:
+                print(f"Gaze trajectory has {len(self.gaze_trajectory)} frames for {self.input_frame}; "
+                      f"the last gaze position is held after that.")
     
     def generate_random_obstacles(self):
         """ランダムに障害物のポイントを生成"""
@@ -54,53 +137,160 @@ class VideoStreaming:
             for _ in range(num_obstacles)
         ]
     
+    def _read_tiers(self, frames):
+        """全階層のフレームをメインスレッドで順にデコードする。"""
+        ret = True
+        for index, cap in enumerate(self.tier_caps):
+            if self.reuse_tier_buffers:
+                # 前フレームの配列をデコード先として再利用
+                ret_tier, frames[index] = cap.read(frames[index])
+            else:
+                ret_tier, frames[index] = cap.read()
+            ret = ret and ret_tier
+        return ret, frames
+
     def run(self):
+        reader = None
+        if self.prefetch_depth > 0:
+            reader = TierReader(self.tier_caps, depth=self.prefetch_depth, reuse_buffers=self.reuse_tier_buffers)
+
+        frames = [None] * len(self.tier_caps)
         while self.frame_counter < self.input_frame:
-            ret_low, frame_low = self.low_cap.read()
-            ret_med, frame_med = self.med_cap.read()
-            ret_high, frame_high = self.high_cap.read()
+            if reader is not None:
+                ret, _, frames = reader.read()
+            else:
+                ret, frames = self._read_tiers(frames)
 
-            if not (ret_low and ret_med and ret_high):
+            if not ret:
                 break
 
+            out = None
+            if self.reuse_output_frame:
+                if self.output_frame is None:
+                    shape = (self.window_height, self.window_width) + frames[0].shape[2:]
+                    self.output_frame = np.empty(shape, dtype=frames[0].dtype)
+                out = self.output_frame
 
-            # フレームごとに障害物を更新（適切な頻度で更新）
-            if self.frame_counter % 10 == 0:
-                self.obstacle_points = self.generate_random_obstacles()
+            if self.gaze_trajectory is not None:
+                # 事前に計算した軌跡から読む
+                gaze_x, gaze_y = self.gaze_trajectory.position(self.frame_counter)
+            else:
+                if self.saliency is not None:
+                    # 低画質の階層のサムネイルから顕著度を更新し、顕著点を障害物として使う
+                    self.saliency.update(frames[0])
+                    self.obstacle_points = self.saliency.interest_points()
+                # フレームごとに障害物を更新（適切な頻度で更新）
+                elif self.frame_counter % 10 == 0:
+                    self.obstacle_points = self.generate_random_obstacles()
 
-            # 視線予測
-            gaze_x, gaze_y = self.gaze_estimator.generate_gaze_position(
-                self.last_gaze_position, 
-                self.boundary_points, 
-                self.obstacle_points, 
-                self.current_vector
-            )
+                # 視線予測
+                gaze_x, gaze_y = self.gaze_estimator.generate_gaze_position(
+                    self.last_gaze_position, 
+                    self.boundary_points, 
+                    self.obstacle_points, 
+                    self.current_vector
+                )
 
             self.last_gaze_position = (gaze_x, gaze_y)
-            self.gaze_log.log_gaze_position(gaze_x, gaze_y)
+            self.gaze_log.log_gaze_position(gaze_x, gaze_y, self.frame_counter)
+            self.bitrate_meter.add(gaze_x, gaze_y)
 
             try:
-                combined_frame = merge_frame(frame_low, frame_med, frame_high, gaze_x, gaze_y)
+                combined_frame = merge_tier_frames(
+                    frames, gaze_x, gaze_y, self.profile, out=out, blend=self.blend,
+                    size=(self.window_height, self.window_width)
+                )
             except Exception as e:
                 print(f"Error during frame merging: {e}\n")
                 break
             
-            if self.frame_counter == 0:
-                self.video_bitrate = calculate_segment_bitrate(self.window_width, self.window_height)
-                
-            frame_segmented(combined_frame, self.input_frame, self.video_bitrate, self.fps, self.segment_dir)
+            # セグメントが完成したら次のセグメントの軌跡を積算し直す
+            self.video_bitrate = self.bitrate_meter.bitrate()
+            if self.ll_hls:
+                try:
+                    segment_completed = self._write_ll_hls(combined_frame)
+                except Exception as e:
+                    print(f"Error during LL-HLS encoding: {e}\n")
+                    break
+            else:
+                segment_completed = frame_segmented(
+                    combined_frame, self.input_frame, self.video_bitrate, self.fps, self.segment_dir,
+                    segment_duration=self.segment_duration, encoder=self.segment_encoder,
+                    direct_hls=self.direct_hls, latency_meter=self.latency_meter,
+                    encoder_bitrate=self.encoder_bitrate
+                )
+            if segment_completed:
+                self.encoder_bitrate = self.video_bitrate
+                self.bitrate_meter.reset()
+
+            if reader is not None:
+                reader.release(frames)
 
             self.frame_counter += 1
             #self.progress_bar.update(self.frame_counter)
 
-        self.low_cap.release()
-        self.med_cap.release()
-        self.high_cap.release()
+        if reader is not None:
+            reader.close()
+        for cap in self.tier_caps:
+            cap.release()
+        if self.ll_hls_writer is not None:
+            try:
+                self.ll_hls_writer.close()
+            except Exception as e:
+                print(f"Error while finishing LL-HLS output: {e}")
+        if not self.ll_hls:
+            # 規定数に満たない最後のセグメントも、エンコーダの停止とプレイリストの終了より前に公開する
+            finish_segments(self.bitrate_meter.bitrate(), self.fps, segment_duration=self.segment_duration,
+                            encoder=self.segment_encoder, direct_hls=self.direct_hls, latency_meter=self.latency_meter)
+        if self.segment_encoder is not None:
+            failures = self.segment_encoder.close()
+            for segment, error in sorted(failures.items()):
+                print(f"Segment {segment} failed: {error}")
+        # 配信の終了をプレイヤーに伝える
+        self.playlist_manager.finish()
+        self.gaze_log.close()
+        self.latency_meter.report()
+
+    def _write_ll_hls(self, combined_frame):
+        """
+        合成フレームを LL-HLS のライターに渡す。最初のフレームでライターを起動する。
+        最初のセグメントは最初のフレームまでの視線軌跡のビットレートを使い、以降は frame_segmented と同様に
+        直前のセグメント全体の視線軌跡のビットレートを次のセグメントに使う。
+
+        Returns:
+            bool: このフレームでセグメントが完成した場合は True。
+        """
+        if self.ll_hls_writer is None:
+            height, width = combined_frame.shape[:2]
+            self.ll_hls_writer = LLHLSWriter(
+                "segments/hls_file", HLS_RESOLUTIONS, width, height, self.fps, self.video_bitrate,
+                segment_duration=self.segment_duration, part_duration=self.part_duration,
+                latency_meter=self.latency_meter
+            )
+        self.ll_hls_writer.write(combined_frame)
+        if self.ll_hls_writer.frame_count % self.ll_hls_writer.frames_per_segment == 0:
+            self.ll_hls_writer.set_bitrate(self.video_bitrate)
+            return True
+        return False
 
 
-def start_video_streaming(input_video, input_flame, low_res_path, med_res_path, high_res_path, window_width, window_height):
+def start_video_streaming(input_video, input_flame, low_res_path, med_res_path, high_res_path, window_width, window_height,
+                          reuse_output_frame=False, blend="hard", profile=DEFAULT_PROFILE, tier_paths=None,
+                          prefetch_depth=0, frame_source="opencv", decoder_threads=0, encode_workers=0, encode_queue=4,
+                          direct_hls=False, segment_duration=SEGMENT_DURATION, ll_hls=False, part_duration=PART_DURATION,
+                          playlist_mode="event", playlist_window=6, gaze_log_text=False, gaze_search="grid",
+                          gaze_trajectory=None, gaze_saliency=False):
     """
     VideoStreaming の実行
     """
-    video_streaming = VideoStreaming(input_video, input_flame, low_res_path, med_res_path, high_res_path, window_width, window_height)
+    video_streaming = VideoStreaming(input_video, input_flame, low_res_path, med_res_path, high_res_path, window_width, window_height,
+                                     reuse_output_frame=reuse_output_frame, blend=blend, profile=profile, tier_paths=tier_paths,
+                                     prefetch_depth=prefetch_depth, frame_source=frame_source,
+                                     decoder_threads=decoder_threads,
+                                     encode_workers=encode_workers, encode_queue=encode_queue,
+                                     direct_hls=direct_hls, segment_duration=segment_duration,
+                                     ll_hls=ll_hls, part_duration=part_duration,
+                                     playlist_mode=playlist_mode, playlist_window=playlist_window,
+                                     gaze_log_text=gaze_log_text, gaze_search=gaze_search,
+                                     gaze_trajectory=gaze_trajectory, gaze_saliency=gaze_saliency)
     video_streaming.run()
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+各階層の動画を別スレッドで先読みデコードするリーダー。
+
+low_cap.read(), med_cap.read(), high_cap.read() をメインスレッドで順に呼ぶと、
+合成を始める前に3本分のH.264デコードが直列に実行される。cv2.VideoCapture.read() は
+デコード中にGILを解放するため、階層ごとにスレッドを立てて上限付きのキューへ先読みすれば、
+1フレームあたりのデコード時間は3本の合計ではなく最も遅い1本に近づく。
+"""
+import queue
+import threading
+
+_END = object()
+
+
+class TierReader:
+    def __init__(self, captures, depth=4, reuse_buffers=False):
+        """
+        Args:
+            captures (Sequence[cv2.VideoCapture]): 外側から内側へ並べた各階層のキャプチャ。
+            depth (int): 階層ごとの先読みキューの上限（フレーム数）。
+            reuse_buffers (bool): release() で返却されたフレーム配列をデコード先として再利用する。
+        """
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1")
+        self.captures = list(captures)
+        self.depth = depth
+        self.reuse_buffers = reuse_buffers
+        self._queues = [queue.Queue(maxsize=depth) for _ in self.captures]
+        self._free = [queue.Queue() for _ in self.captures]
+        self._stop = threading.Event()
+        self._finished = False
+        self._threads = [
+            threading.Thread(target=self._decode, args=(tier, capture), daemon=True)
+            for tier, capture in enumerate(self.captures)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _decode(self, tier, capture):
+        """1階層分のデコードループ。ストリーム終端または停止要求で終了する。"""
+        frame_queue = self._queues[tier]
+        index = 0
+        try:
+            while not self._stop.is_set():
+                buffer = None
+                if self.reuse_buffers:
+                    try:
+                        buffer = self._free[tier].get_nowait()
+                    except queue.Empty:
+                        pass
+                ret, frame = capture.read(buffer) if buffer is not None else capture.read()
+                if not ret:
+                    break
+                if not self._put(frame_queue, (index, frame)):
+                    return
+                index += 1
+        except Exception as e:
+            print(f"Error decoding tier {tier}: {e}")
+        self._put(frame_queue, _END)
+
+    def _put(self, frame_queue, item):
+        """停止要求を確認しながらキューに積む。停止された場合は False。"""
+        while not self._stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self):
+        """
+        全階層の同じフレーム番号のフレームを取得する。
+
+        Returns:
+            Tuple[bool, int, list]: (成功したか, フレーム番号, 外側から内側へ並べたフレーム)。
+            いずれかのストリームが終端に達した場合は (False, None, None)。
+        """
+        if self._finished:
+            return False, None, None
+
+        items = [frame_queue.get() for frame_queue in self._queues]
+        if any(item is _END for item in items):
+            self._finished = True
+            self.close()
+            return False, None, None
+
+        indices = {index for index, _ in items}
+        if len(indices) != 1:
+            raise RuntimeError(f"Tier streams are out of sync: frame indices {sorted(indices)}")
+        return True, items[0][0], [frame for _, frame in items]
+
+    def release(self, frames):
+        """合成が終わったフレームをデコード先として返却する（reuse_buffers=True のとき）。"""
+        if not self.reuse_buffers:
+            return
+        for free, frame in zip(self._free, frames):
+            if free.qsize() < self.depth + 1:
+                free.put(frame)
+
+    def __iter__(self):
+        while True:
+            ret, index, frames = self.read()
+            if not ret:
+                return
+            yield index, frames
+
+    def close(self):
+        """デコードスレッドを停止し、キューを空にしてから終了を待つ。"""
+        self._stop.set()
+        for frame_queue in self._queues:
+            while True:
+                try:
+                    frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,74 @@
+import glob
+import shutil
+import cv2
+import numpy as np
+import pytest
+from src.server.foveated_compression import merge_tier_frames
+from src.server.foveation_profile import MULTI_RESOLUTION_PROFILE, get_profile
+
+WINDOW_WIDTH, WINDOW_HEIGHT = 1280, 720
+# 外側から内側の階層ごとの画素値（合成後にどの階層の画素かを見分けるため）
+TIER_VALUES = (10, 100, 200)
+
+
+def tier_frames(profile):
+    """各階層の縮小率どおりの大きさで、階層ごとに一様な値のフレームを作る。"""
+    frames = []
+    for tier, value in zip(profile, TIER_VALUES):
+        width, height = tier.frame_size(WINDOW_WIDTH, WINDOW_HEIGHT)
+        frames.append(np.full((height, width, 3), value, dtype=np.uint8))
+    return frames
+
+
+def test_get_profile_by_name():
+    assert get_profile("multi_resolution") is MULTI_RESOLUTION_PROFILE
+    assert get_profile(MULTI_RESOLUTION_PROFILE) is MULTI_RESOLUTION_PROFILE
+    with pytest.raises(ValueError):
+        get_profile("unknown")
+
+
+def test_composite_scaled_profile():
+    frames = tier_frames(MULTI_RESOLUTION_PROFILE)
+    assert [frame.shape[1] for frame in frames] == [640, 908, 1280]
+
+    out = np.empty((WINDOW_HEIGHT, WINDOW_WIDTH, 3), dtype=np.uint8)
+    gaze_x, gaze_y = 640, 360
+    combined = merge_tier_frames(frames, gaze_x, gaze_y, MULTI_RESOLUTION_PROFILE, out=out,
+                                 size=(WINDOW_HEIGHT, WINDOW_WIDTH))
+
+    assert combined is out
+    med_radius, high_radius = MULTI_RESOLUTION_PROFILE.radii
+    assert (combined[gaze_y, gaze_x] == 200).all()
+    assert (combined[gaze_y, gaze_x + (med_radius + high_radius) // 2] == 100).all()
+    assert (combined[0, 0] == 10).all()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is required to encode segments")
+def test_mp4_create_scaled_profile(tmp_path, monkeypatch):
+    from src.server import mp4_creater
+
+    monkeypatch.chdir(tmp_path)
+    frame_count = 15
+    paths = []
+    for tier, frame in zip(MULTI_RESOLUTION_PROFILE, tier_frames(MULTI_RESOLUTION_PROFILE)):
+        path = str(tmp_path / f"{tier.name}.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (frame.shape[1], frame.shape[0]))
+        for _ in range(frame_count):
+            writer.write(frame)
+        writer.release()
+        paths.append(path)
+
+    mp4_creater.mp4_create(None, frame_count, "1000k", *paths, WINDOW_WIDTH, WINDOW_HEIGHT,
+                           segment_duration=frame_count / 30, profile="multi_resolution")
+
+    segments = sorted(glob.glob(str(tmp_path / "segments" / "segmented_video" / "segment_*.mp4")))
+    assert segments
+    cap = cv2.VideoCapture(segments[-1])
+    ret, frame = cap.read()
+    cap.release()
+    assert ret
+    assert frame.shape[:2] == (WINDOW_HEIGHT, WINDOW_WIDTH)
+    # 合成後のフレームに全階層の画素が含まれる（圧縮による誤差を許す）
+    gray = frame.mean(axis=2)
+    for value in TIER_VALUES:
+        assert (np.abs(gray - value) < 12).any()
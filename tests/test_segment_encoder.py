@@ -0,0 +1,62 @@
+import pytest
+from src.server import segment_encoder
+from src.server.segment_encoder import SegmentEncodeService
+from src.server.segment_writer import HLSSegmentWriter
+
+
+class FinishedWriter(HLSSegmentWriter):
+    """エンコード済みの direct モードのライターの代わり（ffmpeg を起動しない）。"""
+    def __init__(self, index):
+        self.segment_path = f"job-{index}"
+        self.levels = ["low"]
+        self.start_index = index
+        self.segment_count = 1
+        self.segments = {"low": [(f"segment-low-{index:03d}.ts", 1.0)]}
+        self.frame_count = 30
+
+    def close(self):
+        return self.segment_path
+
+    def abort(self):
+        pass
+
+
+@pytest.fixture
+def published_renditions(monkeypatch):
+    renditions = []
+    monkeypatch.setattr(segment_encoder, "publish_hls_renditions",
+                        lambda output_dir, segments, segment_time: renditions.append(segments))
+    return renditions
+
+
+def test_publish_error_does_not_stop_worker(published_renditions):
+    def on_published(job):
+        if job.segment_index == 1:
+            raise RuntimeError("listener failed")
+
+    encoder = SegmentEncodeService(workers=1, on_published=on_published)
+    for index in range(4):
+        encoder.submit(index, FinishedWriter(index), "1000k", 30)
+    failures = encoder.close()
+
+    # プレイリストへの追加は済んでいるため公開済みのまま、通知の失敗だけを記録する
+    assert encoder.published == [0, 1, 2, 3]
+    assert list(failures) == [1]
+    assert isinstance(failures[1], RuntimeError)
+    assert len(published_renditions) == 4
+
+
+def test_publish_error_keeps_order_with_several_workers(published_renditions, monkeypatch):
+    def publish(output_dir, segments, segment_time):
+        if "segment-low-000.ts" == segments["low"][0][0]:
+            raise OSError("playlist write failed")
+        published_renditions.append(segments)
+
+    monkeypatch.setattr(segment_encoder, "publish_hls_renditions", publish)
+    encoder = SegmentEncodeService(workers=2)
+    for index in range(5):
+        encoder.submit(index, FinishedWriter(index), "1000k", 30)
+    failures = encoder.close()
+
+    assert encoder.published == [1, 2, 3, 4]
+    assert list(failures) == [0]